@@ -0,0 +1 @@
+"""Headless helpers shared by the J&T Fleet Management Streamlit pages."""
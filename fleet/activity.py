@@ -0,0 +1,136 @@
+"""Last activity of every vehicle, for the Utilization report.
+
+VehicleActivity keeps one row per vehicle with its current agency, branch
+and condition, its last fueling and the last time its odometer went up. Like the
+timeline it is updated incrementally from the rows added since the last
+sync, so the report is a single query on an indexed table instead of a
+ranking over the whole Fuel and VehicleAllocation history.
+"""
+import pandas as pd
+
+from fleet import dates
+from fleet.data import where_clause
+from fleet.db import last_synced, mark_synced
+
+SOURCES = {'VehicleBasics': 'rowid', 'VehicleAllocation': 'AllocationID', 'Fuel': 'FuelID', 'Maintenance': 'MaintenanceID'}
+
+UTILIZATION_FILTERS = {'vehicle_id': 'A.VehicleID', 'agency': 'A.Agency', 'chassis': 'VB.ChassisNo', 'vehicle_type': 'VB.VehicleType'}
+
+
+def _new_rows(conn, table, columns):
+    id_column = SOURCES[table]
+    since = last_synced(conn, f'activity.{table}')
+    rows = conn.execute(
+        f"SELECT {id_column}, {', '.join(columns)} FROM {table} WHERE {id_column} > ? ORDER BY {id_column}", (since,)
+    ).fetchall()
+    if rows:
+        mark_synced(conn, f'activity.{table}', rows[-1][0])
+    return [row[1:] for row in rows]
+
+
+def sync(conn):
+    """Fold the rows added since the last sync into VehicleActivity.
+
+    Returns the number of vehicles touched. The caller commits.
+    """
+    touched = set()
+
+    vehicles = _new_rows(conn, 'VehicleBasics', ['VehicleID'])
+    conn.executemany("INSERT OR IGNORE INTO VehicleActivity (VehicleID) VALUES (?)", vehicles)
+    touched.update(row[0] for row in vehicles)
+
+    # In AllocationID order, so the latest allocation wins
+    allocations = _new_rows(conn, 'VehicleAllocation', ['VehicleID', 'Agency', 'Branch', 'Condition'])
+    conn.executemany('''
+        INSERT INTO VehicleActivity (VehicleID, Agency, Branch, Condition) VALUES (?, ?, ?, ?)
+        ON CONFLICT (VehicleID) DO UPDATE SET Agency = excluded.Agency, Branch = excluded.Branch, Condition = excluded.Condition
+    ''', allocations)
+    touched.update(row[0] for row in allocations)
+
+    fuel = pd.DataFrame(_new_rows(conn, 'Fuel', ['VehicleID', 'Date', 'Mileage']), columns=['VehicleID', 'Date', 'Mileage'])
+    maintenance = pd.DataFrame(_new_rows(conn, 'Maintenance', ['VehicleID', 'Date', 'Mileage']), columns=['VehicleID', 'Date', 'Mileage'])
+
+    last_fuel = fuel.dropna(subset=['VehicleID', 'Date']).groupby('VehicleID')['Date'].max()
+    conn.executemany('''
+        INSERT INTO VehicleActivity (VehicleID, LastFuelDate) VALUES (?, ?)
+        ON CONFLICT (VehicleID) DO UPDATE SET LastFuelDate = MAX(COALESCE(LastFuelDate, ''), excluded.LastFuelDate)
+    ''', list(last_fuel.items()))
+    touched.update(last_fuel.index)
+
+    # Highest new odometer reading per vehicle and the first date it was seen
+    readings = pd.concat([fuel, maintenance], ignore_index=True).dropna(subset=['VehicleID', 'Date'])
+    readings['Mileage'] = pd.to_numeric(readings['Mileage'], errors='coerce')
+    readings = readings.loc[readings['Mileage'] > 0].sort_values(['VehicleID', 'Mileage', 'Date'], ascending=[True, False, True])
+    highest = readings.drop_duplicates('VehicleID')
+    conn.executemany('''
+        INSERT INTO VehicleActivity (VehicleID, LastMileage, LastMileageDate) VALUES (?, ?, ?)
+        ON CONFLICT (VehicleID) DO UPDATE SET
+            LastMileageDate = CASE WHEN excluded.LastMileage > COALESCE(LastMileage, 0) THEN excluded.LastMileageDate ELSE LastMileageDate END,
+            LastMileage = MAX(COALESCE(LastMileage, 0), excluded.LastMileage)
+    ''', list(highest[['VehicleID', 'Mileage', 'Date']].itertuples(index=False, name=None)))
+    touched.update(highest['VehicleID'])
+
+    touched = sorted(touched)
+    for offset in range(0, len(touched), 500):
+        chunk = touched[offset:offset + 500]
+        conn.execute(f'''
+            UPDATE VehicleActivity
+            SET LastActivity = NULLIF(MAX(COALESCE(LastFuelDate, ''), COALESCE(LastMileageDate, '')), '')
+            WHERE VehicleID IN ({', '.join('?' * len(chunk))})
+        ''', chunk)
+    return len(touched)
+
+
+def rebuild(conn):
+    conn.execute("DELETE FROM VehicleActivity")
+    for table in SOURCES:
+        mark_synced(conn, f'activity.{table}', 0)
+    return sync(conn)
+
+
+def idle_cutoff(idle_days, as_of=None):
+    as_of = pd.Timestamp(as_of) if as_of is not None else pd.Timestamp.now()
+    return dates.canonical(as_of - pd.Timedelta(days=idle_days))
+
+
+def idle_vehicles(conn, idle_days, filters=None, as_of=None):
+    """Vehicles without a fueling or an odometer increase in the last ``idle_days`` days."""
+    where_clause_str, params = where_clause(filters, UTILIZATION_FILTERS)
+    cutoff = idle_cutoff(idle_days, as_of)
+    as_of = dates.canonical(as_of if as_of is not None else pd.Timestamp.now())
+    return pd.read_sql_query(f'''
+        SELECT
+            A.VehicleID AS "Vehicle ID",
+            VB.VehicleType AS "Vehicle Type",
+            A.Agency,
+            A.Branch,
+            A.LastFuelDate AS "Last Fueling",
+            A.LastMileage AS "Last Odometer",
+            A.LastMileageDate AS "Last Odometer Increase",
+            CAST(julianday(?) - julianday(A.LastActivity) AS INTEGER) AS "Idle Days"
+        FROM VehicleActivity A
+        JOIN VehicleBasics VB ON A.VehicleID = VB.VehicleID
+        WHERE (A.LastActivity IS NULL OR A.LastActivity < ?) AND {where_clause_str}
+        ORDER BY A.LastActivity
+    ''', conn, params=[as_of, cutoff] + params)
+
+
+def utilization(conn, idle_days, filters=None, as_of=None):
+    """Active and idle vehicles per agency and branch."""
+    where_clause_str, params = where_clause(filters, UTILIZATION_FILTERS)
+    df = pd.read_sql_query(f'''
+        SELECT
+            COALESCE(A.Agency, 'Unallocated') AS Agency,
+            COALESCE(A.Branch, 'Unallocated') AS Branch,
+            COUNT(*) AS Vehicles,
+            SUM(A.LastActivity >= ?) AS Active
+        FROM VehicleActivity A
+        JOIN VehicleBasics VB ON A.VehicleID = VB.VehicleID
+        WHERE {where_clause_str}
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+    ''', conn, params=[idle_cutoff(idle_days, as_of)] + params)
+    df['Active'] = df['Active'].fillna(0).astype(int)
+    df['Idle'] = df['Vehicles'] - df['Active']
+    df['Utilization %'] = (df['Active'] / df['Vehicles'] * 100).round(1)
+    return df
@@ -0,0 +1,143 @@
+"""License and ownership alerts per vehicle.
+
+VehicleAlerts keeps every vehicle's latest license end date and ownership
+together with the action they call for ('Renew License', 'Ownership
+Transfer', ...) and its priority. The latest license and ownership are
+folded in incrementally when rows are added; because the action depends on
+today's date, all alerts are re-evaluated by a sweep once a day. The
+dashboard KPI and the Action Needed report (fleet.data) read the dates and
+ownerships from the table and apply the same rules for the day they are
+read on, so they never depend on the sweep having run.
+
+    python -m fleet.alerts --digest digests/
+"""
+import argparse
+import datetime
+import os
+
+from fleet import migrations
+from fleet.data import ALERT_ACTION, ALERT_PRIORITY, action_needed
+from fleet.db import DB_PATH, connect, last_synced, mark_synced
+
+SOURCES = {'VehicleBasics': 'rowid', 'VehiclesLicenses': 'LicenseID', 'Ownership': 'OwnershipID'}
+
+# The rules the reports apply (fleet.data.ALERT_ACTION), stored for the day of the sweep
+EVALUATE = f'''
+    UPDATE VehicleAlerts SET
+        Action = {ALERT_ACTION.format(today='DATE(:today)')},
+        Priority = {ALERT_PRIORITY.format(today='DATE(:today)')},
+        EvaluatedOn = DATE(:today)
+'''
+
+
+def today():
+    return datetime.date.today().isoformat()
+
+
+def _day_number(day):
+    # DerivedState keeps integers; the sweep day is stored as YYYYMMDD
+    return int(day.replace('-', ''))
+
+
+def _latest(conn, table, columns):
+    # Latest new row per vehicle, by ID
+    id_column = SOURCES[table]
+    since = last_synced(conn, f'alerts.{table}')
+    rows = conn.execute(f'''
+        SELECT VehicleID, MAX({id_column}){''.join(', ' + column for column in columns)}
+        FROM {table}
+        WHERE {id_column} > ?
+        GROUP BY VehicleID
+    ''', (since,)).fetchall()
+    if rows:
+        mark_synced(conn, f'alerts.{table}', max(row[1] for row in rows))
+    return [row for row in rows if row[0] is not None]
+
+
+def sync(conn, day=None):
+    """Fold in new licenses and ownerships and sweep once per day.
+
+    Returns the number of vehicles re-evaluated. The caller commits.
+    """
+    day = day or today()
+    touched = set()
+
+    vehicles = _latest(conn, 'VehicleBasics', [])
+    conn.executemany("INSERT OR IGNORE INTO VehicleAlerts (VehicleID) VALUES (?)", [(row[0],) for row in vehicles])
+    touched.update(row[0] for row in vehicles)
+
+    licenses = _latest(conn, 'VehiclesLicenses', ['EndDate'])
+    conn.executemany('''
+        INSERT INTO VehicleAlerts (VehicleID, LicenseID, LicenseEndDate) VALUES (?, ?, ?)
+        ON CONFLICT (VehicleID) DO UPDATE SET LicenseID = excluded.LicenseID, LicenseEndDate = excluded.LicenseEndDate
+        WHERE excluded.LicenseID > COALESCE(LicenseID, 0)
+    ''', licenses)
+    touched.update(row[0] for row in licenses)
+
+    ownerships = _latest(conn, 'Ownership', ['Ownership'])
+    conn.executemany('''
+        INSERT INTO VehicleAlerts (VehicleID, OwnershipID, Ownership) VALUES (?, ?, ?)
+        ON CONFLICT (VehicleID) DO UPDATE SET OwnershipID = excluded.OwnershipID, Ownership = excluded.Ownership
+        WHERE excluded.OwnershipID > COALESCE(OwnershipID, 0)
+    ''', ownerships)
+    touched.update(row[0] for row in ownerships)
+
+    if last_synced(conn, 'alerts.sweep') < _day_number(day):
+        # A new day: every alert may have moved on
+        conn.execute(EVALUATE, {'today': day})
+        mark_synced(conn, 'alerts.sweep', _day_number(day))
+        return conn.execute("SELECT COUNT(*) FROM VehicleAlerts").fetchone()[0]
+
+    touched = sorted(touched)
+    for offset in range(0, len(touched), 500):
+        chunk = touched[offset:offset + 500]
+        names = [f'v{number}' for number in range(len(chunk))]
+        conn.execute(EVALUATE + f" WHERE VehicleID IN ({', '.join(':' + name for name in names)})",
+                     dict(zip(names, chunk), today=day))
+    return len(touched)
+
+
+def rebuild(conn, day=None):
+    conn.execute("DELETE FROM VehicleAlerts")
+    for name in list(SOURCES) + ['sweep']:
+        mark_synced(conn, f'alerts.{name}', 0)
+    return sync(conn, day)
+
+
+PRIORITY_ORDER = {'High': 0, 'Medium': 1, 'Low': 2}
+
+
+def digest(conn, day=None):
+    # The action list of the day, most urgent first
+    df = action_needed(conn, day=day)
+    df.insert(0, 'Digest Date', day or today())
+    df['Order'] = df['Priority Type'].map(PRIORITY_ORDER)
+    return df.sort_values(['Order', 'Licence End Date'], ignore_index=True).drop(columns='Order')
+
+
+def write_digest(conn, directory, day=None):
+    day = day or today()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'alerts-{day}.csv')
+    digest(conn, day).to_csv(path, index=False)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bring the license and ownership alerts up to date")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--rebuild', action='store_true', help="Rebuild the alerts of every vehicle")
+    parser.add_argument('--digest', metavar='DIRECTORY', help="Also write today's digest as alerts-YYYY-MM-DD.csv into this directory")
+    args = parser.parse_args()
+    conn = connect(args.db)
+    migrations.migrate(conn)
+    with conn:
+        vehicles = rebuild(conn) if args.rebuild else sync(conn)
+    print(f"Re-evaluated {vehicles} vehicles")
+    if args.digest:
+        print(f"Wrote {write_digest(conn, args.digest)}")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""CPU-bound per-vehicle analytics, inline or on a process pool.
+
+Fuel efficiency and fraud scoring loop over vehicles in pandas and hold the
+GIL for the whole computation. In pooled mode the input frame is split into
+VehicleID shards, each shard is computed in a worker process and the partial
+results are merged in the same order the inline computation produces.
+
+The mode is chosen per call or with the environment:
+
+    FLEET_ANALYTICS=pooled FLEET_ANALYTICS_WORKERS=4 streamlit run 1🏠Homepage.py
+"""
+import multiprocessing
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from fleet import data
+
+MODE = os.environ.get('FLEET_ANALYTICS', 'inline')
+WORKERS = int(os.environ.get('FLEET_ANALYTICS_WORKERS', 0)) or os.cpu_count()
+
+_pools = {}
+
+
+def pool(workers=None):
+    # One pool per size per process. Workers are spawned rather than forked
+    # because the Streamlit server is multi-threaded.
+    workers = workers or WORKERS
+    if workers not in _pools:
+        _pools[workers] = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+    return _pools[workers]
+
+
+def shutdown():
+    for executor in _pools.values():
+        executor.shutdown()
+    _pools.clear()
+
+
+def shard_of(vehicle_id, shards):
+    # Stable across processes, unlike hash()
+    return zlib.crc32(str(vehicle_id).encode()) % shards
+
+
+def partition(frame, column, shards):
+    """Split ``frame`` into at most ``shards`` frames with disjoint ``column`` values."""
+    keys = frame[column].map(lambda value: shard_of(value, shards))
+    return [part for _, part in frame.groupby(keys, sort=False)]
+
+
+def run(func, frame, column, mode=None, workers=None):
+    """``func(frame)`` computed inline or per shard of ``column`` on the process pool.
+
+    ``func`` must be a module-level function that treats every value of
+    ``column`` independently and returns one frame.
+    """
+    mode = mode or MODE
+    if mode == 'inline':
+        return func(frame)
+    if mode != 'pooled':
+        raise ValueError(f"Unknown analytics mode: {mode}")
+
+    executor = pool(workers)
+    parts = partition(frame, column, workers or WORKERS)
+    if len(parts) < 2:
+        return func(frame)
+    results = list(executor.map(func, parts))
+    merged = pd.concat(results, ignore_index=True)
+    # Inline results come out grouped by vehicle in sorted order
+    return merged.sort_values(column, kind='stable', ignore_index=True)
+
+
+def efficiency(conn, mode=None, workers=None):
+    return run(data.efficiency_from_fuel, data.efficiency_fuel(conn), 'VehicleID', mode, workers)
+
+
+def efficiency_old(conn, mode=None, workers=None):
+    return run(data.efficiency_old_from_fuel, data.efficiency_fuel(conn), 'VehicleID', mode, workers)
+
+
+def fuel_fraud(fuel_data, mode=None, workers=None):
+    return run(data.fuel_fraud, fuel_data, 'Vehicle ID', mode, workers)
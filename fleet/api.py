@@ -0,0 +1,272 @@
+"""Read-only HTTP API over the dashboard data.
+
+Serves the numbers the dashboard and reports show to other tools, from the
+same data layer (fleet.data, the stored aggregates of fleet.precompute and
+a QueryPool of read-only connections):
+
+    GET /kpis        headline numbers of the dashboard
+    GET /vehicles    current allocation, fuel, license and ownership, or with
+                     as_of the allocation, license and ownership on that day
+    GET /expenses    maintenance and fuel costs from start to end
+    GET /penalties   traffic penalties from start to end
+    GET /fraud       potential fuel fraud from start to end
+
+Every endpoint takes the report filters as query parameters (vehicle_id,
+agency, chassis, vehicle_type) and the dated ones take start and end
+(YYYY-MM-DD, default the whole history up to today). Results are JSON
+records, or an Arrow IPC stream when the request sends
+``Accept: application/vnd.apache.arrow.stream`` or ``format=arrow`` and
+pyarrow is installed.
+
+A response only depends on the request and the data, so its ETag is a hash
+of both, with the data version (fleet.db.data_version) standing in for the
+data. A client sending the ETag back in If-None-Match gets a 304 without a
+single query being run, until the next write.
+
+``app`` is a plain ASGI application without dependencies of its own; any
+ASGI server runs it, and ``call`` runs a request in-process, without a
+server or a network (``request`` does the same from async code):
+
+    python -m fleet.api --port 8000
+    python -m fleet.api --get "/expenses?start=2024-01-01&agency=Cairo"
+"""
+import argparse
+import asyncio
+import datetime
+import hashlib
+import io
+import json
+import urllib.parse
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+from fleet import analytics, data, history, precompute
+from fleet.db import DB_PATH, QueryPool, data_version
+
+JSON_TYPE = 'application/json'
+ARROW_TYPE = 'application/vnd.apache.arrow.stream'
+
+FILTER_PARAMS = ['vehicle_id', 'agency', 'chassis', 'vehicle_type']
+
+# First day the reports offer
+HISTORY_START = datetime.date(2023, 9, 1)
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def _period(params):
+    try:
+        start = pd.Timestamp(params.get('start') or HISTORY_START)
+        end = pd.Timestamp(params.get('end') or datetime.date.today())
+    except ValueError:
+        raise BadRequest("start and end must be dates (YYYY-MM-DD)") from None
+    return start.date(), end.date()
+
+
+def _filters(params):
+    return {name: params[name] for name in FILTER_PARAMS if params.get(name)}
+
+
+def kpis(pool, params):
+    # The efficiency frames are the stored aggregates the dashboard uses
+    return pool.run({'kpis': lambda conn: data.kpi_snapshot(
+        conn, precompute.load_or_compute('efficiency', conn), precompute.load_or_compute('efficiency_old', conn))})['kpis']
+
+
+def vehicles(pool, params):
+    if params.get('as_of'):
+        try:
+            day = pd.Timestamp(params['as_of']).date()
+        except ValueError:
+            raise BadRequest("as_of must be a date (YYYY-MM-DD)") from None
+        return pool.run({'vehicles': lambda conn: history.as_of(conn, day, _filters(params))})['vehicles']
+    return pool.run({'vehicles': lambda conn: data.vehicle_state(conn, _filters(params))})['vehicles']
+
+
+def expenses(pool, params):
+    return data.expenses(pool, *_period(params), _filters(params))
+
+
+def penalties(pool, params):
+    return pool.run({'penalties': lambda conn: data.traffic_penalties(conn, *_period(params), _filters(params))})['penalties']
+
+
+def fraud(pool, params):
+    fuel_data = pool.run({'fuel': lambda conn: data.fuel_fraud_data(conn, *_period(params), _filters(params))})['fuel']
+    return analytics.fuel_fraud(fuel_data)
+
+
+# path -> (function(pool, params), stored aggregates the result is built from)
+ROUTES = {
+    '/kpis': (kpis, ['efficiency', 'efficiency_old']),
+    '/vehicles': (vehicles, []),
+    '/expenses': (expenses, []),
+    '/penalties': (penalties, []),
+    '/fraud': (fraud, []),
+}
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+def encode(result, content_type):
+    """Body of ``result`` (a DataFrame or a dict of numbers) in the given content type."""
+    frame = result if isinstance(result, pd.DataFrame) else pd.DataFrame([result])
+    if content_type == ARROW_TYPE:
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        sink = io.BytesIO()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue()
+    if isinstance(result, pd.DataFrame):
+        return result.to_json(orient='records', date_format='iso', force_ascii=False).encode('utf-8')
+    return json.dumps(result, default=_json_default, ensure_ascii=False).encode('utf-8')
+
+
+def content_type(params, accept):
+    if params.get('format') == 'arrow' or ARROW_TYPE in accept:
+        if pa is None:
+            raise BadRequest("Arrow output needs pyarrow")
+        return ARROW_TYPE
+    return JSON_TYPE
+
+
+def etag(path, params, content_type, version):
+    # The date is part of the key: expired licenses and default periods move with it
+    key = json.dumps([path, sorted(params.items()), content_type, version, datetime.date.today().isoformat()])
+    return '"' + hashlib.sha1(key.encode('utf-8')).hexdigest()[:20] + '"'
+
+
+def _matches(if_none_match, tag):
+    return if_none_match.strip() == '*' or tag in [value.strip() for value in if_none_match.split(',')]
+
+
+class API:
+    """ASGI application serving ROUTES from one database."""
+
+    def __init__(self, db_path=None, max_workers=4):
+        self.db_path = db_path or DB_PATH
+        self.max_workers = max_workers
+        self._pool = None
+
+    @property
+    def pool(self):
+        # Opened on the first request, so importing the module touches no database
+        if self._pool is None:
+            self._pool = QueryPool(self.db_path, max_workers=self.max_workers)
+        return self._pool
+
+    def version(self, aggregates):
+        # Stored aggregates are recomputed after a write, without changing the data version again
+        stored = precompute.stored_versions()
+        return [data_version(self.db_path)] + [stored.get(name) for name in aggregates]
+
+    def handle(self, method, path, query, headers):
+        """``(status, headers, body)`` of a request; runs the queries, so call it off the event loop."""
+        if path not in ROUTES:
+            return _error(404, f"Unknown path {path}; one of {', '.join(ROUTES)}")
+        if method != 'GET':
+            return _error(405, "Only GET is supported")
+        func, aggregates = ROUTES[path]
+        params = dict(urllib.parse.parse_qsl(query))
+        # The pool switches the database to WAL, which changes the data version once
+        pool = self.pool
+        try:
+            response_type = content_type(params, headers.get('accept', ''))
+            tag = etag(path, params, response_type, self.version(aggregates))
+            response_headers = [('etag', tag), ('cache-control', 'no-cache')]
+            if _matches(headers.get('if-none-match', ''), tag):
+                return 304, response_headers, b''
+            body = encode(func(pool, params), response_type)
+        except BadRequest as e:
+            return _error(400, str(e))
+        return 200, response_headers + [('content-type', response_type)], body
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while (await receive())['type'] != 'lifespan.shutdown':
+                await send({'type': 'lifespan.startup.complete'})
+            if self._pool is not None:
+                self._pool.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+        status, response_headers, body = await asyncio.get_running_loop().run_in_executor(
+            None, self.handle, scope['method'], scope['path'], scope['query_string'].decode('latin-1'), request_headers(scope))
+        await respond(send, status, response_headers, body)
+
+
+def _error(status, message):
+    return status, [('content-type', JSON_TYPE)], json.dumps({'error': message}).encode('utf-8')
+
+
+def request_headers(scope):
+    return {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+
+
+async def respond(send, status, headers, body):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+                + [(b'content-length', str(len(body)).encode('latin-1'))]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+app = API()
+
+
+async def request(application, target, headers=None, method='GET', body=b''):
+    """Run one request through an ASGI application in-process; returns ``(status, headers, body)``."""
+    path, _, query = target.partition('?')
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query.encode('latin-1'),
+             'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in (headers or {}).items()]}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await application(scope, receive, send)
+    start = messages[0]
+    response_headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in start['headers']}
+    return start['status'], response_headers, b''.join(message.get('body', b'') for message in messages[1:])
+
+
+def call(application, target, headers=None, method='GET'):
+    # ``request`` outside of an event loop
+    return asyncio.run(request(application, target, headers, method))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the dashboard data as JSON or Arrow over HTTP")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--get', metavar='PATH', help="Print the response to one request instead of serving")
+    args = parser.parse_args()
+    application = API(args.db)
+    if args.get:
+        status, headers, body = call(application, args.get)
+        print(status, headers.get('etag', ''))
+        print(body.decode('utf-8'))
+        return
+    try:
+        import uvicorn
+    except ImportError:
+        parser.error("serving needs an ASGI server, e.g. pip install uvicorn")
+    uvicorn.run(application, host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
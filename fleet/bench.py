@@ -0,0 +1,218 @@
+"""Headless benchmark of the dashboard and report queries.
+
+Runs every analytics function the pages use against a database (usually
+one made by ``fleet.synthetic``), stores the timings as JSON and optionally
+compares them with an earlier baseline.
+
+    python -m fleet.synthetic --vehicles 2000 --years 2 --end 2024-06-30 --out bench/fleet_management.db
+    python -m fleet.bench --db bench/fleet_management.db --out bench/baseline.json
+    python -m fleet.bench --db bench/fleet_management.db --baseline bench/baseline.json --fail-on-regression
+    python -m fleet.bench --db bench/fleet_management.db --scaling 1 2 4 8
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import time
+
+import pandas as pd
+
+from fleet import analytics, data
+from fleet.db import QueryPool, connect
+
+TABLES = ['VehicleBasics', 'VehicleAllocation', 'Fuel', 'VehiclesLicenses', 'Ownership', 'Maintenance', 'TrafficPen', 'branches']
+
+
+def benchmarks(start_date, end_date, filters=None, pool=None):
+    """Return ``{name: callable(conn)}`` for everything worth timing.
+
+    With a ``QueryPool`` the functions that can fan out their queries use it.
+    """
+    return {
+        'efficiency': lambda conn: data.efficiency(conn),
+        'efficiency_old': lambda conn: data.efficiency_old(conn),
+        'fuelcost': lambda conn: data.fuelcost(conn),
+        'trafficcost': lambda conn: data.trafficcost(conn),
+        'kpi_snapshot': lambda conn: data.kpi_snapshot(pool or conn),
+        'basic_data_fun': lambda conn: data.vehicle_state(conn, filters),
+        'report.action_needed': lambda conn: data.action_needed(conn, filters),
+        'report.expenses': lambda conn: data.expenses(pool or conn, start_date, end_date, filters),
+        'report.maintenance_history': lambda conn: data.maintenance_history(conn, start_date, end_date, filters),
+        'report.traffic_penalties': lambda conn: data.traffic_penalties(conn, start_date, end_date, filters),
+        'report.fuel_fraud': lambda conn: data.fetch_fuel_data(conn, start_date, end_date, filters),
+        'detect_fuel_fraud': lambda conn: data.fuel_fraud(data.fuel_fraud_data(conn, start_date, end_date, filters)),
+    }
+
+
+def analytics_benchmarks(start_date, end_date, mode, workers=None):
+    """The process-pool capable analytics in the given mode."""
+    return {
+        'efficiency': lambda conn: analytics.efficiency(conn, mode, workers),
+        'efficiency_old': lambda conn: analytics.efficiency_old(conn, mode, workers),
+        'detect_fuel_fraud': lambda conn: analytics.fuel_fraud(data.fuel_fraud_data(conn, start_date, end_date), mode, workers),
+    }
+
+
+def row_count(result):
+    try:
+        return len(result)
+    except TypeError:
+        return None
+
+
+def table_sizes(conn):
+    return {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in TABLES}
+
+
+def date_range(conn):
+    # The whole span of fuel history, so range-filtered reports see all rows
+    first, last = conn.execute("SELECT MIN(Date), MAX(Date) FROM Fuel").fetchone()
+    return datetime.date.fromisoformat(first[:10]), datetime.date.fromisoformat(last[:10])
+
+
+def measure(func, conn, repeat):
+    timings = []
+    rows = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(conn)
+        timings.append((time.perf_counter() - started) * 1000)
+        rows = row_count(result)
+    return {
+        'runs_ms': [round(value, 2) for value in timings],
+        'min_ms': round(min(timings), 2),
+        'median_ms': round(statistics.median(timings), 2),
+        'rows': rows,
+    }
+
+
+def run(db_path, repeat=3, only=None, workers=0, analytics_mode=None):
+    conn = connect(db_path)
+    pool = QueryPool(db_path, workers) if workers else None
+    start_date, end_date = date_range(conn)
+    funcs = benchmarks(start_date, end_date, pool=pool)
+    if analytics_mode:
+        funcs.update(analytics_benchmarks(start_date, end_date, analytics_mode))
+    results = {}
+    for name, func in funcs.items():
+        if only and not any(pattern in name for pattern in only):
+            continue
+        results[name] = measure(func, conn, repeat)
+        print(f"{name:<32}{results[name]['median_ms']:>12,.1f} ms", file=sys.stderr)
+
+    report = {
+        'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'pandas': pd.__version__,
+        'db': {'path': db_path, 'rows': table_sizes(conn)},
+        'repeat': repeat,
+        'workers': workers,
+        'analytics_mode': analytics_mode or analytics.MODE,
+        'results': results,
+    }
+    conn.close()
+    if pool:
+        pool.close()
+    return report
+
+
+def scaling(db_path, workers_list, repeat=3):
+    """Median timings of the analytics inline and pooled with each worker count.
+
+    The first pooled call of every pool size starts its worker processes, so
+    one untimed warm-up call is made per configuration.
+    """
+    conn = connect(db_path)
+    start_date, end_date = date_range(conn)
+    configurations = [('inline', None)] + [('pooled', workers) for workers in workers_list]
+    results = {}
+    for mode, workers in configurations:
+        label = 'inline' if mode == 'inline' else f'{workers} workers'
+        for name, func in analytics_benchmarks(start_date, end_date, mode, workers).items():
+            func(conn)
+            results.setdefault(name, {})[label] = measure(func, conn, repeat)['median_ms']
+            print(f"{name:<24}{label:<12}{results[name][label]:>12,.1f} ms", file=sys.stderr)
+    conn.close()
+    analytics.shutdown()
+    return {'cpus': os.cpu_count(), 'results': results}
+
+
+def print_scaling(report):
+    print(f"{report['cpus']} CPUs")
+    for name, timings in report['results'].items():
+        inline = timings['inline']
+        for label, ms in timings.items():
+            print(f"{name:<24}{label:<12}{ms:>12,.1f} ms{inline / ms:>8.2f}x")
+
+
+def compare(baseline, current, threshold=0.2):
+    """Return ``(rows, regressions)`` comparing median timings of two reports."""
+    rows = []
+    regressions = []
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            rows.append((name, None, result['median_ms'], None))
+            continue
+        ratio = result['median_ms'] / before['median_ms'] if before['median_ms'] else None
+        rows.append((name, before['median_ms'], result['median_ms'], ratio))
+        if ratio is not None and ratio > 1 + threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+def print_comparison(rows):
+    print(f"{'benchmark':<32}{'baseline ms':>14}{'current ms':>14}{'ratio':>8}")
+    for name, before, after, ratio in rows:
+        before_str = f"{before:,.1f}" if before is not None else '-'
+        ratio_str = f"{ratio:.2f}x" if ratio is not None else '-'
+        print(f"{name:<32}{before_str:>14}{after:>14,.1f}{ratio_str:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the fleet dashboard and report queries")
+    parser.add_argument('--db', default='bench/fleet_management.db')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', nargs='*', help="Only run benchmarks whose name contains one of these strings")
+    parser.add_argument('--workers', type=int, default=0, help="Run fan-out queries on a thread pool of this size (0 runs them sequentially)")
+    parser.add_argument('--out', help="Write the results as JSON to this file")
+    parser.add_argument('--baseline', help="Compare against a JSON file written by an earlier run")
+    parser.add_argument('--threshold', type=float, default=0.2, help="Slowdown ratio above which a benchmark counts as a regression")
+    parser.add_argument('--fail-on-regression', action='store_true')
+    parser.add_argument('--analytics', choices=['inline', 'pooled'], help="Time the per-vehicle analytics through fleet.analytics in this mode")
+    parser.add_argument('--scaling', type=int, nargs='+', metavar='WORKERS', help="Only time the analytics inline and on process pools of these sizes")
+    args = parser.parse_args()
+
+    if args.scaling:
+        report = scaling(args.db, args.scaling, args.repeat)
+        if args.out:
+            with open(args.out, 'w') as f:
+                json.dump(report, f, indent=2)
+        print_scaling(report)
+        return
+
+    report = run(args.db, args.repeat, args.only, args.workers, args.analytics)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows, regressions = compare(baseline, report, args.threshold)
+        print_comparison(rows)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            if args.fail_on_regression:
+                sys.exit(1)
+    else:
+        print(json.dumps(report['results'], indent=2))
+
+
+if __name__ == '__main__':
+    main()
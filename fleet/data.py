@@ -0,0 +1,709 @@
+"""SQL and pandas logic behind the dashboard and the reports.
+
+Every function takes an open ``sqlite3`` connection and returns plain
+values or DataFrames, so it can run without Streamlit (benchmarks, jobs).
+The pages wrap these functions with ``st.cache_data`` where appropriate.
+
+Report filters are passed as a dictionary with the keys ``vehicle_id``,
+``agency``, ``chassis`` and ``vehicle_type``; empty values and "All" are
+ignored.
+"""
+import datetime
+import os
+
+import numpy as np
+import pandas as pd
+
+from fleet import dates, mirror, penalties
+from fleet.db import run_queries
+
+# Published workshop sheet; FLEET_MAINTENANCE_SHEET can point to a local CSV export instead
+MAINTENANCE_SHEET_URL = os.environ.get('FLEET_MAINTENANCE_SHEET', "https://docs.google.com/spreadsheets/d/e/2PACX-1vR38RHrj7Ne1De_dZg7xf7T8bdD2iZt0MHcOhnbfhXbZkRaOIfsbyJEMeZ4FxKmSN-pRza9s6CcX38k/pub?gid=247980336&single=true&output=csv")
+
+# Column each filter applies to, per report query
+BASIC_DATA_FILTERS = {'vehicle_id': '"Vehicle ID"', 'agency': '"Agency"', 'chassis': '"Chassis No."', 'vehicle_type': '"Vehicle Type"'}
+ACTION_NEEDED_FILTERS = {'vehicle_id': 'VB.VehicleID', 'agency': 'A.Agency', 'chassis': 'VB.ChassisNo', 'vehicle_type': 'VB.VehicleType'}
+EXPENSES_FILTERS = BASIC_DATA_FILTERS
+MAINTENANCE_HISTORY_FILTERS = {'vehicle_id': 'M.VehicleID'}
+TRAFFIC_PENALTIES_FILTERS = {'vehicle_id': '"Vehicle ID"', 'agency': 'VA.Agency', 'chassis': 'VB.ChassisNo', 'vehicle_type': '"Vehicle Type"'}
+FUEL_DATA_FILTERS = {'vehicle_id': '"Vehicle ID"', 'agency': 'VA.Agency', 'chassis': 'VB.ChassisNo', 'vehicle_type': '"Vehicle Type"'}
+
+
+def where_clause(filters, columns):
+    """Return ``(sql, params)`` for the filters a query supports."""
+    clauses = []
+    params = []
+    for key, value in (filters or {}).items():
+        if not value or value == "All" or key not in columns:
+            continue
+        if key == 'chassis':
+            clauses.append(f"{columns[key]} LIKE ?")
+            params.append(f"%{value}%")
+        else:
+            clauses.append(f"{columns[key]} = ?")
+            params.append(value)
+    # Default to 1=1 for no filtering
+    return (' AND '.join(clauses) if clauses else "1=1"), params
+
+
+def maintenance_sheet(url=MAINTENANCE_SHEET_URL):
+    return pd.read_csv(url, skiprows=1).fillna(0)
+
+
+def under_maintenance_count(sheet):
+    # The workshop sheet keeps the number of vehicles under maintenance in a fixed cell
+    return sheet.iloc[10, 19]
+
+
+def vehicle_ids(conn):
+    return [row[0] for row in conn.execute("SELECT VehicleID FROM VehicleBasics").fetchall()]
+
+
+def vehicle_types(conn):
+    return [row[0] for row in conn.execute("SELECT DISTINCT VehicleType FROM VehicleBasics").fetchall()]
+
+
+def agencies(conn):
+    return [row[0] for row in conn.execute("SELECT DISTINCT Agency FROM VehicleAllocation").fetchall()]
+
+
+def branch_agencies(conn):
+    return [row[0] for row in conn.execute("SELECT DISTINCT Agency FROM branches").fetchall()]
+
+
+def branches(conn, agency):
+    return [row[0] for row in conn.execute("SELECT Branch FROM branches WHERE Agency = ?", (agency,)).fetchall()]
+
+
+def total_vehicles(conn):
+    return conn.execute("SELECT COUNT(*) FROM VehicleBasics").fetchone()[0]
+
+
+def expired_licenses(conn, day=None):
+    # Vehicles whose latest license has ended, from the alerts kept by fleet.alerts
+    day = day or datetime.date.today().isoformat()
+    return conn.execute("SELECT COUNT(*) FROM VehicleAlerts WHERE LicenseEndDate < DATE(?)", (day,)).fetchone()[0]
+
+
+def inactive_vehicles(conn):
+    rows = conn.execute('''
+    WITH RankedAllocations AS (
+        SELECT
+            VB.VehicleID AS "Vehicle ID",
+            VA.Condition,
+            ROW_NUMBER() OVER (PARTITION BY VB.VehicleID ORDER BY VA.AllocationID DESC) AS RowNum
+        FROM
+            VehicleBasics VB
+            LEFT JOIN VehicleAllocation VA ON VB.VehicleID = VA.VehicleID
+        WHERE
+            VA.Condition = "Inactive"
+    )
+    SELECT
+        "Vehicle ID",
+        Condition
+    FROM
+        RankedAllocations
+    WHERE
+        RowNum = 1;
+    ''').fetchall()
+    return len(rows)
+
+
+def vehicles_by_location_type(conn):
+    rows = conn.execute("""
+    SELECT A.Agency, COUNT(DISTINCT B.VehicleID) AS TotalVehicles, B.VehicleType
+    FROM VehicleAllocation A
+    LEFT JOIN VehicleBasics B ON A.VehicleID = B.VehicleID
+    WHERE A.AllocationID IN (
+        SELECT MAX(AllocationID)
+        FROM VehicleAllocation
+        GROUP BY VehicleID
+    )
+    GROUP BY A.Agency, B.VehicleType
+    """).fetchall()
+    return pd.DataFrame(rows, columns=["Location", 'Total Vehicles', "VehicleType"])
+
+
+def vehicles_by_location(conn):
+    rows = conn.execute("""
+    SELECT A.Agency, COUNT(DISTINCT B.VehicleID) AS TotalVehicles
+    FROM VehicleAllocation A
+    LEFT JOIN VehicleBasics B ON A.VehicleID = B.VehicleID
+    WHERE A.AllocationID IN (
+        SELECT MAX(AllocationID)
+        FROM VehicleAllocation
+        GROUP BY VehicleID
+    )
+    GROUP BY A.Agency
+    """).fetchall()
+    return pd.DataFrame(rows, columns=["Location", "Total Vehicles"]).sort_values(by='Total Vehicles', ascending=False)
+
+
+def efficiency_by_type(efficiency_df):
+    average_efficiency_by_type = efficiency_df.groupby('VehicleType')['FuelEfficiency'].mean().reset_index()
+    average_efficiency_by_type.columns = ['Vehicle Type', 'Average Fuel Efficiency (KM/L)']
+    return average_efficiency_by_type.sort_values(by='Average Fuel Efficiency (KM/L)', ascending=False)
+
+
+def efficiency_by_agency_type(efficiency_df):
+    return efficiency_df.groupby(['Agency', 'VehicleType'])['FuelEfficiency'].mean().reset_index()
+
+
+# Independent queries behind the dashboard KPIs
+KPI_QUERIES = {
+    'total_vehicles': lambda conn: total_vehicles(conn),
+    'expired_licenses': lambda conn: expired_licenses(conn),
+    'inactive_vehicles': lambda conn: inactive_vehicles(conn),
+    'fuelcost': lambda conn: fuelcost(conn),
+    'trafficcost': lambda conn: trafficcost(conn),
+}
+
+
+def kpi_snapshot(source, efficiency_df=None, efficiency_old_df=None):
+    """Headline numbers of the dashboard as a dictionary.
+
+    ``source`` is a connection or a ``QueryPool``; with a pool the KPI
+    queries run concurrently. The efficiency frames can be passed in when
+    the caller already holds them (for example from a cache); otherwise
+    they are computed here.
+    """
+    queries = dict(KPI_QUERIES)
+    if efficiency_df is None:
+        queries['efficiency'] = efficiency
+    if efficiency_old_df is None:
+        queries['efficiency_old'] = efficiency_old
+    results = run_queries(source, queries)
+    results.setdefault('efficiency', efficiency_df)
+    results.setdefault('efficiency_old', efficiency_old_df)
+    return kpis_from_results(results)
+
+
+def kpis_from_results(results):
+    # Combine the results of KPI_QUERIES plus both efficiency frames
+    vehicles = results['total_vehicles']
+    expired = results['expired_licenses']
+    fuel_date, fuel_week, fuel_week_before = results['fuelcost']
+    penalty_date, penalty_week, penalty_week_before = results['trafficcost']
+    return {
+        'total_vehicles': vehicles,
+        'expired_licenses': expired,
+        'expired_licenses_pct': (expired / vehicles) * 100 if vehicles else 0,
+        'inactive_vehicles': results['inactive_vehicles'],
+        'avg_fuel_efficiency': results['efficiency'].FuelEfficiency.mean(),
+        'avg_fuel_efficiency_old': results['efficiency_old'].FuelEfficiencyLast7Days.mean(),
+        'fuel_last_update': fuel_date,
+        'fuel_week_cost': fuel_week or 0,
+        'fuel_week_before_cost': fuel_week_before or 0,
+        'penalties_last_update': penalty_date,
+        'penalties_week_cost': penalty_week or 0,
+        'penalties_week_before_cost': penalty_week_before or 0,
+    }
+
+
+EFFICIENCY_FUEL_QUERY = '''
+    WITH RankedAllocations AS (
+        SELECT
+            VA.VehicleID,
+            VA.Agency,
+            ROW_NUMBER() OVER (PARTITION BY VA.VehicleID ORDER BY VA.AllocationID DESC) AS RowNum
+        FROM VehicleAllocation VA
+    )
+
+    SELECT
+        F.Date,
+        F.VehicleID,
+        F.Mileage,
+        F.Type,
+        F.Amount,
+        F.Cost,
+        V.VehicleType,
+        VA.Agency
+    FROM Fuel F
+    LEFT JOIN VehicleBasics V ON F.VehicleID = V.VehicleID
+    LEFT JOIN RankedAllocations VA ON F.VehicleID = VA.VehicleID AND VA.RowNum = 1;
+
+    '''
+
+
+CURRENT_AGENCY_QUERY = '''
+    SELECT VehicleID, Agency
+    FROM (
+        SELECT
+            VehicleID,
+            Agency,
+            ROW_NUMBER() OVER (PARTITION BY VehicleID ORDER BY AllocationID DESC) AS RowNum
+        FROM VehicleAllocation
+    )
+    WHERE RowNum = 1
+'''
+
+
+def efficiency_fuel(conn):
+    # Fuel history with vehicle type and current agency, input of the efficiency calculations.
+    # Repeated fill-ups are kept out of Fuel by its natural key (migrations.NATURAL_KEYS).
+    if mirror.is_current(conn, 'Fuel'):
+        # Typed columns straight from the Parquet mirror; only the small lookups come from SQLite
+        fuel = mirror.read_parquet('Fuel', ['Date', 'VehicleID', 'Mileage', 'Type', 'Amount', 'Cost'])
+        types = pd.read_sql_query("SELECT VehicleID, VehicleType FROM VehicleBasics", conn)
+        agencies = pd.read_sql_query(CURRENT_AGENCY_QUERY, conn)
+        return fuel.merge(types, on='VehicleID', how='left').merge(agencies, on='VehicleID', how='left')
+
+    df = pd.read_sql_query(EFFICIENCY_FUEL_QUERY, conn)
+    df['Date'] = dates.to_datetime(df['Date'])
+    return df
+
+
+def efficiency(conn):
+    return efficiency_from_fuel(efficiency_fuel(conn))
+
+
+def efficiency_from_fuel(df):
+    # Fuel efficiency of the last 7 days before each vehicle's most recent fill-up.
+    # Vehicles are independent of each other, so any subset of vehicles can be
+    # computed on its own (see fleet.analytics).
+    grouped = df.groupby('VehicleID')
+
+    vehicle_efficiency_data = []
+
+    for vehicle_id, group in grouped:
+        group = group.sort_values(by='Date', ascending=False)
+
+        most_recent_date = group['Date'].iloc[0]
+
+        last_7_days = most_recent_date - datetime.timedelta(days=7)
+
+        group = group[group['Date'] >= last_7_days]
+
+        total_distance = group['Mileage'].max() - group['Mileage'].min()
+
+        total_fuel = group['Amount'].sum() - group['Amount'].iloc[0]  # Subtract the last fuel amount
+
+        if total_fuel > 0:  # Check if there was any fuel consumption in the last 7 days
+            fuel_efficiency = total_distance / total_fuel
+        else:
+            fuel_efficiency = 0  # Set efficiency to 0 if no fuel was consumed
+
+        vehicle_type = group['VehicleType'].values[0]
+        vehicle_area = group['Agency'].values[0]
+        total_cost = group['Cost'].values[0]
+
+        vehicle_efficiency_data.append({
+            'VehicleID': vehicle_id,
+            'VehicleType': vehicle_type,
+            'Agency': vehicle_area,
+            'FuelEfficiency': fuel_efficiency,
+            'Cost': total_cost
+        })
+
+    # Create a DataFrame from the results
+    fuel_efficiency_df = pd.DataFrame(vehicle_efficiency_data, columns=['VehicleID', 'VehicleType', 'Agency', 'FuelEfficiency', 'Cost'])
+    fuel_efficiency_df = fuel_efficiency_df.loc[
+        (fuel_efficiency_df['FuelEfficiency'] > 0) &
+        (fuel_efficiency_df['FuelEfficiency'] < 40)
+        ]
+
+    return fuel_efficiency_df
+
+
+def efficiency_old(conn):
+    return efficiency_old_from_fuel(efficiency_fuel(conn))
+
+
+def efficiency_old_from_fuel(df):
+    # Fuel efficiency of the 7 days before the last 7 days, per vehicle
+    grouped = df.groupby('VehicleID')
+
+    vehicle_efficiency_data = []
+    for vehicle_id, group in grouped:
+        group = group.sort_values(by='Date', ascending=False)
+
+        most_recent_date = group['Date'].iloc[0]
+
+        last_7_days = most_recent_date - datetime.timedelta(days=7)
+
+        last_14_days = last_7_days - datetime.timedelta(days=7)
+
+        group_last_7_to_14_days = group[(group['Date'] >= last_14_days) & (group['Date'] < last_7_days)]
+        if group_last_7_to_14_days.shape[0] > 0:
+
+            total_distance_last_7_to_14_days = group_last_7_to_14_days['Mileage'].max() - group_last_7_to_14_days['Mileage'].min()
+
+            total_fuel_last_7_to_14_days = group_last_7_to_14_days['Amount'].sum() - group_last_7_to_14_days['Amount'].iloc[-1]
+
+            if total_fuel_last_7_to_14_days > 0:  # Check if there was any fuel consumption in the 7 days before the last 7 days
+                fuel_efficiency_last_7_to_14_days = total_distance_last_7_to_14_days / total_fuel_last_7_to_14_days
+            else:
+                fuel_efficiency_last_7_to_14_days = 0  # Set efficiency to 0 if no fuel was consumed during that period
+
+            vehicle_type = group['VehicleType'].values[0]
+            total_cost = group['Cost'].values[0]
+
+            vehicle_efficiency_data.append({
+                'VehicleID': vehicle_id,
+                'VehicleType': vehicle_type,
+                'FuelEfficiencyLast7Days': fuel_efficiency_last_7_to_14_days,
+                'Cost': total_cost
+            })
+
+    # Create a DataFrame from the results
+    fuel_efficiency_df = pd.DataFrame(vehicle_efficiency_data, columns=['VehicleID', 'VehicleType', 'FuelEfficiencyLast7Days', 'Cost'])
+    fuel_efficiency_df = fuel_efficiency_df.loc[
+        (fuel_efficiency_df['FuelEfficiencyLast7Days'] > 0) &
+        (fuel_efficiency_df['FuelEfficiencyLast7Days'] < 40)
+        ]
+
+    return fuel_efficiency_df
+
+
+def weekly_cost(conn, table):
+    # Cost of the last 7 days before the most recent entry of the table and of the 7 days before that
+    cursor = conn.cursor()
+
+    # Get the most recent date from the database
+    most_recent_date_str = cursor.execute(f"SELECT MAX(Date) FROM {table}").fetchone()[0]
+
+    # Convert the most recent date string to a datetime object
+    most_recent_date = dates.parse(most_recent_date_str)
+
+    # Calculate the date range
+    end_date = most_recent_date
+    start_date = end_date - datetime.timedelta(days=7)  # Last week
+    week_before_start_date = start_date - datetime.timedelta(days=7)  # The week before
+
+    # Use the date range in your query
+    query = f"""
+    SELECT
+        ? AS MostRecentDate,
+        SUM(CASE WHEN Date >= ? AND Date < ? THEN Cost ELSE 0 END) AS LastWeekCost,
+        SUM(CASE WHEN Date >= ? AND Date < ? THEN Cost ELSE 0 END) AS WeekBeforeCost
+    FROM {table}
+    WHERE Date >= ? AND Date < ?
+    """
+
+    start_date, end_date, week_before_start_date = (dates.canonical(value) for value in (start_date, end_date, week_before_start_date))
+    cursor.execute(query, (most_recent_date_str, start_date, end_date, week_before_start_date, start_date, week_before_start_date, end_date))
+    return cursor.fetchone()
+
+
+def fuelcost(conn):
+    return weekly_cost(conn, 'Fuel')
+
+
+def trafficcost(conn):
+    return weekly_cost(conn, 'TrafficPen')
+
+
+def vehicle_state(conn, filters=None):
+    # Current allocation, last fueling, license and ownership of every vehicle
+    where_clause_str, params = where_clause(filters, BASIC_DATA_FILTERS)
+    return pd.read_sql_query(f'''
+    WITH VehicleAllocationCTE AS (
+      SELECT
+        VA1.VehicleID,
+        VA1.Agency,
+        VA1.Branch,
+        VA1.Condition,
+        ROW_NUMBER() OVER (PARTITION BY VA1.VehicleID ORDER BY VA1.AllocationID DESC) AS row_num
+      FROM VehicleAllocation VA1
+    ),
+    FuelCTE AS (
+      SELECT
+        F1.VehicleID,
+        F1.Amount,
+        F1.Date,
+        ROW_NUMBER() OVER (PARTITION BY F1.VehicleID ORDER BY F1.Date DESC) AS row_num
+      FROM Fuel F1
+    ),
+    VehiclesLicensesCTE AS (
+      SELECT
+        VL1.VehicleID,
+        VL1.EndDate,
+        ROW_NUMBER() OVER (PARTITION BY VL1.VehicleID ORDER BY VL1.LicenseID DESC) AS row_num
+      FROM VehiclesLicenses VL1
+    ),
+    OwnershipCTE AS (
+      SELECT
+        O1.VehicleID,
+        O1.Ownership,
+        ROW_NUMBER() OVER (PARTITION BY O1.VehicleID ORDER BY O1.OwnershipID DESC) AS row_num
+      FROM Ownership O1
+    )
+    SELECT
+      DISTINCT VB.VehicleID AS "Vehicle ID",
+      VB.ChassisNo AS "Chassis No.",
+      VB.VehicleType AS "Vehicle Type",
+      VA.Agency AS "Agency",
+      VA.Branch AS "Branch",
+      F.Amount AS "Last Fuel Amount",
+      F.Date AS "Last Fuel Date",
+      VL.EndDate AS "Licence End Date",
+      O.Ownership AS "Ownership",
+      VA.Condition AS "Condition"
+    FROM VehicleBasics VB
+    LEFT JOIN VehicleAllocationCTE VA ON VB.VehicleID = VA.VehicleID AND VA.row_num = 1
+    LEFT JOIN FuelCTE F ON VB.VehicleID = F.VehicleID AND F.row_num = 1
+    LEFT JOIN VehiclesLicensesCTE VL ON VB.VehicleID = VL.VehicleID AND VL.row_num = 1
+    LEFT JOIN OwnershipCTE O ON VB.VehicleID = O.VehicleID AND O.row_num = 1
+    WHERE {where_clause_str};
+    ''', con=conn, params=params)
+
+
+# The rules of the former Action Needed query, on the latest license end date
+# and ownership of a vehicle (VehicleAlerts) and the day of {today}. Licenses
+# ending within a month are due soon; any ownership other than 'JT' needs a transfer.
+ALERT_ACTION = '''
+    CASE
+        WHEN LicenseEndDate < {today} AND (Ownership = 'JT' OR Ownership IS NULL) THEN 'Renew License'
+        WHEN LicenseEndDate >= {today} AND LicenseEndDate <= DATE({today}, '+1 month') AND (Ownership = 'JT' OR Ownership IS NULL) THEN 'Renew Soon'
+        WHEN LicenseEndDate < {today} AND Ownership != 'JT' THEN 'Ownership Transfer and Renew License'
+        WHEN LicenseEndDate >= {today} AND LicenseEndDate <= DATE({today}, '+1 month') AND Ownership != 'JT' THEN 'Ownership Transfer and Renew Soon'
+        WHEN Ownership != 'JT' THEN 'Ownership Transfer'
+        ELSE 'No Action Needed'
+    END
+'''
+ALERT_PRIORITY = '''
+    CASE
+        WHEN LicenseEndDate < {today} THEN 'High'
+        WHEN LicenseEndDate >= {today} AND LicenseEndDate <= DATE({today}, '+1 month') THEN 'Medium'
+        ELSE 'Low'
+    END
+'''
+
+
+def action_needed(conn, filters=None, day=None):
+    """Vehicles that need a license renewal or an ownership transfer on ``day`` (default today), except inactive ones.
+
+    The license end dates and ownerships come from VehicleAlerts (fleet.alerts);
+    the action and priority are evaluated here for ``day``, so a session
+    running past midnight never shows the day before's.
+    """
+    where_clause_str, params = where_clause(filters, ACTION_NEEDED_FILTERS)
+    day = day or datetime.date.today().isoformat()
+    return pd.read_sql_query(f'''
+        WITH Alerts AS (
+            SELECT
+                VehicleID,
+                LicenseEndDate,
+                Ownership,
+                {ALERT_ACTION.format(today='Today')} AS Action,
+                {ALERT_PRIORITY.format(today='Today')} AS Priority
+            FROM VehicleAlerts, (SELECT DATE(?) AS Today)
+        )
+        SELECT
+            VB.VehicleID AS "Vehicle ID",
+            VB.VehicleType AS "Vehicle Type",
+            A.Agency,
+            A.Branch,
+            AL.LicenseEndDate AS "Licence End Date",
+            AL.Ownership AS "Ownership",
+            AL.Action AS "Action Needed",
+            AL.Priority AS "Priority Type",
+            A.Condition
+        FROM Alerts AL
+        JOIN VehicleBasics VB ON AL.VehicleID = VB.VehicleID
+        LEFT JOIN VehicleActivity A ON AL.VehicleID = A.VehicleID
+        WHERE AL.Action <> 'No Action Needed'
+        AND A.Condition <> 'Inactive'
+        AND {where_clause_str}
+        ORDER BY VB.VehicleID
+            ''', con=conn, params=[day] + params)
+
+
+def _allocation_at(alias):
+    # Joins VA, the allocation in force at the Date of the row ``alias`` (fleet.history).
+    # An event from before the vehicle's first allocation gets that first allocation.
+    return f'''LEFT JOIN AllocationHistory AH
+                ON AH.VehicleID = {alias}.VehicleID AND AH.ValidFrom <= {alias}.Date AND (AH.ValidTo IS NULL OR {alias}.Date < AH.ValidTo)
+            LEFT JOIN VehicleAllocation VA ON VA.AllocationID = COALESCE(AH.AllocationID, (
+                SELECT FA.AllocationID FROM AllocationHistory FA
+                WHERE FA.VehicleID = {alias}.VehicleID
+                ORDER BY FA.ValidFrom, FA.AllocationID
+                LIMIT 1
+            ))'''
+
+
+# The agency of an expense or penalty is the one the vehicle was allocated to
+# when it happened (_allocation_at)
+EXPENSE_SOURCES = {
+    'maintenance': f'''
+            SELECT
+                M.MaintenanceID AS ID,
+                M.VehicleID,
+                M.Date,
+                VB.VehicleType,
+                VA.Agency,
+                VB.ChassisNo,
+                M.Cost,
+                M.MaintenanceType
+            FROM Maintenance M
+            LEFT JOIN VehicleBasics VB ON M.VehicleID = VB.VehicleID
+            {_allocation_at('M')}''',
+    'fuel': f'''
+            SELECT
+                F.FuelID AS ID,
+                F.VehicleID,
+                F.Date,
+                VB.VehicleType,
+                VA.Agency,
+                VB.ChassisNo,
+                F.Cost,
+                NULL AS MaintenanceType
+            FROM Fuel F
+            LEFT JOIN VehicleBasics VB ON F.VehicleID = VB.VehicleID
+            {_allocation_at('F')}''',
+}
+
+
+def expense_queries(start_date, end_date, filters=None):
+    """One independent query per expense source, as ``{name: callable(conn)}``."""
+    where_clause_str, params = where_clause(filters, EXPENSES_FILTERS)
+
+    def query(source):
+        sql = f'''
+        WITH ExpenseData AS ({EXPENSE_SOURCES[source]}
+        )
+
+        SELECT
+            ID,
+            VehicleID AS "Vehicle ID",
+            Date,
+            VehicleType AS "Vehicle Type",
+            Agency,
+            ChassisNo AS "Chassis No.",
+            CASE WHEN MaintenanceType IS NOT NULL THEN 'Maintenance' ELSE 'Fuel' END AS "Expense Type",
+            Cost
+        FROM ExpenseData
+        WHERE Date >= ? AND Date < ? AND {where_clause_str};
+        '''
+        return lambda conn: pd.read_sql_query(sql, con=conn, params=dates.day_range(start_date, end_date) + params)
+
+    return {source: query(source) for source in EXPENSE_SOURCES}
+
+
+def expenses(source, start_date, end_date, filters=None):
+    # Maintenance and fuel halves run concurrently when given a pool
+    halves = run_queries(source, expense_queries(start_date, end_date, filters))
+    return pd.concat([halves[name] for name in EXPENSE_SOURCES], ignore_index=True)
+
+
+def maintenance_history(conn, start_date, end_date, filters=None):
+    where_clause_str, params = where_clause(filters, MAINTENANCE_HISTORY_FILTERS)
+    return pd.read_sql_query(f'''SELECT
+        M.MaintenanceID,
+        M.Date AS MaintenanceDate,
+        M.VehicleID,
+        M.MaintenanceType,
+        M.Mileage,
+        M.Cost,
+        CASE
+            WHEN EXISTS (
+                SELECT 1
+                FROM Maintenance AS PrevM
+                WHERE PrevM.VehicleID = M.VehicleID
+                AND PrevM.Date < M.Date
+            ) THEN 'Yes'
+            ELSE 'No'
+        END AS PreviousMaintenance,
+        CASE
+            WHEN EXISTS (
+                SELECT 1
+                FROM Maintenance AS PrevM
+                WHERE PrevM.VehicleID = M.VehicleID
+                AND PrevM.Date < M.Date
+            ) AND M.Mileage - LAG(M.Mileage) OVER (PARTITION BY M.VehicleID ORDER BY M.Date) < 5000 THEN 'Normal'
+            WHEN EXISTS (
+                SELECT 1
+                FROM Maintenance AS PrevM
+                WHERE PrevM.VehicleID = M.VehicleID
+                AND PrevM.Date < M.Date
+            ) AND M.Mileage - LAG(M.Mileage) OVER (PARTITION BY M.VehicleID ORDER BY M.Date) >= 5000 THEN 'Abnormal'
+            ELSE 'No Previous Maintenance'
+        END AS MaintenanceStatus,
+        COUNT(*) OVER (PARTITION BY M.VehicleID, M.MaintenanceType) AS "Maintenance Count"
+    FROM Maintenance AS M
+    WHERE M.Date >= ? AND M.Date < ? AND {where_clause_str};
+
+        ''', con=conn, params=dates.day_range(start_date, end_date) + params)
+
+
+def traffic_penalties(conn, start_date, end_date, filters=None):
+    where_clause_str, params = where_clause(filters, TRAFFIC_PENALTIES_FILTERS)
+    return pd.read_sql_query(f'''
+                SELECT
+                    TP.PenaltyID AS "Penalty ID",
+                    TP.Date,
+                    TP.VehicleID AS "Vehicle ID",
+                    VB.VehicleType AS "Vehicle Type",
+                    VA.Agency,
+                    VA.Condition,  -- Assuming there is a "Condition" column in the VehicleAllocation table
+                    TP.Location,
+                    COALESCE(PD.CategoryID, 0) AS "Category ID",
+                    COALESCE(PC.Label, '{penalties.UNKNOWN_LABEL}') AS "Description",
+                    TP.Desc AS "Original Description",
+                    TP.Cost,
+                    TP.CompanyCode AS "Company Code"
+                FROM TrafficPen TP
+                {_allocation_at('TP')}
+                LEFT JOIN VehicleBasics VB ON TP.VehicleID = VB.VehicleID
+                LEFT JOIN PenaltyDescriptions PD ON PD.Description = TP.Desc
+                LEFT JOIN PenaltyCategories PC ON PC.CategoryID = PD.CategoryID
+                WHERE TP.Date >= ? AND TP.Date < ? AND {where_clause_str};
+            ''', con=conn, params=dates.day_range(start_date, end_date) + params)
+
+
+def fetch_fuel_data(conn, start_date, end_date, filters=None):
+    where_clause_str, params = where_clause(filters, FUEL_DATA_FILTERS)
+    query = f'''
+        SELECT
+            F.FuelID AS "Fuel ID",
+            F.Date as "Date",
+            F.VehicleID AS "Vehicle ID",
+            VB.VehicleType AS "Vehicle Type",
+            VA.Agency,
+            F.Amount AS "Fuel Amount (Liters)",
+            F.Cost AS "Fuel Cost (EGP)"
+        FROM Fuel F
+        LEFT JOIN VehicleBasics VB ON F.VehicleID = VB.VehicleID
+        LEFT JOIN (
+            SELECT
+                VA1.VehicleID,
+                VA1.Agency,
+                ROW_NUMBER() OVER (PARTITION BY VA1.VehicleID ORDER BY VA1.AllocationID DESC) AS row_num
+            FROM VehicleAllocation VA1
+        ) VA ON F.VehicleID = VA.VehicleID AND VA.row_num = 1
+        WHERE F.Date >= ? AND F.Date < ? AND {where_clause_str}
+    '''
+    return pd.read_sql_query(query, con=conn, params=dates.day_range(start_date, end_date) + params)
+
+
+FRAUD_COLUMNS = ["Vehicle ID", "Vehicle Type", "Agency", "Days", "Fuel Amount (Liters)", "Fuel Efficiency (km/l)", "Expected Kilometers", "Exceeded 400 km per Day"]
+
+
+def detect_fuel_fraud(group):
+    group = group.sort_values(by="Date", ascending=False).head(4)
+    group["Days"] = (group["Date"].max() - group["Date"]).dt.days
+    grouppp = group.groupby(['Vehicle ID', 'Vehicle Type', 'Agency']).agg({'Days': 'max', 'Fuel Amount (Liters)': 'sum'}).reset_index()
+    grouppp['Fuel Amount (Liters)'] -= group['Fuel Amount (Liters)'].iloc[0]
+    group = grouppp
+    group["Fuel Efficiency (km/l)"] = 8
+    group["Expected Kilometers"] = ((group["Fuel Efficiency (km/l)"] * group["Fuel Amount (Liters)"]) / group["Days"])
+    group.replace([np.inf, -np.inf], np.nan, inplace=True)
+    group["Exceeded 400 km per Day"] = group["Expected Kilometers"] > 400
+    group = group.loc[group['Exceeded 400 km per Day']]
+    return group[FRAUD_COLUMNS].sort_values(by="Expected Kilometers")
+
+
+def fuel_fraud_data(conn, start_date, end_date, filters=None):
+    # Fuel data of the period prepared the way the Fuel Fraud report shows it
+    fuel_data = fetch_fuel_data(conn, start_date, end_date, filters)
+    fuel_data["Date"] = dates.to_datetime(fuel_data["Date"])
+    return fuel_data
+
+
+def fuel_fraud(fuel_data):
+    # Potential fuel fraud for every vehicle in the prepared fuel data. The groups are
+    # iterated explicitly because newer pandas drops the grouping column in apply().
+    flagged = [detect_fuel_fraud(group) for _, group in fuel_data.groupby("Vehicle ID")]
+    if not flagged:
+        return pd.DataFrame(columns=FRAUD_COLUMNS)
+    return pd.concat(flagged, ignore_index=True)
@@ -0,0 +1,50 @@
+"""Canonical storage format of the Date columns.
+
+Fuel, Maintenance and TrafficPen store their Date as ISO-8601 text
+'YYYY-MM-DD HH:MM:SS'. Text in this format sorts chronologically, so range
+filters are plain comparisons that can use the Date indexes, and pandas
+parses it with one fixed format.
+"""
+import datetime
+
+import pandas as pd
+
+FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Tables whose Date column is kept in the canonical format
+TABLES = ['Fuel', 'Maintenance', 'TrafficPen']
+
+# SQLite GLOB pattern of a canonical value, used by the insert triggers
+PATTERN = '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9] [0-9][0-9]:[0-9][0-9]:[0-9][0-9]'
+
+
+def canonical(value):
+    """``value`` (date, datetime, Timestamp or string) in the storage format."""
+    if isinstance(value, datetime.datetime):
+        return value.strftime(FORMAT)
+    if isinstance(value, datetime.date):
+        return datetime.datetime.combine(value, datetime.time()).strftime(FORMAT)
+    timestamp = pd.Timestamp(value)
+    if pd.isna(timestamp):
+        raise ValueError(f"Not a date: {value!r}")
+    return timestamp.strftime(FORMAT)
+
+
+def parse(value):
+    return datetime.datetime.strptime(value, FORMAT)
+
+
+def to_datetime(values):
+    # Parse a column of canonical values. A database that has not been
+    # migrated yet may still hold other formats.
+    try:
+        return pd.to_datetime(values, format=FORMAT)
+    except ValueError:
+        return pd.to_datetime(values, format='mixed')
+
+
+def day_range(start_date, end_date):
+    """Bounds for ``Date >= ? AND Date < ?`` covering the whole days from start to end."""
+    start = pd.Timestamp(start_date).normalize()
+    end = pd.Timestamp(end_date).normalize() + pd.Timedelta(days=1)
+    return [canonical(start), canonical(end)]
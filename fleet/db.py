@@ -0,0 +1,100 @@
+"""Connections to the fleet database."""
+import os
+import sqlite3
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+# The pages run from the repository root; FLEET_DB points jobs and benchmarks elsewhere
+DB_PATH = os.environ.get('FLEET_DB', 'fleet_management.db')
+
+
+def connect(path=None, check_same_thread=True):
+    return sqlite3.connect(path or DB_PATH, check_same_thread=check_same_thread)
+
+
+def enable_wal(path=None):
+    # WAL lets readers run alongside each other and alongside a writer. The
+    # mode is stored in the database file, so this only needs to run once.
+    conn = connect(path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.close()
+
+
+def checkpoint(conn):
+    # Fold the write-ahead log back into the main file, e.g. before copying it
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+
+def connect_readonly(path=None):
+    uri = 'file:' + urllib.parse.quote(os.path.abspath(path or DB_PATH)) + '?mode=ro'
+    return sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+
+class QueryPool:
+    """Runs independent read queries concurrently.
+
+    Every worker thread keeps its own read-only connection, so queries never
+    share a connection. SQLite releases the GIL while it executes a
+    statement, which is where these queries spend their time.
+    """
+
+    def __init__(self, path=None, max_workers=8):
+        self.path = path or DB_PATH
+        enable_wal(self.path)
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fleet-read')
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = connect_readonly(self.path)
+        return conn
+
+    def _call(self, func):
+        return func(self._connection())
+
+    def run(self, queries):
+        """Run ``{name: callable(conn)}`` concurrently and return ``{name: result}``."""
+        futures = {name: self._executor.submit(self._call, func) for name, func in queries.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+    def close(self):
+        self._executor.shutdown()
+
+
+def last_synced(conn, name):
+    # Highest source ID a derived table has seen (see DerivedState)
+    row = conn.execute("SELECT LastID FROM DerivedState WHERE Name = ?", (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def mark_synced(conn, name, last_id):
+    conn.execute("INSERT OR REPLACE INTO DerivedState (Name, LastID) VALUES (?, ?)", (name, last_id))
+
+
+def run_queries(source, queries):
+    # Concurrently on a QueryPool, one after another on a plain connection
+    if isinstance(source, QueryPool):
+        return source.run(queries)
+    return {name: func(source) for name, func in queries.items()}
+
+
+def data_version(path=None):
+    """Cheap fingerprint of the database contents.
+
+    Any committed write changes the modification time or size of the
+    database file or of its write-ahead log, so this string changes too.
+    """
+    path = path or DB_PATH
+    parts = []
+    for suffix in ('', '-wal'):
+        try:
+            stat = os.stat(path + suffix)
+        except FileNotFoundError:
+            continue
+        # The first reader creates an empty log; it holds nothing the main file doesn't
+        if suffix and not stat.st_size:
+            continue
+        parts.append(f"{stat.st_mtime_ns}-{stat.st_size}")
+    return ':'.join(parts)
@@ -0,0 +1,61 @@
+"""Cache of built Plotly figures.
+
+Pages rebuild the same figures on every rerun, even when only an unrelated
+widget changed. A figure is a pure function of its chart, the filters it was
+drawn with and the data, so it is cached under (chart id, filter params,
+data version) and served until the data changes.
+
+The cache keeps the built Figure objects rather than their JSON:
+st.plotly_chart re-validates a figure handed over as a dict, which costs as
+much as building it. Cached figures are shared between sessions and must
+not be modified after they are returned.
+"""
+import collections
+import json
+import threading
+
+
+def key(chart_id, params, version):
+    # Filter values may be dates or numbers; the key only needs to be stable
+    return chart_id, json.dumps(params or {}, sort_keys=True, default=str), version
+
+
+class FigureCache:
+    """Thread-safe LRU of figures, shared by all sessions of a server process."""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._figures = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chart_id, params, version, build):
+        """The figure cached under the key, or ``build()`` stored under it.
+
+        ``build`` is called without arguments and should do the aggregation
+        behind the chart as well, so a hit skips both.
+        """
+        cache_key = key(chart_id, params, version)
+        with self._lock:
+            if cache_key in self._figures:
+                self._figures.move_to_end(cache_key)
+                self.hits += 1
+                return self._figures[cache_key]
+            self.misses += 1
+        # Built outside the lock; two sessions missing at once both build, the last one is kept
+        figure = build()
+        with self._lock:
+            self._figures[cache_key] = figure
+            self._figures.move_to_end(cache_key)
+            while len(self._figures) > self.max_entries:
+                self._figures.popitem(last=False)
+        return figure
+
+    def clear(self):
+        with self._lock:
+            self._figures.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._figures), 'hits': self.hits, 'misses': self.misses}
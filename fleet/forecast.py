@@ -0,0 +1,168 @@
+"""Next preventive maintenance per vehicle.
+
+Preventive maintenance runs in a cycle of PM 10, PM 20, PM 30 and PM 40,
+one every SERVICE_INTERVAL_KM. ServiceForecast keeps, per vehicle, the last
+PM service, the next one in the cycle and the odometer it is due at, the
+vehicle's recent km per day from its Fuel odometer readings, and the date
+the due odometer will be reached at that rate.
+
+The prediction only depends on the vehicle's own history, so ``sync``
+recomputes just the vehicles with Fuel or Maintenance rows added since the
+last sync.
+
+    python -m fleet.forecast --db fleet_management.db --rebuild
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from fleet import dates, migrations
+from fleet.data import where_clause
+from fleet.db import DB_PATH, connect, last_synced, mark_synced
+
+SOURCES = {'Fuel': 'FuelID', 'Maintenance': 'MaintenanceID'}
+
+PM_CYCLE = ['PM 10', 'PM 20', 'PM 30', 'PM 40']
+SERVICE_INTERVAL_KM = 10000
+
+# The mileage rate is taken over the readings of the last RATE_WINDOW_DAYS
+# before a vehicle's latest reading; shorter spans are too noisy
+RATE_WINDOW_DAYS = 90
+MIN_RATE_SPAN_DAYS = 7
+
+COLUMNS = ['VehicleID', 'LastService', 'LastServiceDate', 'LastServiceMileage', 'NextService', 'DueMileage',
+           'Odometer', 'OdometerDate', 'KmPerDay', 'PredictedDate']
+
+DUE_SOON_FILTERS = {'vehicle_id': 'SF.VehicleID', 'agency': 'A.Agency', 'chassis': 'VB.ChassisNo', 'vehicle_type': 'VB.VehicleType'}
+
+
+def _frame(conn, query, vehicle_ids):
+    df = pd.read_sql_query(query.format(vehicles=', '.join('?' * len(vehicle_ids))), conn, params=vehicle_ids)
+    df['Date'] = pd.to_datetime(df['Date'], format=dates.FORMAT, errors='coerce')
+    df['Mileage'] = pd.to_numeric(df['Mileage'], errors='coerce')
+    return df.dropna(subset=['Date', 'Mileage']).loc[lambda df: df['Mileage'] > 0]
+
+
+def mileage_rates(fuel):
+    """Km per day of every vehicle in ``fuel`` (VehicleID, Date, Mileage)."""
+    last = fuel.groupby('VehicleID')['Date'].transform('max')
+    recent = fuel.loc[fuel['Date'] >= last - pd.Timedelta(days=RATE_WINDOW_DAYS)]
+    spans = recent.groupby('VehicleID').agg(first=('Date', 'min'), last=('Date', 'max'),
+                                           low=('Mileage', 'min'), high=('Mileage', 'max'))
+    days = (spans['last'] - spans['first']).dt.total_seconds() / 86400
+    return ((spans['high'] - spans['low']) / days).where(days >= MIN_RATE_SPAN_DAYS)
+
+
+def build(services, readings, fuel):
+    """Forecast rows of the vehicles in ``readings``.
+
+    ``services`` holds the PM services and ``readings`` every odometer reading
+    (Fuel and Maintenance), both with VehicleID, Date and Mileage.
+    """
+    latest = readings.sort_values('Date').groupby('VehicleID').agg(Odometer=('Mileage', 'max'), OdometerDate=('Date', 'last'))
+    last_pm = services.sort_values(['Date', 'Mileage']).groupby('VehicleID').last()
+    df = latest.join(last_pm.rename(columns={'MaintenanceType': 'LastService', 'Date': 'LastServiceDate',
+                                             'Mileage': 'LastServiceMileage'}))
+    df['KmPerDay'] = mileage_rates(fuel).reindex(df.index)
+
+    # Next service in the cycle; vehicles without one start at PM 10 on the next interval
+    position = df['LastService'].map({service: number for number, service in enumerate(PM_CYCLE)})
+    df['NextService'] = [PM_CYCLE[int((number + 1) % len(PM_CYCLE))] if pd.notna(number) else PM_CYCLE[0] for number in position]
+    df['DueMileage'] = np.where(df['LastServiceMileage'].notna(), df['LastServiceMileage'] + SERVICE_INTERVAL_KM,
+                                (df['Odometer'] // SERVICE_INTERVAL_KM + 1) * SERVICE_INTERVAL_KM)
+
+    # Overdue vehicles are due at their latest reading
+    remaining = (df['DueMileage'] - df['Odometer']).clip(lower=0)
+    days = (remaining / df['KmPerDay'].where(df['KmPerDay'] > 0)).clip(upper=3650)
+    df['PredictedDate'] = (df['OdometerDate'] + pd.to_timedelta(days, unit='D')).dt.strftime('%Y-%m-%d')
+    df['LastServiceDate'] = df['LastServiceDate'].dt.strftime(dates.FORMAT)
+    df['OdometerDate'] = df['OdometerDate'].dt.strftime(dates.FORMAT)
+    df['KmPerDay'] = df['KmPerDay'].round(1)
+    df = df.reset_index()
+    return df[COLUMNS].astype(object).where(df[COLUMNS].notna(), None)
+
+
+def rebuild_vehicles(conn, vehicle_ids):
+    # Replace the forecast of the given vehicles. The caller commits.
+    vehicle_ids = list(vehicle_ids)
+    placeholders = ', '.join('?' * len(COLUMNS))
+    for offset in range(0, len(vehicle_ids), 500):
+        chunk = vehicle_ids[offset:offset + 500]
+        fuel = _frame(conn, "SELECT VehicleID, Date, Mileage FROM Fuel WHERE VehicleID IN ({vehicles})", chunk)
+        maintenance = _frame(conn, "SELECT VehicleID, Date, Mileage, MaintenanceType FROM Maintenance WHERE VehicleID IN ({vehicles})", chunk)
+        services = maintenance.loc[maintenance['MaintenanceType'].isin(PM_CYCLE)]
+        readings = pd.concat([fuel, maintenance[['VehicleID', 'Date', 'Mileage']]], ignore_index=True)
+
+        conn.execute(f"DELETE FROM ServiceForecast WHERE VehicleID IN ({', '.join('?' * len(chunk))})", chunk)
+        conn.executemany(f"INSERT INTO ServiceForecast ({', '.join(COLUMNS)}) VALUES ({placeholders})",
+                         build(services, readings, fuel).itertuples(index=False, name=None))
+
+
+def sync(conn):
+    """Recompute the vehicles with Fuel or Maintenance rows added since the last sync.
+
+    Returns the number of vehicles recomputed. The caller commits.
+    """
+    marks = {}
+    vehicles = set()
+    for table, id_column in SOURCES.items():
+        since = last_synced(conn, f'forecast.{table}')
+        rows = conn.execute(f"SELECT {id_column}, VehicleID FROM {table} WHERE {id_column} > ?", (since,)).fetchall()
+        if rows:
+            marks[table] = max(row[0] for row in rows)
+            vehicles.update(row[1] for row in rows if row[1] is not None)
+    # Nothing is written when there is nothing new, so the data version stays the same
+    rebuild_vehicles(conn, sorted(vehicles))
+    for table, last_id in marks.items():
+        mark_synced(conn, f'forecast.{table}', last_id)
+    return len(vehicles)
+
+
+def rebuild(conn):
+    conn.execute("DELETE FROM ServiceForecast")
+    for table in SOURCES:
+        mark_synced(conn, f'forecast.{table}', 0)
+    return sync(conn)
+
+
+def due_soon(conn, days, filters=None, as_of=None):
+    """Vehicles whose next PM service is predicted within ``days`` days, soonest first."""
+    where_clause_str, params = where_clause(filters, DUE_SOON_FILTERS)
+    as_of = pd.Timestamp(as_of if as_of is not None else pd.Timestamp.now()).strftime('%Y-%m-%d')
+    return pd.read_sql_query(f'''
+        SELECT
+            SF.VehicleID AS "Vehicle ID",
+            VB.VehicleType AS "Vehicle Type",
+            A.Agency,
+            SF.NextService AS "Next Service",
+            SF.PredictedDate AS "Predicted Date",
+            CAST(julianday(SF.PredictedDate) - julianday(?) AS INTEGER) AS "Days Left",
+            SF.DueMileage AS "Due At (KM)",
+            SF.Odometer AS "Last Odometer",
+            SF.KmPerDay AS "KM per Day",
+            SF.LastService AS "Last Service",
+            SF.LastServiceDate AS "Last Service Date"
+        FROM ServiceForecast SF
+        JOIN VehicleBasics VB ON SF.VehicleID = VB.VehicleID
+        LEFT JOIN VehicleActivity A ON SF.VehicleID = A.VehicleID
+        WHERE SF.PredictedDate <= DATE(?, '+' || ? || ' days') AND {where_clause_str}
+        ORDER BY SF.PredictedDate
+    ''', conn, params=[as_of, as_of, int(days)] + params)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bring the preventive maintenance forecast up to date")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--rebuild', action='store_true', help="Recompute the forecast of every vehicle")
+    args = parser.parse_args()
+    conn = connect(args.db)
+    migrations.migrate(conn)
+    with conn:
+        vehicles = rebuild(conn) if args.rebuild else sync(conn)
+    conn.close()
+    print(f"Forecast {vehicles} vehicles")
+
+
+if __name__ == '__main__':
+    main()
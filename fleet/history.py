@@ -0,0 +1,162 @@
+"""Validity intervals of the vehicle state, and the fleet as of any date.
+
+VehicleAllocation, VehiclesLicenses and Ownership keep every change, and
+the current state is their latest row. For the state on a past date, every
+row gets the interval it was in force: from its own date (the allocation
+Date, the license StartDate, the ownership UploadDate) up to the date of the
+next row of the same vehicle, ordered by date and then ID. AllocationHistory,
+LicenseHistory and OwnershipHistory keep these intervals, in the canonical
+date format, indexed by (VehicleID, ValidFrom); ValidTo is NULL for the row
+in force today. The state at a moment is then one indexed lookup per
+vehicle instead of a ranking over the whole history. A vehicle has no state
+before its first row, as for the penalty hotspots (fleet.hotspots).
+
+The tables are kept up to date incrementally: ``sync`` recomputes the
+intervals of just the vehicles that got new rows since the last sync.
+Edited or deleted rows need ``rebuild``.
+
+    python -m fleet.history --as-of 2025-12-31 --out close-2025-12.csv
+    python -m fleet.history --db fleet_management.db --rebuild
+"""
+import argparse
+
+import pandas as pd
+
+from fleet import dates, migrations
+from fleet.data import where_clause
+from fleet.db import DB_PATH, connect, last_synced, mark_synced
+
+SOURCES = {'VehicleAllocation': 'AllocationID', 'VehiclesLicenses': 'LicenseID', 'Ownership': 'OwnershipID'}
+
+# Source table -> (interval table, column the row comes into force on)
+INTERVALS = {
+    'VehicleAllocation': ('AllocationHistory', 'Date'),
+    'VehiclesLicenses': ('LicenseHistory', 'StartDate'),
+    'Ownership': ('OwnershipHistory', 'UploadDate'),
+}
+
+AS_OF_FILTERS = {'vehicle_id': 'VB.VehicleID', 'agency': 'VA.Agency', 'chassis': 'VB.ChassisNo', 'vehicle_type': 'VB.VehicleType'}
+
+
+def _insert_intervals(conn, table, vehicle_ids=None):
+    history, date_column = INTERVALS[table]
+    id_column = SOURCES[table]
+    vehicles = f"AND VehicleID IN ({', '.join('?' * len(vehicle_ids))})" if vehicle_ids is not None else ''
+    # datetime() puts every stored date format in the canonical one; rows without a usable date are left out
+    conn.execute(f'''
+        INSERT INTO {history} ({id_column}, VehicleID, ValidFrom, ValidTo)
+        SELECT
+            {id_column},
+            VehicleID,
+            ValidFrom,
+            LEAD(ValidFrom) OVER (PARTITION BY VehicleID ORDER BY ValidFrom, {id_column})
+        FROM (
+            SELECT {id_column}, VehicleID, datetime({date_column}) AS ValidFrom
+            FROM {table}
+            WHERE VehicleID IS NOT NULL {vehicles}
+        )
+        WHERE ValidFrom IS NOT NULL
+    ''', list(vehicle_ids or []))
+
+
+def sync(conn):
+    """Recompute the intervals of the vehicles with rows added since the last sync.
+
+    Returns the number of vehicles touched. The caller commits.
+    """
+    touched = 0
+    for table, id_column in SOURCES.items():
+        history = INTERVALS[table][0]
+        since = last_synced(conn, f'history.{table}')
+        last_id = conn.execute(f"SELECT MAX({id_column}) FROM {table}").fetchone()[0] or 0
+        # Nothing is written when there is nothing new, so the data version stays the same
+        if last_id <= since:
+            continue
+        if since == 0:
+            conn.execute(f"DELETE FROM {history}")
+            _insert_intervals(conn, table)
+            touched += conn.execute(f"SELECT COUNT(DISTINCT VehicleID) FROM {history}").fetchone()[0]
+        else:
+            # A new row may come before older ones of its vehicle, so the vehicle's intervals are redone
+            vehicles = [row[0] for row in conn.execute(
+                f"SELECT DISTINCT VehicleID FROM {table} WHERE {id_column} > ? AND VehicleID IS NOT NULL", (since,))]
+            for offset in range(0, len(vehicles), 500):
+                chunk = vehicles[offset:offset + 500]
+                conn.execute(f"DELETE FROM {history} WHERE VehicleID IN ({', '.join('?' * len(chunk))})", chunk)
+                _insert_intervals(conn, table, chunk)
+            touched += len(vehicles)
+        mark_synced(conn, f'history.{table}', last_id)
+    return touched
+
+
+def rebuild(conn):
+    for table in SOURCES:
+        mark_synced(conn, f'history.{table}', 0)
+    return sync(conn)
+
+
+def as_of(conn, day, filters=None):
+    """Allocation, license and ownership of every vehicle at the end of ``day``.
+
+    "Licence Valid" tells whether the license in force covered ``day``; it is
+    empty for vehicles without a license by then.
+    """
+    where_clause_str, params = where_clause(filters, AS_OF_FILTERS)
+    day = pd.Timestamp(day).strftime('%Y-%m-%d')
+    # Rows dated during the day count, so the moment is the start of the next day
+    moment = dates.day_range(day, day)[1]
+    return pd.read_sql_query(f'''
+        SELECT
+            VB.VehicleID AS "Vehicle ID",
+            VB.ChassisNo AS "Chassis No.",
+            VB.VehicleType AS "Vehicle Type",
+            VA.Agency AS "Agency",
+            VA.Branch AS "Branch",
+            VA.Condition AS "Condition",
+            VL.StartDate AS "Licence Start Date",
+            VL.EndDate AS "Licence End Date",
+            CASE
+                WHEN VL.LicenseID IS NULL THEN NULL
+                WHEN DATE(VL.EndDate) >= DATE(?) THEN 'Yes'
+                ELSE 'No'
+            END AS "Licence Valid",
+            O.Ownership AS "Ownership"
+        FROM VehicleBasics VB
+        LEFT JOIN AllocationHistory AH
+            ON AH.VehicleID = VB.VehicleID AND AH.ValidFrom < ? AND (AH.ValidTo IS NULL OR AH.ValidTo >= ?)
+        LEFT JOIN VehicleAllocation VA ON VA.AllocationID = AH.AllocationID
+        LEFT JOIN LicenseHistory LH
+            ON LH.VehicleID = VB.VehicleID AND LH.ValidFrom < ? AND (LH.ValidTo IS NULL OR LH.ValidTo >= ?)
+        LEFT JOIN VehiclesLicenses VL ON VL.LicenseID = LH.LicenseID
+        LEFT JOIN OwnershipHistory OH
+            ON OH.VehicleID = VB.VehicleID AND OH.ValidFrom < ? AND (OH.ValidTo IS NULL OR OH.ValidTo >= ?)
+        LEFT JOIN Ownership O ON O.OwnershipID = OH.OwnershipID
+        WHERE {where_clause_str}
+        ORDER BY VB.VehicleID
+    ''', conn, params=[day] + [moment] * 6 + params)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bring the state intervals up to date, or print the fleet as of a date")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--rebuild', action='store_true', help="Rebuild the intervals from the whole history")
+    parser.add_argument('--as-of', metavar='YYYY-MM-DD', help="Fleet state at the end of this day")
+    parser.add_argument('--out', help="CSV file for the --as-of state instead of printing it")
+    args = parser.parse_args()
+    conn = connect(args.db)
+    migrations.migrate(conn)
+    with conn:
+        vehicles = rebuild(conn) if args.rebuild else sync(conn)
+    print(f"Updated the intervals of {vehicles} vehicles")
+    if args.as_of:
+        state = as_of(conn, args.as_of)
+        if args.out:
+            state.to_csv(args.out, index=False)
+            print(f"Wrote the state of {len(state)} vehicles as of {args.as_of} to {args.out}")
+        else:
+            print(state.to_string(index=False))
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
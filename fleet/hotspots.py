@@ -0,0 +1,173 @@
+"""Traffic penalty hotspots by location.
+
+TrafficPen.Location is free text; the same road shows up with stray spaces
+and spelling variants ("الدائرى"/"الدائري"). Locations are normalized like
+the penalty descriptions (fleet.penalties.normalize) and the penalties are
+rolled up per (location, week, agency) into PenaltyHotspots. Weeks start on
+Monday. The agency is the one the vehicle was allocated to on the day of the
+penalty. New penalties are simply added to their row; a new allocation that
+some rolled-up penalty falls after (a back-dated one, say) changes the agency
+of that penalty, so the rollup is rebuilt. Edited or deleted allocations and
+penalties need ``rebuild``, which the SQL Queries page runs for them
+(fleet.writes.after_statement).
+
+    python -m fleet.hotspots --db fleet_management.db --rebuild
+"""
+import argparse
+
+import pandas as pd
+
+from fleet import dates, migrations
+from fleet.data import where_clause
+from fleet.db import DB_PATH, connect, last_synced, mark_synced
+from fleet.penalties import normalize
+
+SOURCES = {'TrafficPen': 'PenaltyID', 'VehicleAllocation': 'AllocationID'}
+
+HOTSPOT_FILTERS = {'agency': 'H.Agency'}
+
+UNALLOCATED = 'Unallocated'
+
+NEW_PENALTIES_QUERY = f'''
+    SELECT
+        TP.PenaltyID,
+        TP.Location,
+        DATE(TP.Date, '-6 days', 'weekday 1') AS Week,
+        COALESCE((
+            SELECT VA.Agency FROM VehicleAllocation VA
+            WHERE VA.VehicleID = TP.VehicleID AND VA.Date <= DATE(TP.Date)
+            ORDER BY VA.Date DESC, VA.AllocationID DESC LIMIT 1
+        ), '{UNALLOCATED}') AS Agency,
+        COALESCE(TP.Cost, 0) AS Cost
+    FROM TrafficPen TP
+    WHERE TP.PenaltyID > ? AND TP.Date IS NOT NULL
+    ORDER BY TP.PenaltyID
+'''
+
+
+def location_key(location):
+    return normalize(location) if location is not None and str(location).strip() else None
+
+
+def _reallocated(conn):
+    # Whether an allocation added since the last sync covers a penalty already rolled up
+    since = last_synced(conn, 'hotspots.VehicleAllocation')
+    last_id = conn.execute("SELECT MAX(AllocationID) FROM VehicleAllocation").fetchone()[0] or 0
+    if last_id <= since:
+        return False
+    covered = conn.execute('''
+        SELECT 1
+        FROM VehicleAllocation VA
+        JOIN TrafficPen TP ON TP.VehicleID = VA.VehicleID AND VA.Date <= DATE(TP.Date)
+        WHERE VA.AllocationID > ? AND TP.PenaltyID <= ?
+        LIMIT 1
+    ''', (since, last_synced(conn, 'hotspots.TrafficPen'))).fetchone()
+    mark_synced(conn, 'hotspots.VehicleAllocation', last_id)
+    return covered is not None
+
+
+def sync(conn):
+    """Add the penalties recorded since the last sync to the rollup.
+
+    The whole rollup is redone when a new allocation moves penalties already
+    in it to another agency. Returns the number of penalties added. The
+    caller commits.
+    """
+    if _reallocated(conn):
+        conn.execute("DELETE FROM PenaltyHotspots")
+        mark_synced(conn, 'hotspots.TrafficPen', 0)
+    since = last_synced(conn, 'hotspots.TrafficPen')
+    new = pd.read_sql_query(NEW_PENALTIES_QUERY, conn, params=[since])
+    last_id = conn.execute("SELECT MAX(PenaltyID) FROM TrafficPen").fetchone()[0] or 0
+    # Nothing is written when there is nothing new, so the data version stays the same
+    if last_id <= since:
+        return 0
+
+    new['LocationKey'] = new['Location'].map(location_key)
+    new = new.dropna(subset=['LocationKey'])
+    # The first spelling seen of a location is the one shown
+    labels = new.drop_duplicates('LocationKey')
+    conn.executemany("INSERT OR IGNORE INTO PenaltyLocations (LocationKey, Location) VALUES (?, ?)",
+                     list(zip(labels['LocationKey'], labels['Location'].str.strip())))
+    rollup = new.groupby(['LocationKey', 'Week', 'Agency'])['Cost'].agg(['size', 'sum']).reset_index()
+    conn.executemany('''
+        INSERT INTO PenaltyHotspots (LocationKey, Week, Agency, Penalties, Cost) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (LocationKey, Week, Agency) DO UPDATE SET
+            Penalties = Penalties + excluded.Penalties,
+            Cost = Cost + excluded.Cost
+    ''', [(key, week, agency, int(size), float(cost)) for key, week, agency, size, cost in rollup.itertuples(index=False, name=None)])
+    mark_synced(conn, 'hotspots.TrafficPen', last_id)
+    return len(new)
+
+
+def rebuild(conn):
+    conn.execute("DELETE FROM PenaltyHotspots")
+    conn.execute("DELETE FROM PenaltyLocations")
+    for table in SOURCES:
+        mark_synced(conn, f'hotspots.{table}', 0)
+    return sync(conn)
+
+
+def _weeks(start_date, end_date):
+    # Weeks overlapping the days from start to end
+    start = pd.Timestamp(start_date).normalize()
+    start -= pd.Timedelta(days=start.weekday())
+    return [start.strftime('%Y-%m-%d'), dates.day_range(start_date, end_date)[1][:10]]
+
+
+def top_locations(conn, start_date, end_date, filters=None, limit=10):
+    """Locations with the most penalty cost in the weeks from start to end."""
+    where_clause_str, params = where_clause(filters, HOTSPOT_FILTERS)
+    return pd.read_sql_query(f'''
+        SELECT
+            H.LocationKey,
+            L.Location,
+            SUM(H.Penalties) AS Penalties,
+            SUM(H.Cost) AS Cost
+        FROM PenaltyHotspots H
+        JOIN PenaltyLocations L ON L.LocationKey = H.LocationKey
+        WHERE H.Week >= ? AND H.Week < ? AND {where_clause_str}
+        GROUP BY H.LocationKey
+        ORDER BY Cost DESC, Penalties DESC
+        LIMIT ?
+    ''', conn, params=_weeks(start_date, end_date) + params + [limit])
+
+
+def weekly(conn, start_date, end_date, location_keys, filters=None):
+    """Penalties and cost per week of the given locations."""
+    if not location_keys:
+        return pd.DataFrame(columns=['Week', 'Location', 'Penalties', 'Cost'])
+    where_clause_str, params = where_clause(filters, HOTSPOT_FILTERS)
+    df = pd.read_sql_query(f'''
+        SELECT
+            H.Week,
+            L.Location,
+            SUM(H.Penalties) AS Penalties,
+            SUM(H.Cost) AS Cost
+        FROM PenaltyHotspots H
+        JOIN PenaltyLocations L ON L.LocationKey = H.LocationKey
+        WHERE H.Week >= ? AND H.Week < ?
+        AND H.LocationKey IN ({', '.join('?' * len(location_keys))})
+        AND {where_clause_str}
+        GROUP BY H.Week, H.LocationKey
+        ORDER BY H.Week
+    ''', conn, params=_weeks(start_date, end_date) + list(location_keys) + params)
+    df['Week'] = pd.to_datetime(df['Week'])
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bring the penalty hotspot rollup up to date")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--rebuild', action='store_true', help="Rebuild the rollup from the whole penalty history")
+    args = parser.parse_args()
+    conn = connect(args.db)
+    migrations.migrate(conn)
+    with conn:
+        penalties = rebuild(conn) if args.rebuild else sync(conn)
+    conn.close()
+    print(f"Rolled up {penalties} penalties")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,338 @@
+"""Batched ingestion of the fuel card and traffic penalty feeds.
+
+Feeds POST batches of rows as JSON (a list of objects, or ``{"rows": [...]}``)
+or as CSV with a header line:
+
+    POST /fuel        Date, VehicleID, Mileage, Type, Amount, Cost
+    POST /penalties   VehicleID, Date, Location, Desc, Cost, CompanyCode
+
+Rows get the same treatment as an import on the Data Insert page: plate
+numbers are transliterated and rearranged (writes.transform_and_rearrange),
+dates are stored in the canonical format and rows of vehicles missing from
+VehicleBasics are rejected. Rows already stored are skipped (see
+migrations.NATURAL_KEYS), so a feed can resend a batch safely. The response
+tells how many rows were stored, how many were already there and why the
+others were not.
+
+Every write goes through one writer. It takes all submissions waiting in its
+queue (after BATCH_WINDOW seconds, up to MAX_BATCH_ROWS rows) and stores them
+in one transaction together with their journal entries (fleet.journal) and
+derived tables, so many small submissions from concurrent feeds share one
+commit and one derived-table sync. A submission is answered once its transaction is committed.
+
+    python -m fleet.ingest --port 8001
+    python -m fleet.ingest --db bench/ingest.db --bench --senders 20 --submissions 50 --rows 10
+
+The benchmark posts generated feed batches from concurrent senders through
+the app in-process and writes them into ``--db``, so point it at a copy.
+"""
+import argparse
+import asyncio
+import csv
+import datetime
+import io
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fleet import api, journal, migrations, synthetic, writes
+from fleet.db import DB_PATH, connect, enable_wal
+
+FEEDS = {
+    'Fuel': ['Date', 'VehicleID', 'Mileage', 'Type', 'Amount', 'Cost'],
+    'TrafficPen': ['VehicleID', 'Date', 'Location', 'Desc', 'Cost', 'CompanyCode'],
+}
+
+FEED_PATHS = {'/fuel': 'Fuel', '/penalties': 'TrafficPen'}
+
+BATCH_WINDOW = 0.02
+MAX_BATCH_ROWS = 5000
+
+
+def parse(body, content_type):
+    """Records (dicts) of a JSON or CSV payload."""
+    if 'csv' in content_type:
+        return list(csv.DictReader(io.StringIO(body.decode('utf-8-sig'))))
+    payload = json.loads(body)
+    if isinstance(payload, dict):
+        payload = payload.get('rows')
+    if not isinstance(payload, list):
+        raise ValueError("Expected a list of rows")
+    return payload
+
+
+def _value(value):
+    # CSV cells are strings; empty cells are missing values
+    if isinstance(value, str):
+        value = value.strip()
+    return None if value == '' else value
+
+
+def prepare(table, records):
+    """Rows of ``table`` ready to insert, and the records rejected with their error."""
+    rows = []
+    rejected = []
+    for record in records:
+        try:
+            if not isinstance(record, dict):
+                raise ValueError("Not a row")
+            row = {column: _value(record.get(column)) for column in FEEDS[table]}
+            if row['VehicleID'] is None or row['Date'] is None:
+                raise ValueError("VehicleID and Date are required")
+            row['VehicleID'] = writes.transform_and_rearrange(row['VehicleID'])
+            rows.append(writes.normalize(table, row))
+        except ValueError as e:
+            rejected.append({'row': record, 'error': str(e)})
+    return rows, rejected
+
+
+def write_batch(conn, submissions):
+    """Store ``[(table, records)]`` in one transaction.
+
+    Returns ``{'stored': count, 'duplicates': count, 'rejected': [...]}`` per submission.
+    """
+    prepared = [prepare(table, records) for table, records in submissions]
+    known = writes.existing_vehicles(conn, {row['VehicleID'] for rows, _ in prepared for row in rows})
+    results = []
+    with conn:
+        for (table, _), (rows, rejected) in zip(submissions, prepared):
+            valid = [row for row in rows if row['VehicleID'] in known]
+            rejected += [{'row': row, 'error': f"Vehicle with ID {row['VehicleID']} does not exist in VehicleBasics"}
+                         for row in rows if row['VehicleID'] not in known]
+            # Everything above the highest rowid before the insert is this submission's
+            before = conn.execute(f"SELECT IFNULL(MAX(rowid), 0) FROM {table}").fetchone()[0]
+            inserted = conn.executemany(
+                f"INSERT INTO {table} ({', '.join(FEEDS[table])}) VALUES ({', '.join('?' * len(FEEDS[table]))}) ON CONFLICT DO NOTHING",
+                [[row[column] for column in FEEDS[table]] for row in valid]
+            ).rowcount
+            if inserted:
+                last_rowid = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+                journal.record_rows(conn, table, before + 1, last_rowid)
+            results.append({'stored': inserted, 'duplicates': len(valid) - inserted, 'rejected': rejected})
+        for table in sorted({table for table, _ in submissions}):
+            writes.update_derived(conn, table)
+    return results
+
+
+class Writer:
+    """Single writer that stores queued submissions in batches.
+
+    The connection lives on one worker thread; the event loop only queues
+    submissions and waits for their transaction.
+    """
+
+    def __init__(self, db_path=None, batch_window=BATCH_WINDOW, max_batch_rows=MAX_BATCH_ROWS):
+        self.db_path = db_path or DB_PATH
+        self.batch_window = batch_window
+        self.max_batch_rows = max_batch_rows
+        self.transactions = 0
+        self.submissions = 0
+        self._queue = None
+        self._task = None
+        self._conn = None
+        self._executor = None
+
+    def start(self):
+        enable_wal(self.db_path)
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='fleet-ingest')
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, table, records):
+        if self._task is None:
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((table, records, future))
+        return await future
+
+    def _write(self, submissions):
+        if self._conn is None:
+            self._conn = connect(self.db_path)
+        return write_batch(self._conn, submissions)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            if self.batch_window:
+                await asyncio.sleep(self.batch_window)
+            # Whatever arrived meanwhile, including while the last batch was written, joins this one
+            rows = len(batch[0][1])
+            while rows < self.max_batch_rows and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                rows += len(batch[-1][1])
+            # Submitters cancelled while waiting (client gone, timeout) got no answer, so their rows are not written
+            batch = [submission for submission in batch if not submission[2].done()]
+            if not batch:
+                continue
+            try:
+                results = await loop.run_in_executor(self._executor, self._write, [(table, records) for table, records, _ in batch])
+            except Exception as e:
+                # The batch fails, the writer goes on with the next one
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.transactions += 1
+            self.submissions += len(batch)
+            for (_, _, future), result in zip(batch, results):
+                # Cancelled while the batch was written: its rows are stored, nobody waits for the answer
+                if not future.done():
+                    future.set_result(result)
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        if self._conn is not None:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._conn.close)
+        self._executor.shutdown()
+        self._task = self._conn = None
+
+
+class Ingest:
+    """ASGI application accepting the feeds at FEED_PATHS."""
+
+    def __init__(self, db_path=None, batch_window=BATCH_WINDOW, max_batch_rows=MAX_BATCH_ROWS):
+        self.writer = Writer(db_path, batch_window, max_batch_rows)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while (await receive())['type'] != 'lifespan.shutdown':
+                await send({'type': 'lifespan.startup.complete'})
+            await self.writer.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+        table = FEED_PATHS.get(scope['path'])
+        if table is None:
+            return await _reply(send, 404, {'error': f"Unknown path {scope['path']}; one of {', '.join(FEED_PATHS)}"})
+        if scope['method'] != 'POST':
+            return await _reply(send, 405, {'error': "Only POST is supported"})
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        try:
+            records = parse(body, api.request_headers(scope).get('content-type', ''))
+        except ValueError as e:
+            return await _reply(send, 400, {'error': str(e)})
+        await _reply(send, 200, await self.writer.submit(table, records))
+
+
+async def _reply(send, status, payload):
+    await api.respond(send, status, [('content-type', api.JSON_TYPE)],
+                      json.dumps(payload, default=str, ensure_ascii=False).encode('utf-8'))
+
+
+def feed(rng, table, vehicles, rows, now):
+    """Stand-in for a fuel card or traffic department export of ``rows`` rows.
+
+    Plates come spaced and cased the way they are typed, and about one row in
+    fifty is for a vehicle the fleet doesn't have. ``vehicles`` maps the
+    vehicle IDs to their odometer, which fuel rows move forward.
+    """
+    records = []
+    for _ in range(rows):
+        vehicle_id = rng.choice(list(vehicles))
+        letters = vehicle_id.rstrip('0123456789')
+        plate = rng.choice([vehicle_id, f"{letters.lower()} {vehicle_id[len(letters):]}", f"{vehicle_id[len(letters):]} {letters}"])
+        if rng.random() < 0.02:
+            plate = f"ZZ {rng.randint(100, 9999)}"
+        stamp = (now - datetime.timedelta(minutes=rng.randint(0, 60 * 24))).strftime('%Y-%m-%d %H:%M:%S')
+        if table == 'Fuel':
+            vehicles[vehicle_id] += rng.randint(50, 400)
+            liters = round(rng.uniform(20, 80), 1)
+            records.append({'Date': stamp, 'VehicleID': plate, 'Mileage': vehicles[vehicle_id], 'Type': 'Benzine 92',
+                            'Amount': liters, 'Cost': round(liters * synthetic.fuel_price(now), 2)})
+        else:
+            description, cost = rng.choice(synthetic.PENALTIES)
+            records.append({'VehicleID': plate, 'Date': stamp, 'Location': rng.choice(synthetic.PENALTY_LOCATIONS),
+                            'Desc': description, 'Cost': cost, 'CompanyCode': 'JT'})
+    return records
+
+
+async def _send_all(app, payloads):
+    # One sender posting its payloads one after another
+    counts = {'stored': 0, 'duplicates': 0, 'rejected': 0}
+    for path, body in payloads:
+        status, _, response = await api.request(app, path, {'content-type': api.JSON_TYPE}, 'POST', body)
+        result = json.loads(response)
+        if status != 200:
+            raise RuntimeError(result['error'])
+        counts['stored'] += result['stored']
+        counts['duplicates'] += result['duplicates']
+        counts['rejected'] += len(result['rejected'])
+    return counts
+
+
+async def _bench_run(app, payloads):
+    started = time.perf_counter()
+    counts = await asyncio.gather(*(_send_all(app, sender) for sender in payloads))
+    seconds = time.perf_counter() - started
+    await app.writer.close()
+    report = {name: sum(count[name] for count in counts) for name in counts[0]}
+    report['rows'] = sum(report.values())
+    report.update({'seconds': round(seconds, 3), 'rows_per_sec': round(report['rows'] / seconds, 1),
+                   'transactions': app.writer.transactions,
+                   'submissions_per_transaction': round(app.writer.submissions / max(app.writer.transactions, 1), 1)})
+    return report
+
+
+def bench(db_path, senders=20, submissions=50, rows=10, seed=7):
+    """Throughput of the batched writer and of one transaction per submission.
+
+    Half of the senders post fuel, the other half penalties.
+    """
+    conn = connect(db_path)
+    vehicles = dict(conn.execute('''
+        SELECT VB.VehicleID, COALESCE(MAX(F.Mileage), 0) FROM VehicleBasics VB
+        LEFT JOIN Fuel F ON F.VehicleID = VB.VehicleID GROUP BY VB.VehicleID
+    ''').fetchall())
+    conn.close()
+    rng = random.Random(seed)
+    now = datetime.datetime.now()
+    report = {}
+    for name, options in (('batched', {}), ('per submission', {'batch_window': 0, 'max_batch_rows': 1})):
+        payloads = [[(path, json.dumps(feed(rng, FEED_PATHS[path], vehicles, rows, now)).encode('utf-8'))
+                     for _ in range(submissions)]
+                    for path in (list(FEED_PATHS)[sender % 2] for sender in range(senders))]
+        report[name] = asyncio.run(_bench_run(Ingest(db_path, **options), payloads))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Accept batched fuel and traffic penalty feeds over HTTP")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--batch-window', type=float, default=BATCH_WINDOW, help="Seconds the writer waits for more submissions")
+    parser.add_argument('--bench', action='store_true', help="Measure throughput with generated feeds instead of serving")
+    parser.add_argument('--senders', type=int, default=20)
+    parser.add_argument('--submissions', type=int, default=50, help="Submissions per sender")
+    parser.add_argument('--rows', type=int, default=10, help="Rows per submission")
+    args = parser.parse_args()
+    conn = connect(args.db)
+    migrations.migrate(conn)
+    conn.close()
+    if args.bench:
+        for name, result in bench(args.db, args.senders, args.submissions, args.rows).items():
+            print(f"{name:<15} {result['rows']} rows in {result['seconds']:.2f} s = {result['rows_per_sec']:,.0f} rows/s, "
+                  f"{result['transactions']} transactions ({result['submissions_per_transaction']} submissions each), "
+                  f"{result['duplicates']} already stored, {result['rejected']} rejected")
+        return
+    try:
+        import uvicorn
+    except ImportError:
+        parser.error("serving needs an ASGI server, e.g. pip install uvicorn")
+    uvicorn.run(Ingest(args.db, args.batch_window), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
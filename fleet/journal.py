@@ -0,0 +1,301 @@
+"""Change journal and snapshots of the fleet database.
+
+Every change made through the app is recorded in ChangeJournal, in the same
+transaction as the change itself: inserted rows as they were stored
+(including their rowid), and statements run on the SQL Queries page as
+their SQL. Derived tables are not journaled; they follow from the rows.
+
+Outside the request path (an Archiver thread, or this module's CLI) the
+journal is
+
+- shipped: entries not shipped yet are appended to a new segment file in
+  FLEET_JOURNAL_DIR (default fleet_journal), one JSON entry per line,
+  fleet_journal/changes-000000000101-000000000250.jsonl
+- snapshotted every SNAPSHOT_INTERVAL: the database is copied with SQLite's
+  online backup API, which does not block the app, to
+  fleet_journal/snapshot-000000000250.db (the last entry it contains), and
+  the journal rows, segments and snapshots no longer needed to restore from
+  the last KEEP_SNAPSHOTS snapshots are deleted.
+
+Shipping costs time in proportion to the changes, and copying the journal
+directory somewhere else replicates the database. The latest snapshot plus
+the segments after it rebuild the database:
+
+    python -m fleet.journal --interval 60
+    python -m fleet.journal --ship --snapshot
+    python -m fleet.journal --replay restored.db
+"""
+import argparse
+import datetime
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from fleet import migrations
+from fleet.db import DB_PATH, connect
+
+JOURNAL_DIR = os.environ.get('FLEET_JOURNAL_DIR', 'fleet_journal')
+
+SNAPSHOT_INTERVAL = 24 * 3600
+KEEP_SNAPSHOTS = 2
+
+SEGMENT_PATTERN = re.compile(r'changes-(\d+)-(\d+)\.jsonl$')
+SNAPSHOT_PATTERN = re.compile(r'snapshot-(\d+)\.db$')
+
+COLUMNS = ['Seq', 'At', 'Kind', 'TableName', 'Payload']
+
+
+def record_rows(conn, table, first_rowid, last_rowid):
+    """Journal the rows of ``table`` with rowids from first to last, as stored.
+
+    Runs on the caller's connection, inside the transaction of the insert.
+    """
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    fields = ', '.join(["'rowid', rowid"] + [f"'{column}', {column}" for column in columns])
+    conn.execute(f'''
+        INSERT INTO ChangeJournal (At, Kind, TableName, Payload)
+        SELECT datetime('now'), 'insert', ?, json_object({fields})
+        FROM {table} WHERE rowid BETWEEN ? AND ?
+        ORDER BY rowid
+    ''', (table, first_rowid, last_rowid))
+
+
+def record_sql(conn, statement):
+    # A statement run on the SQL Queries page, replayed as it was written
+    conn.execute("INSERT INTO ChangeJournal (At, Kind, Payload) VALUES (datetime('now'), 'sql', ?)", (statement,))
+
+
+def last_seq(conn):
+    # Highest journal sequence number ever given out, also after compaction
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'ChangeJournal'").fetchone()
+    return row[0] if row else 0
+
+
+def segments(journal_dir=None):
+    """``[(first, last, path)]`` of the shipped segments, oldest first."""
+    journal_dir = journal_dir or JOURNAL_DIR
+    if not os.path.isdir(journal_dir):
+        return []
+    found = [(SEGMENT_PATTERN.match(name), name) for name in os.listdir(journal_dir)]
+    return sorted((int(match[1]), int(match[2]), os.path.join(journal_dir, name)) for match, name in found if match)
+
+
+def snapshots(journal_dir=None):
+    """``[(seq, path)]`` of the snapshots, oldest first."""
+    journal_dir = journal_dir or JOURNAL_DIR
+    if not os.path.isdir(journal_dir):
+        return []
+    found = [(SNAPSHOT_PATTERN.match(name), name) for name in os.listdir(journal_dir)]
+    return sorted((int(match[1]), os.path.join(journal_dir, name)) for match, name in found if match)
+
+
+def shipped(journal_dir=None):
+    # Entries up to here are in a segment or in a snapshot
+    return max([last for _, last, _ in segments(journal_dir)] + [seq for seq, _ in snapshots(journal_dir)] + [0])
+
+
+def ship(conn, journal_dir=None):
+    """Write the entries not shipped yet to a new segment. Returns their number."""
+    journal_dir = journal_dir or JOURNAL_DIR
+    entries = conn.execute(f"SELECT {', '.join(COLUMNS)} FROM ChangeJournal WHERE Seq > ? ORDER BY Seq",
+                           (shipped(journal_dir),)).fetchall()
+    if not entries:
+        return 0
+    os.makedirs(journal_dir, exist_ok=True)
+    path = os.path.join(journal_dir, f"changes-{entries[0][0]:012d}-{entries[-1][0]:012d}.jsonl")
+    # Written under a temporary name first, so a segment is either complete or absent
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        for entry in entries:
+            f.write(json.dumps(dict(zip(COLUMNS, entry)), ensure_ascii=False) + '\n')
+    os.replace(path + '.tmp', path)
+    return len(entries)
+
+
+def _backup(source, path):
+    # Online backup; steps restart by themselves when the source is written meanwhile
+    target = sqlite3.connect(path)
+    source.backup(target, pages=1024)
+    return target
+
+
+def snapshot(db_path=None, journal_dir=None):
+    """Ship, snapshot the database and compact. Returns the snapshot path, or None when nothing changed."""
+    journal_dir = journal_dir or JOURNAL_DIR
+    conn = connect(db_path)
+    try:
+        ship(conn, journal_dir)
+        taken = snapshots(journal_dir)
+        if taken and taken[-1][0] == last_seq(conn):
+            return None
+        os.makedirs(journal_dir, exist_ok=True)
+        temporary = os.path.join(journal_dir, 'snapshot.tmp')
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        target = _backup(conn, temporary)
+        seq = last_seq(target)
+        # The file name says which entries the snapshot holds; their rows are not needed in it
+        with target:
+            target.execute("DELETE FROM ChangeJournal")
+        # A single self-contained file, even when the database runs in WAL mode
+        target.execute('PRAGMA journal_mode=DELETE')
+        target.execute('VACUUM')
+        target.close()
+        path = os.path.join(journal_dir, f"snapshot-{seq:012d}.db")
+        os.replace(temporary, path)
+        compact(conn, journal_dir)
+        return path
+    finally:
+        conn.close()
+
+
+def compact(conn, journal_dir=None):
+    # Keep what restoring from the last KEEP_SNAPSHOTS snapshots needs
+    kept = snapshots(journal_dir)[-KEEP_SNAPSHOTS:]
+    if not kept:
+        return
+    for _, path in snapshots(journal_dir)[:-KEEP_SNAPSHOTS]:
+        os.remove(path)
+    for _, last, path in segments(journal_dir):
+        if last <= kept[0][0]:
+            os.remove(path)
+    # Rows in the latest snapshot have also been shipped or are in that snapshot
+    with conn:
+        conn.execute("DELETE FROM ChangeJournal WHERE Seq <= ?", (kept[-1][0],))
+
+
+def apply(conn, entry):
+    # Redo one journal entry and keep it in the journal of ``conn``
+    if entry['Kind'] == 'insert':
+        row = json.loads(entry['Payload'])
+        conn.execute(f"INSERT INTO {entry['TableName']} ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})",
+                     list(row.values()))
+    else:
+        conn.execute(entry['Payload'])
+    conn.execute(f"INSERT INTO ChangeJournal ({', '.join(COLUMNS)}) VALUES (?, ?, ?, ?, ?)",
+                 [entry[column] for column in COLUMNS])
+
+
+def replay(out_path, journal_dir=None, snapshot_path=None):
+    """Rebuild the database at ``out_path`` from a snapshot (default the latest) and the segments after it.
+
+    Returns the number of entries replayed.
+    """
+    # Imported here: fleet.writes records into this journal
+    from fleet import writes
+
+    journal_dir = journal_dir or JOURNAL_DIR
+    if snapshot_path is None:
+        taken = snapshots(journal_dir)
+        if not taken:
+            raise FileNotFoundError(f"No snapshot in {journal_dir}")
+        snapshot_path = taken[-1][1]
+    if os.path.exists(out_path):
+        os.remove(out_path)
+    source = sqlite3.connect(f"file:{os.path.abspath(snapshot_path)}?mode=ro", uri=True)
+    conn = _backup(source, out_path)
+    source.close()
+
+    # The app migrates before it writes, so later entries expect the current schema
+    migrations.migrate(conn)
+    since = last_seq(conn)
+    replayed = 0
+    with conn:
+        for _, last, path in segments(journal_dir):
+            if last <= since:
+                continue
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    entry = json.loads(line)
+                    if entry['Seq'] > since:
+                        apply(conn, entry)
+                        # As the SQL Queries page did after running the statement
+                        if entry['Kind'] == 'sql':
+                            writes.after_statement(conn, entry['Payload'])
+                        replayed += 1
+        writes.update_derived(conn)
+    conn.close()
+    return replayed
+
+
+class Archiver:
+    """Daemon thread that ships the journal and takes the periodic snapshots."""
+
+    def __init__(self, interval=60, snapshot_interval=SNAPSHOT_INTERVAL, db_path=None, journal_dir=None):
+        self.interval = interval
+        self.snapshot_interval = snapshot_interval
+        self.db_path = db_path
+        self.journal_dir = journal_dir
+        self.last_run = None
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='fleet-journal', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def snapshot_due(self):
+        taken = snapshots(self.journal_dir)
+        return not taken or time.time() - os.path.getmtime(taken[-1][1]) >= self.snapshot_interval
+
+    def tick(self):
+        # Snapshotting ships as well
+        if self.snapshot_due():
+            return snapshot(self.db_path, self.journal_dir)
+        conn = connect(self.db_path)
+        ship(conn, self.journal_dir)
+        conn.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.tick()
+                self.last_run = datetime.datetime.now()
+                self.last_error = None
+            except Exception as e:
+                # Nothing is lost: unshipped entries stay in ChangeJournal for the next tick
+                self.last_error = e
+            self._stop.wait(self.interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ship the change journal, take snapshots or rebuild the database from them")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--journal', default=JOURNAL_DIR, help="Directory of the segments and snapshots")
+    parser.add_argument('--ship', action='store_true', help="Write the new journal entries to a segment")
+    parser.add_argument('--snapshot', action='store_true', help="Take a snapshot now and compact")
+    parser.add_argument('--replay', metavar='OUT', help="Rebuild the database at OUT from the latest snapshot and the segments")
+    parser.add_argument('--from-snapshot', help="Snapshot to replay from instead of the latest")
+    parser.add_argument('--interval', type=int, default=60, help="Seconds between shipments when running as a worker")
+    args = parser.parse_args()
+
+    if args.replay:
+        print(f"Replayed {replay(args.replay, args.journal, args.from_snapshot)} entries into {args.replay}")
+        return
+    migrations.migrate_path(args.db)
+    if args.ship or args.snapshot:
+        if args.ship:
+            conn = connect(args.db)
+            print(f"Shipped {ship(conn, args.journal)} entries")
+            conn.close()
+        if args.snapshot:
+            path = snapshot(args.db, args.journal)
+            print(f"Snapshot {path}" if path else "No changes since the last snapshot")
+        return
+    archiver = Archiver(args.interval, db_path=args.db, journal_dir=args.journal)
+    while True:
+        path = archiver.tick()
+        if path:
+            print(f"{datetime.datetime.now():%Y-%m-%d %H:%M:%S} snapshot {path}")
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
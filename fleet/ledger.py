@@ -0,0 +1,133 @@
+"""Monthly cost of ownership ledger per vehicle.
+
+VehicleLedger holds one row per vehicle and month with the kilometers
+driven and the fuel, maintenance and traffic penalty costs of that month.
+Km, liters, fuel and maintenance come from the daily timeline
+(fleet.timeline), penalties from TrafficPen, so a cost-per-km ranking over
+any range of months is one GROUP BY over the (VehicleID, Month) key.
+
+The timeline of a vehicle is rebuilt when it gets a new reading (new
+readings move the interpolated km of earlier days), so ``sync`` recomputes
+the whole ledger of the vehicles with rows added since the last sync. It
+runs after the timeline sync.
+
+    python -m fleet.ledger --db fleet_management.db --rebuild
+"""
+import argparse
+
+import pandas as pd
+
+from fleet import migrations
+from fleet.data import where_clause
+from fleet.db import DB_PATH, connect, last_synced, mark_synced
+
+SOURCES = {'Fuel': 'FuelID', 'Maintenance': 'MaintenanceID', 'TrafficPen': 'PenaltyID'}
+
+COST_PER_KM_FILTERS = {'vehicle_id': 'L.VehicleID', 'agency': 'A.Agency', 'chassis': 'VB.ChassisNo', 'vehicle_type': 'VB.VehicleType'}
+
+REBUILD_QUERY = '''
+    INSERT INTO VehicleLedger (VehicleID, Month, Km, Liters, FuelCost, MaintenanceCost, PenaltyCost)
+    SELECT VehicleID, Month, SUM(Km), SUM(Liters), SUM(FuelCost), SUM(MaintenanceCost), SUM(PenaltyCost)
+    FROM (
+        SELECT VehicleID, substr(Day, 1, 7) AS Month, Km, Liters, FuelCost, MaintenanceCost, 0 AS PenaltyCost
+        FROM VehicleTimeline
+        WHERE VehicleID IN ({vehicles})
+        UNION ALL
+        SELECT VehicleID, substr(Date, 1, 7), NULL, 0, 0, 0, COALESCE(Cost, 0)
+        FROM TrafficPen
+        WHERE VehicleID IN ({vehicles}) AND Date IS NOT NULL
+    )
+    GROUP BY VehicleID, Month
+'''
+
+
+def rebuild_vehicles(conn, vehicle_ids):
+    # Replace the ledger of the given vehicles. The caller commits.
+    vehicle_ids = list(vehicle_ids)
+    for offset in range(0, len(vehicle_ids), 500):
+        chunk = vehicle_ids[offset:offset + 500]
+        placeholders = ', '.join('?' * len(chunk))
+        conn.execute(f"DELETE FROM VehicleLedger WHERE VehicleID IN ({placeholders})", chunk)
+        conn.execute(REBUILD_QUERY.format(vehicles=placeholders), chunk * 2)
+
+
+def sync(conn):
+    """Recompute the vehicles with Fuel, Maintenance or TrafficPen rows added since the last sync.
+
+    Returns the number of vehicles recomputed. The caller commits.
+    """
+    marks = {}
+    vehicles = set()
+    for table, id_column in SOURCES.items():
+        since = last_synced(conn, f'ledger.{table}')
+        rows = conn.execute(f"SELECT {id_column}, VehicleID FROM {table} WHERE {id_column} > ?", (since,)).fetchall()
+        if rows:
+            marks[table] = max(row[0] for row in rows)
+            vehicles.update(row[1] for row in rows if row[1] is not None)
+    # Nothing is written when there is nothing new, so the data version stays the same
+    rebuild_vehicles(conn, sorted(vehicles))
+    for table, last_id in marks.items():
+        mark_synced(conn, f'ledger.{table}', last_id)
+    return len(vehicles)
+
+
+def rebuild(conn):
+    conn.execute("DELETE FROM VehicleLedger")
+    for table in SOURCES:
+        mark_synced(conn, f'ledger.{table}', 0)
+    return sync(conn)
+
+
+def months(start_date, end_date):
+    # First and last month touched by the days from start to end
+    return [pd.Timestamp(start_date).strftime('%Y-%m'), pd.Timestamp(end_date).strftime('%Y-%m')]
+
+
+def cost_per_km(conn, start_date, end_date, filters=None):
+    """Costs, km and cost per km of every vehicle over the months from start to end, costliest per km first."""
+    where_clause_str, params = where_clause(filters, COST_PER_KM_FILTERS)
+    df = pd.read_sql_query(f'''
+        SELECT
+            L.VehicleID AS "Vehicle ID",
+            VB.VehicleType AS "Vehicle Type",
+            A.Agency,
+            SUM(L.Km) AS "KM",
+            SUM(L.FuelCost) AS "Fuel Cost",
+            SUM(L.MaintenanceCost) AS "Maintenance Cost",
+            SUM(L.PenaltyCost) AS "Penalty Cost",
+            SUM(L.FuelCost + L.MaintenanceCost + L.PenaltyCost) AS "Total Cost"
+        FROM VehicleLedger L
+        JOIN VehicleBasics VB ON L.VehicleID = VB.VehicleID
+        LEFT JOIN VehicleActivity A ON L.VehicleID = A.VehicleID
+        WHERE L.Month >= ? AND L.Month <= ? AND {where_clause_str}
+        GROUP BY L.VehicleID
+    ''', conn, params=months(start_date, end_date) + params)
+    df['Cost per KM'] = (df['Total Cost'] / df['KM'].where(df['KM'] > 0)).round(2)
+    return df.sort_values('Cost per KM', ascending=False, na_position='last', ignore_index=True)
+
+
+def monthly(conn, vehicle_id):
+    # Ledger rows of one vehicle, for the drill-down
+    return pd.read_sql_query('''
+        SELECT Month, Km AS "KM", FuelCost AS "Fuel Cost", MaintenanceCost AS "Maintenance Cost", PenaltyCost AS "Penalty Cost"
+        FROM VehicleLedger
+        WHERE VehicleID = ?
+        ORDER BY Month
+    ''', conn, params=[vehicle_id])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bring the monthly cost of ownership ledger up to date")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--rebuild', action='store_true', help="Recompute the ledger of every vehicle")
+    args = parser.parse_args()
+    conn = connect(args.db)
+    migrations.migrate(conn)
+    with conn:
+        vehicles = rebuild(conn) if args.rebuild else sync(conn)
+    conn.close()
+    print(f"Recomputed the ledger of {vehicles} vehicles")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,358 @@
+"""Numbered schema and data migrations of the fleet database.
+
+The number of applied migrations is kept in ``PRAGMA user_version``. Every
+migration runs in its own explicit transaction together with the version
+bump, schema statements included, so an interrupted run is picked up again
+where it stopped.
+
+    python -m fleet.migrations --db fleet_management.db
+"""
+import argparse
+
+import pandas as pd
+
+from fleet import dates
+from fleet.db import DB_PATH, connect
+
+ID_COLUMNS = {'Fuel': 'FuelID', 'Maintenance': 'MaintenanceID', 'TrafficPen': 'PenaltyID'}
+
+# Rows with the same natural key are the same record, e.g. a fill-up imported
+# twice from overlapping sheets. Optional text columns count as empty, so a
+# missing value does not let a repeat through. Ownership has no natural key:
+# a vehicle can go back to an earlier owner.
+NATURAL_KEYS = {
+    'Fuel': ['VehicleID', 'Date', 'Mileage', 'Amount'],
+    'Maintenance': ['VehicleID', 'Date', 'MaintenanceType', "IFNULL(SparePartName, '')", 'Mileage', 'Cost'],
+    'TrafficPen': ['VehicleID', 'Date', "IFNULL(Location, '')", 'Desc', 'Cost'],
+    'VehicleAllocation': ['VehicleID', 'Date', 'Agency', 'Branch', 'Condition'],
+    'VehiclesLicenses': ['VehicleID', 'StartDate', 'EndDate'],
+    'branches': ['Agency', 'Branch'],
+}
+
+
+def canonical_dates(conn):
+    # Rewrite every parseable Date of the history tables to 'YYYY-MM-DD HH:MM:SS'.
+    # Values that cannot be parsed are left untouched so nothing is lost.
+    for table in dates.TABLES:
+        id_column = ID_COLUMNS[table]
+        df = pd.read_sql_query(f"SELECT {id_column}, Date FROM {table} WHERE Date IS NOT NULL", conn)
+        parsed = pd.to_datetime(df['Date'], format='mixed', errors='coerce')
+        df['Canonical'] = parsed.dt.strftime(dates.FORMAT)
+        changed = df[parsed.notna() & (df['Canonical'] != df['Date'])]
+        conn.executemany(
+            f"UPDATE {table} SET Date = ? WHERE {id_column} = ?",
+            list(zip(changed['Canonical'], changed[id_column].astype(int)))
+        )
+
+
+def date_indexes(conn):
+    for table in dates.TABLES:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table.lower()}_date ON {table} (Date)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table.lower()}_vehicle_date ON {table} (VehicleID, Date)")
+
+
+def date_format_triggers(conn):
+    # Reject writes that would bring back non-canonical dates, whichever page they come from
+    for table in dates.TABLES:
+        for event in ('INSERT', 'UPDATE OF Date'):
+            name = f"{table.lower()}_date_format_{event.split()[0].lower()}"
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {name}
+                BEFORE {event} ON {table}
+                WHEN NEW.Date IS NOT NULL AND NEW.Date NOT GLOB '{dates.PATTERN}'
+                BEGIN
+                    SELECT RAISE(ABORT, '{table}.Date must be formatted as YYYY-MM-DD HH:MM:SS');
+                END
+            ''')
+
+
+def vehicle_timeline(conn):
+    # Derived per-vehicle daily timeline (fleet.timeline) and the sync marks of derived tables
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS DerivedState (
+            Name TEXT PRIMARY KEY,
+            LastID INTEGER
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS VehicleTimeline (
+            VehicleID TEXT,
+            Day TEXT,
+            Odometer REAL,
+            Km REAL,
+            Liters REAL,
+            FuelCost REAL,
+            MaintenanceCost REAL,
+            PRIMARY KEY (VehicleID, Day)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_vehicletimeline_day ON VehicleTimeline (Day)")
+
+
+def vehicle_activity(conn):
+    # Last activity per vehicle for the Utilization report (fleet.activity)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS VehicleActivity (
+            VehicleID TEXT PRIMARY KEY,
+            Agency TEXT,
+            Branch TEXT,
+            LastFuelDate TEXT,
+            LastMileage REAL,
+            LastMileageDate TEXT,
+            LastActivity TEXT
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_vehicleactivity_lastactivity ON VehicleActivity (LastActivity)")
+
+
+def vehicle_alerts(conn):
+    # License and ownership alerts (fleet.alerts); the Action Needed report
+    # also needs the current allocation condition next to the agency
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS VehicleAlerts (
+            VehicleID TEXT PRIMARY KEY,
+            LicenseID INTEGER,
+            LicenseEndDate TEXT,
+            OwnershipID INTEGER,
+            Ownership TEXT,
+            Action TEXT,
+            Priority TEXT,
+            EvaluatedOn TEXT
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_vehiclealerts_action ON VehicleAlerts (Action)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_vehiclealerts_licenseenddate ON VehicleAlerts (LicenseEndDate)")
+    if 'Condition' not in [row[1] for row in conn.execute("PRAGMA table_info(VehicleActivity)")]:
+        conn.execute("ALTER TABLE VehicleActivity ADD COLUMN Condition TEXT")
+    conn.execute('''
+        UPDATE VehicleActivity
+        SET Condition = (
+            SELECT VA.Condition FROM VehicleAllocation VA
+            WHERE VA.VehicleID = VehicleActivity.VehicleID
+            ORDER BY VA.AllocationID DESC LIMIT 1
+        )
+    ''')
+
+
+def penalty_categories(conn):
+    # Integer categories of the traffic penalty descriptions (fleet.penalties)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS PenaltyCategories (
+            CategoryID INTEGER PRIMARY KEY,
+            Description TEXT,
+            Label TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS PenaltyDescriptions (
+            Description TEXT PRIMARY KEY,
+            CategoryID INTEGER REFERENCES PenaltyCategories (CategoryID),
+            Score REAL,
+            Method TEXT
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_penaltydescriptions_categoryid ON PenaltyDescriptions (CategoryID)")
+
+
+def penalty_hotspots(conn):
+    # Penalties per location, week and agency (fleet.hotspots)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS PenaltyLocations (
+            LocationKey TEXT PRIMARY KEY,
+            Location TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS PenaltyHotspots (
+            LocationKey TEXT,
+            Week TEXT,
+            Agency TEXT,
+            Penalties INTEGER,
+            Cost REAL,
+            PRIMARY KEY (LocationKey, Week, Agency)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_penaltyhotspots_week ON PenaltyHotspots (Week)")
+    # Allocation in force on a given day, for attributing penalties to agencies
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_vehicleallocation_vehicle_date ON VehicleAllocation (VehicleID, Date)")
+
+
+def service_forecast(conn):
+    # Predicted next preventive maintenance per vehicle (fleet.forecast)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ServiceForecast (
+            VehicleID TEXT PRIMARY KEY,
+            LastService TEXT,
+            LastServiceDate TEXT,
+            LastServiceMileage REAL,
+            NextService TEXT,
+            DueMileage REAL,
+            Odometer REAL,
+            OdometerDate TEXT,
+            KmPerDay REAL,
+            PredictedDate TEXT
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_serviceforecast_predicteddate ON ServiceForecast (PredictedDate)")
+
+
+def vehicle_ledger(conn):
+    # Monthly cost of ownership per vehicle (fleet.ledger)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS VehicleLedger (
+            VehicleID TEXT,
+            Month TEXT,
+            Km REAL,
+            Liters REAL,
+            FuelCost REAL,
+            MaintenanceCost REAL,
+            PenaltyCost REAL,
+            PRIMARY KEY (VehicleID, Month)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_vehicleledger_month ON VehicleLedger (Month)")
+
+
+def change_journal(conn):
+    # Changes made through the app, written in the same transaction as the change (see fleet.journal)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ChangeJournal (
+            Seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            At TEXT,
+            Kind TEXT,
+            TableName TEXT,
+            Payload TEXT
+        )
+    ''')
+
+
+def natural_keys(conn):
+    # Delete the repeats re-imported sheets left behind, keeping the first row
+    # of every key, and make the keys unique so inserts skip repeats
+    deleted = {}
+    for table, key in NATURAL_KEYS.items():
+        deleted[table] = conn.execute(
+            f"DELETE FROM {table} WHERE rowid NOT IN (SELECT MIN(rowid) FROM {table} GROUP BY {', '.join(key)})"
+        ).rowcount
+        conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS uq_{table.lower()}_natural_key ON {table} ({', '.join(key)})")
+
+    # The rollups counted the deleted rows; imported here because they import this module
+    from fleet import activity, alerts, forecast, hotspots, ledger, timeline
+    if deleted['Fuel'] or deleted['Maintenance']:
+        timeline.rebuild(conn)
+        forecast.rebuild(conn)
+    # The latest allocation may have been a deleted repeat
+    if deleted['VehicleAllocation']:
+        activity.rebuild(conn)
+    if deleted['Fuel'] or deleted['Maintenance'] or deleted['TrafficPen']:
+        ledger.rebuild(conn)
+    if deleted['TrafficPen']:
+        hotspots.rebuild(conn)
+    if deleted['VehiclesLicenses']:
+        alerts.rebuild(conn)
+
+
+def state_history(conn):
+    # When each allocation, license and ownership row was in force (fleet.history)
+    for table, id_column in [('AllocationHistory', 'AllocationID'), ('LicenseHistory', 'LicenseID'), ('OwnershipHistory', 'OwnershipID')]:
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                {id_column} INTEGER PRIMARY KEY,
+                VehicleID TEXT,
+                ValidFrom TEXT,
+                ValidTo TEXT
+            )
+        ''')
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table.lower()}_vehicle_validfrom ON {table} (VehicleID, ValidFrom)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table.lower()}_validfrom ON {table} (ValidFrom)")
+    # Filled right away, so reports attributing by date never see them empty; imported here because it imports this module
+    from fleet import history
+    history.rebuild(conn)
+
+
+def edit_counters(conn):
+    # Count the edited and deleted rows of the mirrored tables in DerivedState
+    # ('edits.<table>'), whoever changes them, so the Parquet mirror (fleet.mirror)
+    # can tell it is stale even when the row count and highest ID stay the same
+    for table in ID_COLUMNS:
+        for event in ('UPDATE', 'DELETE'):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table.lower()}_count_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    INSERT INTO DerivedState (Name, LastID) VALUES ('edits.{table}', 1)
+                    ON CONFLICT (Name) DO UPDATE SET LastID = LastID + 1;
+                END
+            ''')
+
+
+# Applied in order; never reorder or remove entries, only append
+MIGRATIONS = [
+    canonical_dates,
+    date_indexes,
+    date_format_triggers,
+    vehicle_timeline,
+    vehicle_activity,
+    vehicle_alerts,
+    penalty_categories,
+    penalty_hotspots,
+    service_forecast,
+    vehicle_ledger,
+    change_journal,
+    natural_keys,
+    state_history,
+    edit_counters,
+]
+
+
+def version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """Apply the pending migrations. Returns the names of the applied ones."""
+    applied = []
+    # In its default mode sqlite3 commits CREATE and ALTER statements on their
+    # own; in autocommit mode BEGIN ... COMMIT covers them as well
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        while True:
+            # The version is read inside the write lock, so concurrent runs never apply a migration twice
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                number = version(conn)
+                if number >= len(MIGRATIONS):
+                    conn.execute('COMMIT')
+                    break
+                migration = MIGRATIONS[number]
+                migration(conn)
+                conn.execute(f'PRAGMA user_version = {number + 1}')
+                conn.execute('COMMIT')
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                raise
+            applied.append(migration.__name__)
+    finally:
+        conn.isolation_level = isolation_level
+    return applied
+
+
+def migrate_path(path=None):
+    conn = connect(path or DB_PATH)
+    applied = migrate(conn)
+    conn.close()
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply the pending migrations to the fleet database")
+    parser.add_argument('--db', default=DB_PATH)
+    args = parser.parse_args()
+    applied = migrate_path(args.db)
+    print(f"Applied: {', '.join(applied)}" if applied else "Up to date")
+
+
+if __name__ == '__main__':
+    main()
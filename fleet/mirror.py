@@ -0,0 +1,204 @@
+"""Columnar Parquet mirror of the Fuel, Maintenance and TrafficPen tables.
+
+Rows are exported incrementally (everything above the highest exported ID)
+into one directory per table, partitioned by month, with the Date column
+parsed once into a real timestamp:
+
+    fleet_mirror/Fuel/month=2024-05/part-000123-000456.parquet
+
+Readers get only the columns and months they ask for through pyarrow with
+memory-mapped files. When pyarrow is missing or the mirror is behind the
+database, the same frame is read from SQLite instead.
+
+The database counts the edited and deleted rows of every mirrored table
+(migrations.edit_counters). The manifest keeps the count the mirror was
+exported at, so after an edit or a delete, from the SQL Queries page or
+anywhere else, the mirror is not current any more and the next sync
+rebuilds it.
+
+    python -m fleet.mirror --db fleet_management.db --out fleet_mirror
+"""
+import argparse
+import json
+import os
+import shutil
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+from fleet import migrations
+from fleet.db import DB_PATH, connect, last_synced
+
+MIRROR_DIR = os.environ.get('FLEET_MIRROR_DIR', 'fleet_mirror')
+
+# table -> (ID column, mirrored columns)
+TABLES = {
+    'Fuel': ('FuelID', ['FuelID', 'Date', 'VehicleID', 'Mileage', 'Type', 'Amount', 'Cost']),
+    'Maintenance': ('MaintenanceID', ['MaintenanceID', 'Date', 'VehicleID', 'MaintenanceType', 'SparePartName', 'Mileage', 'Cost', 'ServiceProviderOrGarage']),
+    'TrafficPen': ('PenaltyID', ['PenaltyID', 'VehicleID', 'Date', 'Location', 'Desc', 'Cost', 'CompanyCode']),
+}
+
+
+def available():
+    return pq is not None
+
+
+def parse_dates(values):
+    # The tables hold a mix of date and date-time strings
+    try:
+        return pd.to_datetime(values, format='mixed', errors='coerce')
+    except ValueError:
+        return pd.to_datetime(values, errors='coerce')
+
+
+def _table_dir(table, mirror_dir=None):
+    return os.path.join(mirror_dir or MIRROR_DIR, table)
+
+
+def manifest(table, mirror_dir=None):
+    path = os.path.join(_table_dir(table, mirror_dir), '_manifest.json')
+    if not os.path.exists(path):
+        return {'last_id': 0, 'rows': 0, 'edits': 0}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_manifest(table, state, mirror_dir=None):
+    path = os.path.join(_table_dir(table, mirror_dir), '_manifest.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(path + '.tmp', path)
+
+
+def _source_state(conn, table, last_id):
+    id_column = TABLES[table][0]
+    rows = conn.execute(f"SELECT COUNT(*) FROM {table} WHERE {id_column} <= ?", (last_id,)).fetchone()[0]
+    newest = conn.execute(f"SELECT MAX({id_column}) FROM {table}").fetchone()[0]
+    return rows, newest or 0, last_synced(conn, f'edits.{table}')
+
+
+def is_current(conn, table, mirror_dir=None):
+    # True when the mirror holds exactly the rows currently in the table
+    if not available():
+        return False
+    state = manifest(table, mirror_dir)
+    if not state['last_id']:
+        return False
+    rows, newest, edits = _source_state(conn, table, state['last_id'])
+    return rows == state['rows'] and newest == state['last_id'] and edits == state.get('edits', 0)
+
+
+def sync_table(conn, table, mirror_dir=None, full=False):
+    """Append the rows added since the last sync. Returns the number of rows written."""
+    id_column, columns = TABLES[table]
+    directory = _table_dir(table, mirror_dir)
+    state = manifest(table, mirror_dir)
+    rows, _, edits = _source_state(conn, table, state['last_id'])
+    # Rows were deleted or edited since the last export
+    if state['last_id'] and (rows != state['rows'] or edits != state.get('edits', 0)):
+        full = True
+    if full:
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        state = {'last_id': 0, 'rows': 0}
+    state['edits'] = edits
+    os.makedirs(directory, exist_ok=True)
+
+    df = pd.read_sql_query(
+        f"SELECT {', '.join(columns)} FROM {table} WHERE {id_column} > ? ORDER BY {id_column}",
+        conn, params=[state['last_id']]
+    )
+    if df.empty:
+        _write_manifest(table, state, mirror_dir)
+        return 0
+
+    df['Date'] = parse_dates(df['Date'])
+    months = df['Date'].dt.strftime('%Y-%m').fillna('unknown')
+    first, last = df[id_column].iloc[0], df[id_column].iloc[-1]
+    for month, part in df.groupby(months):
+        month_dir = os.path.join(directory, f'month={month}')
+        os.makedirs(month_dir, exist_ok=True)
+        table_data = pa.Table.from_pandas(part, preserve_index=False)
+        pq.write_table(table_data, os.path.join(month_dir, f'part-{first:06d}-{last:06d}.parquet'))
+
+    state = {'last_id': int(last), 'rows': state['rows'] + len(df), 'edits': edits}
+    _write_manifest(table, state, mirror_dir)
+    return len(df)
+
+
+def sync(db_path=None, mirror_dir=None, full=False):
+    """Bring every mirrored table up to date. Returns ``{table: rows written}``."""
+    if not available():
+        return {}
+    migrations.migrate_path(db_path)
+    conn = connect(db_path or DB_PATH)
+    written = {table: sync_table(conn, table, mirror_dir, full) for table in TABLES}
+    conn.close()
+    return written
+
+
+def _month(value):
+    return pd.Timestamp(value).strftime('%Y-%m')
+
+
+def read_parquet(table, columns=None, start=None, end=None, mirror_dir=None):
+    # Only the requested columns and the months overlapping [start, end] are read
+    id_column, all_columns = TABLES[table]
+    columns = list(columns or all_columns)
+    read_columns = list(dict.fromkeys(columns + [id_column]))
+    filters = []
+    if start is not None:
+        filters += [('month', '>=', _month(start)), ('Date', '>=', pd.Timestamp(start))]
+    if end is not None:
+        filters += [('month', '<=', _month(end)), ('Date', '<=', pd.Timestamp(end))]
+    table_data = pq.read_table(
+        _table_dir(table, mirror_dir), columns=read_columns, filters=filters or None,
+        partitioning='hive', memory_map=True
+    )
+    df = table_data.to_pandas().sort_values(id_column, ignore_index=True)
+    return df[columns]
+
+
+def read_sqlite(conn, table, columns=None, start=None, end=None):
+    id_column, all_columns = TABLES[table]
+    columns = list(columns or all_columns)
+    df = pd.read_sql_query(f"SELECT {', '.join(columns)} FROM {table} ORDER BY {id_column}", conn)
+    if 'Date' in df:
+        df['Date'] = parse_dates(df['Date'])
+        if start is not None:
+            df = df[df['Date'] >= pd.Timestamp(start)]
+        if end is not None:
+            df = df[df['Date'] <= pd.Timestamp(end)]
+    return df.reset_index(drop=True)
+
+
+def read(conn, table, columns=None, start=None, end=None, mirror_dir=None):
+    """Rows of ``table`` in ID order with Date as a timestamp, from the mirror when it is current.
+
+    ``start`` and ``end`` filter on Date and need the Date column.
+    """
+    if is_current(conn, table, mirror_dir):
+        return read_parquet(table, columns, start, end, mirror_dir)
+    return read_sqlite(conn, table, columns, start, end)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the fleet history tables to a Parquet mirror")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--out', default=MIRROR_DIR)
+    parser.add_argument('--full', action='store_true', help="Rebuild the mirror from scratch")
+    args = parser.parse_args()
+    if not available():
+        parser.error("pyarrow is not installed")
+    for table, rows in sync(args.db, args.out, args.full).items():
+        print(f"{table}: {rows} new rows")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""Categories of the traffic penalty descriptions.
+
+Penalty descriptions arrive in Arabic, with spelling variants of the same
+violation ("فى"/"في", "ة"/"ه", ...). Every distinct description is matched
+once, when its first penalty is inserted or imported, against the known
+categories and stored in PenaltyDescriptions with the integer CategoryID of
+PenaltyCategories, which carries the English label. Reports join on the
+description and group by the CategoryID.
+
+Descriptions that match no category closely enough keep a NULL CategoryID;
+they make up the curation backlog:
+
+    python -m fleet.penalties --unknown
+    python -m fleet.penalties --assign "الانتظار فى الممنوع" 12
+    python -m fleet.penalties --add-category "السير عكس الاتجاه" "Driving against traffic."
+"""
+import argparse
+import difflib
+import re
+
+import pandas as pd
+
+from fleet import migrations
+from fleet.db import DB_PATH, connect, last_synced, mark_synced
+
+SOURCES = {'TrafficPen': 'PenaltyID'}
+
+# CategoryID, Arabic description, English label. IDs are stored; never renumber.
+CATEGORIES = [
+    (1, "انتهاء رخصة التسيير", "Expiry of the driving license."),
+    (2, "تجاوز السرعة المقررة", "Exceeding the specified speed limit."),
+    (3, "قيادة السيارة بدون حزام امان", "Driving without wearing a seatbelt."),
+    (4, "إضافة ملصقات مخالفة على جسم المركبة", "Placing stickers to the vehicle's body."),
+    (5, "تسبب دون مقتضى فى تعطيل حركة المرور أو تعويقها", "Causing the obstruction of traffic."),
+    (6, "عدم اتباع إشارات المرور", "Failure to obey traffic signals."),
+    (7, "استخدام التليفون يدويا أثناء القيادة", "Using the phone manually while driving."),
+    (8, "تعمد تعطيل حركة المرور", "Intentionally obstructing traffic."),
+    (9, "وضع كتابة مخالفة على جسم المركبة", "Placing a text on the vehicle's body."),
+    (10, "عدم اتباع تعليمات رجل المرور", "Failure to follow traffic officer instructions."),
+    (11, "وضع رسم مخالف على جسم المركبة", "Placing a drawing on the vehicle's body."),
+    (12, "الانتظار فى الممنوع", "Waiting in a prohibited area."),
+    (13, "قيادة مركبة بدون رخصة تسيير", "Driving a vehicle without a driving license."),
+    (14, "عدم اتباع علامات المرور", "Disregarding traffic signs."),
+]
+
+# Label of penalties whose description has no category yet
+UNKNOWN_LABEL = 'Uncategorized'
+
+# Minimum difflib ratio between normalized descriptions to accept a match
+MATCH_CUTOFF = 0.85
+
+_LETTERS = str.maketrans({'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا', 'ى': 'ي', 'ة': 'ه', 'ؤ': 'و', 'ئ': 'ي'})
+_MARKS = re.compile('[ً-ْـ]')  # harakat and tatweel
+_PUNCTUATION = re.compile(r'[^\w\s]')
+
+
+def normalize(description):
+    # Spelling-insensitive form of an Arabic description
+    text = _MARKS.sub('', str(description)).translate(_LETTERS)
+    text = _PUNCTUATION.sub(' ', text)
+    return ' '.join(text.split())
+
+
+def seed(conn):
+    # Add the categories of CATEGORIES that are not in the table yet
+    existing = {row[0] for row in conn.execute("SELECT CategoryID FROM PenaltyCategories")}
+    conn.executemany(
+        "INSERT INTO PenaltyCategories (CategoryID, Description, Label) VALUES (?, ?, ?)",
+        [category for category in CATEGORIES if category[0] not in existing]
+    )
+
+
+def references(conn):
+    # Normalized text -> CategoryID of the categories and of the curated descriptions
+    known = {}
+    for description, category_id in conn.execute("SELECT Description, CategoryID FROM PenaltyCategories"):
+        known[normalize(description)] = category_id
+    for description, category_id in conn.execute(
+            "SELECT Description, CategoryID FROM PenaltyDescriptions WHERE Method = 'manual' AND CategoryID IS NOT NULL"):
+        known[normalize(description)] = category_id
+    return known
+
+
+def match(description, known):
+    """(CategoryID, score, method) of ``description``; CategoryID is None below the cutoff."""
+    text = normalize(description)
+    if text in known:
+        return known[text], 1.0, 'exact'
+    best, score = None, 0.0
+    for candidate in known:
+        ratio = difflib.SequenceMatcher(None, text, candidate).ratio()
+        if ratio > score:
+            best, score = candidate, ratio
+    if best is not None and score >= MATCH_CUTOFF:
+        return known[best], round(score, 3), 'fuzzy'
+    return None, round(score, 3), 'unmatched'
+
+
+def classify(conn, descriptions, known=None):
+    # Match and store descriptions. The caller commits.
+    known = known if known is not None else references(conn)
+    rows = [(description, *match(description, known)) for description in descriptions]
+    conn.executemany('''
+        INSERT INTO PenaltyDescriptions (Description, CategoryID, Score, Method) VALUES (?, ?, ?, ?)
+        ON CONFLICT (Description) DO UPDATE SET CategoryID = excluded.CategoryID, Score = excluded.Score, Method = excluded.Method
+        WHERE Method <> 'manual'
+    ''', rows)
+    return rows
+
+
+def sync(conn):
+    """Categorize the descriptions first seen since the last sync.
+
+    Returns the number of new descriptions. The caller commits.
+    """
+    since = last_synced(conn, 'penalties.TrafficPen')
+    rows = conn.execute('''
+        SELECT MAX(TP.PenaltyID), TP.Desc
+        FROM TrafficPen TP
+        LEFT JOIN PenaltyDescriptions PD ON PD.Description = TP.Desc
+        WHERE TP.PenaltyID > ? AND TP.Desc IS NOT NULL AND PD.Description IS NULL
+        GROUP BY TP.Desc
+    ''', (since,)).fetchall()
+    last_id = conn.execute("SELECT MAX(PenaltyID) FROM TrafficPen").fetchone()[0] or 0
+    # Nothing is written when there is nothing new, so the data version stays the same
+    if last_id > since:
+        seed(conn)
+        classify(conn, [row[1] for row in rows])
+        mark_synced(conn, 'penalties.TrafficPen', last_id)
+    return len(rows)
+
+
+def rebuild(conn):
+    # Re-match every description except the curated ones
+    seed(conn)
+    conn.execute("DELETE FROM PenaltyDescriptions WHERE Method <> 'manual'")
+    mark_synced(conn, 'penalties.TrafficPen', 0)
+    return sync(conn)
+
+
+def assign(conn, description, category_id):
+    # Curate one description; curated descriptions are kept by rebuilds and
+    # serve as references for later fuzzy matches. The caller commits.
+    if conn.execute("SELECT 1 FROM PenaltyCategories WHERE CategoryID = ?", (category_id,)).fetchone() is None:
+        raise ValueError(f"Unknown penalty category {category_id}")
+    conn.execute('''
+        INSERT INTO PenaltyDescriptions (Description, CategoryID, Score, Method) VALUES (?, ?, 1.0, 'manual')
+        ON CONFLICT (Description) DO UPDATE SET CategoryID = excluded.CategoryID, Score = 1.0, Method = 'manual'
+    ''', (description, category_id))
+    # Uncategorized descriptions may now match the new reference
+    unknown = [row[0] for row in conn.execute("SELECT Description FROM PenaltyDescriptions WHERE CategoryID IS NULL")]
+    classify(conn, unknown)
+
+
+def add_category(conn, description, label):
+    # New category with the next free ID; its own description is assigned to it. The caller commits.
+    category_id = conn.execute("SELECT COALESCE(MAX(CategoryID), 0) + 1 FROM PenaltyCategories").fetchone()[0]
+    conn.execute("INSERT INTO PenaltyCategories (CategoryID, Description, Label) VALUES (?, ?, ?)",
+                 (category_id, description, label))
+    assign(conn, description, category_id)
+    return category_id
+
+
+def categories(conn):
+    return pd.read_sql_query("SELECT CategoryID AS \"Category ID\", Label, Description FROM PenaltyCategories ORDER BY CategoryID", conn)
+
+
+def unknown_descriptions(conn):
+    """Descriptions without a category, with their penalties and closest match."""
+    df = pd.read_sql_query('''
+        SELECT
+            PD.Description,
+            COUNT(TP.PenaltyID) AS Penalties,
+            SUM(TP.Cost) AS Cost,
+            PD.Score AS "Best Score"
+        FROM PenaltyDescriptions PD
+        LEFT JOIN TrafficPen TP ON TP.Desc = PD.Description
+        WHERE PD.CategoryID IS NULL
+        GROUP BY PD.Description
+        ORDER BY Penalties DESC
+    ''', conn)
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Categorize traffic penalty descriptions")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--rebuild', action='store_true', help="Re-match every description that was not curated by hand")
+    parser.add_argument('--unknown', action='store_true', help="List the descriptions without a category")
+    parser.add_argument('--assign', nargs=2, metavar=('DESCRIPTION', 'CATEGORY_ID'), help="Put a description in a category")
+    parser.add_argument('--add-category', nargs=2, metavar=('DESCRIPTION', 'LABEL'), help="Add a category with its English label")
+    args = parser.parse_args()
+    conn = connect(args.db)
+    migrations.migrate(conn)
+    with conn:
+        if args.rebuild:
+            print(f"Categorized {rebuild(conn)} descriptions")
+        else:
+            sync(conn)
+        if args.add_category:
+            print(f"Added category {add_category(conn, *args.add_category)}")
+        if args.assign:
+            assign(conn, args.assign[0], int(args.assign[1]))
+    if args.unknown:
+        print(unknown_descriptions(conn).to_string(index=False))
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
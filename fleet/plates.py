@@ -0,0 +1,98 @@
+"""Prefix search over the plate numbers of the fleet.
+
+VehicleIDs are stored the way writes.transform_and_rearrange writes them:
+Arabic letters and digits transliterated, letters first, then digits. A
+search goes through the same transformation, so 'أ ب ٣٤' and 'ab 34' find
+the same plates, and a search of digits only matches the number of the
+plate, whatever its letters.
+
+The index is two sorted arrays of normalized plates, one by letters and one
+by number; a search is a bisect to the first match and a walk over at most
+``limit`` entries, so it costs the same for a hundred vehicles as for fifty
+thousand. The pages build it once per data version (fleet.ui.vehicle_index).
+
+    python -m fleet.plates "أ ب 12"
+    python -m fleet.plates 1234 --limit 5
+"""
+import argparse
+import bisect
+import re
+import time
+
+from fleet import data
+from fleet.db import DB_PATH, connect
+from fleet.writes import transform_and_rearrange
+
+LIMIT = 50
+
+# Letters, then digits: the stored form. Most VehicleIDs are in it already,
+# so the index is built without transliterating them one character at a time
+PLATE = re.compile('([A-Z]*)([0-9]*)')
+
+
+def normalize(text):
+    if not text:
+        return ''
+    text = str(text)
+    return text if PLATE.fullmatch(text) else transform_and_rearrange(text)
+
+
+def _number_first(plate):
+    # '1234AB' for 'AB1234', so a search by number is a prefix search too. Plates
+    # with characters transliteration keeps as they are (e.g. Persian digits) stay unchanged
+    match = PLATE.fullmatch(plate)
+    return match[2] + match[1] if match else plate
+
+
+class PlateIndex:
+    """Sorted plates of ``vehicle_ids``, searched by prefix."""
+
+    def __init__(self, vehicle_ids):
+        self.vehicle_ids = frozenset(vehicle_ids)
+        by_plate = sorted((normalize(vehicle_id), vehicle_id) for vehicle_id in self.vehicle_ids)
+        by_number = sorted((_number_first(plate), vehicle_id) for plate, vehicle_id in by_plate)
+        self._plates = [plate for plate, _ in by_plate]
+        self._plate_ids = [vehicle_id for _, vehicle_id in by_plate]
+        self._numbers = [number for number, _ in by_number]
+        self._number_ids = [vehicle_id for _, vehicle_id in by_number]
+
+    def __len__(self):
+        return len(self._plates)
+
+    def search(self, text, limit=LIMIT):
+        """Up to ``limit`` VehicleIDs whose plate starts with ``text``, exact match first.
+
+        An empty search returns the first plates in order.
+        """
+        query = normalize(text)
+        keys, vehicle_ids = (self._numbers, self._number_ids) if query.isdigit() else (self._plates, self._plate_ids)
+        start = bisect.bisect_left(keys, query)
+        end = start
+        while end < len(keys) and end - start < limit and keys[end].startswith(query):
+            end += 1
+        return vehicle_ids[start:end]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search the VehicleIDs by plate prefix, in Arabic or Latin")
+    parser.add_argument('query')
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--limit', type=int, default=LIMIT)
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+    started = time.perf_counter()
+    index = PlateIndex(data.vehicle_ids(conn))
+    built = time.perf_counter()
+    matches = index.search(args.query, args.limit)
+    searched = time.perf_counter()
+    conn.close()
+
+    print(f"{len(index)} plates indexed in {(built - started) * 1000:.1f} ms, "
+          f"{len(matches)} matches in {(searched - built) * 1000:.3f} ms")
+    for vehicle_id in matches:
+        print(vehicle_id)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""Precomputed dashboard aggregates.
+
+The heavy dashboard aggregates are computed off the request path and stored
+in a separate SQLite file (``FLEET_CACHE_DB``, default ``fleet_cache.db``)
+together with the data version they were computed from. Keeping them out
+of the main database means storing a result does not itself change the
+data version.
+
+Results are refreshed by a daemon thread started from the dashboard, or by
+a separate worker:
+
+    python -m fleet.precompute --interval 60
+    python -m fleet.precompute --once
+"""
+import argparse
+import datetime
+import io
+import os
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+from fleet import analytics, data, migrations, mirror, writes
+from fleet.db import DB_PATH, connect, data_version
+
+CACHE_PATH = os.environ.get('FLEET_CACHE_DB', 'fleet_cache.db')
+
+
+def _efficiency_by_agency_type(conn, results):
+    return data.efficiency_by_agency_type(results['efficiency'])
+
+
+def _efficiency_by_type(conn, results):
+    return data.efficiency_by_type(results['efficiency'])
+
+
+# name -> function(conn, results so far); later entries may use earlier results
+AGGREGATES = {
+    'efficiency': lambda conn, results: analytics.efficiency(conn),
+    'efficiency_old': lambda conn, results: analytics.efficiency_old(conn),
+    'efficiency_by_type': _efficiency_by_type,
+    'efficiency_heatmap': _efficiency_by_agency_type,
+    'vehicles_by_location': lambda conn, results: data.vehicles_by_location(conn),
+    'vehicles_by_location_type': lambda conn, results: data.vehicles_by_location_type(conn),
+}
+
+
+def _cache(path=None):
+    cache = sqlite3.connect(path or CACHE_PATH, timeout=30)
+    # Frames used to be stored as split JSON, read back with guessed dtypes; they are recomputed
+    cache.execute('DROP TABLE IF EXISTS AggregateResults')
+    cache.execute('''
+    CREATE TABLE IF NOT EXISTS AggregateFrames (
+        Name TEXT PRIMARY KEY,
+        Version TEXT,
+        ComputedAt TEXT,
+        DurationMs REAL,
+        Payload TEXT
+    )''')
+    return cache
+
+
+def store(name, frame, version, duration_ms=0.0, cache_path=None):
+    cache = _cache(cache_path)
+    with cache:
+        # Table JSON carries the dtype of every column, so the frame reads back as it was stored
+        cache.execute('INSERT OR REPLACE INTO AggregateFrames VALUES (?, ?, ?, ?, ?)',
+                      (name, version, datetime.datetime.now().isoformat(timespec='seconds'), duration_ms,
+                       frame.to_json(orient='table', date_format='iso', index=False)))
+    cache.close()
+
+
+def load(name, cache_path=None):
+    """Return ``(frame, version)`` of a stored aggregate, or ``(None, None)``."""
+    cache = _cache(cache_path)
+    row = cache.execute('SELECT Payload, Version FROM AggregateFrames WHERE Name = ?', (name,)).fetchone()
+    cache.close()
+    if row is None:
+        return None, None
+    return pd.read_json(io.StringIO(row[0]), orient='table'), row[1]
+
+
+def stored_versions(cache_path=None):
+    cache = _cache(cache_path)
+    versions = dict(cache.execute('SELECT Name, Version FROM AggregateFrames').fetchall())
+    cache.close()
+    return versions
+
+
+def refresh(db_path=None, cache_path=None, force=False):
+    """Recompute every aggregate whose stored version is out of date.
+
+    Returns the names that were recomputed.
+    """
+    migrations.migrate_path(db_path)
+    conn = connect(db_path or DB_PATH)
+    with conn:
+        writes.update_derived(conn)
+    conn.close()
+
+    version = data_version(db_path)
+    versions = stored_versions(cache_path)
+    if not force and all(versions.get(name) == version for name in AGGREGATES):
+        return []
+
+    # Bring the Parquet mirror up to date first so the aggregates can read from it
+    mirror.sync(db_path)
+    conn = connect(db_path or DB_PATH)
+    results = {}
+    for name, func in AGGREGATES.items():
+        started = time.perf_counter()
+        results[name] = func(conn, results)
+        store(name, results[name], version, (time.perf_counter() - started) * 1000, cache_path)
+    conn.close()
+    return list(results)
+
+
+def load_or_compute(name, conn, cache_path=None):
+    """Stored aggregate if there is one, even if a refresh is pending.
+
+    Only the very first request on an empty cache computes inline.
+    """
+    frame, _ = load(name, cache_path)
+    if frame is not None:
+        return frame
+    results = {}
+    for dependency, func in AGGREGATES.items():
+        results[dependency] = func(conn, results)
+        if dependency == name:
+            break
+    return results[name]
+
+
+class Scheduler:
+    """Daemon thread that refreshes the aggregates when the data changes."""
+
+    def __init__(self, interval=60, db_path=None, cache_path=None):
+        self.interval = interval
+        self.db_path = db_path
+        self.cache_path = cache_path
+        self.last_run = None
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='fleet-precompute', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                refresh(self.db_path, self.cache_path)
+                self.last_run = datetime.datetime.now()
+                self.last_error = None
+            except Exception as e:
+                # Keep serving the last good results; try again on the next tick
+                self.last_error = e
+            self._stop.wait(self.interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute the heavy dashboard aggregates")
+    parser.add_argument('--db', default=None)
+    parser.add_argument('--cache', default=None)
+    parser.add_argument('--interval', type=int, default=60, help="Seconds between checks for changed data")
+    parser.add_argument('--once', action='store_true', help="Refresh once and exit")
+    parser.add_argument('--force', action='store_true', help="Recompute even if the data did not change")
+    args = parser.parse_args()
+
+    while True:
+        started = time.perf_counter()
+        names = refresh(args.db, args.cache, force=args.force)
+        if names:
+            print(f"{datetime.datetime.now():%Y-%m-%d %H:%M:%S} refreshed {', '.join(names)} in {time.perf_counter() - started:.1f}s")
+        if args.once:
+            break
+        args.force = False
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
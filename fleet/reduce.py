@@ -0,0 +1,97 @@
+"""Data reduction for charts.
+
+A chart never needs more marks than can be told apart on screen. Every chart
+has a point budget: the number of bars of a categorical chart, or the number
+of points per line of a time series. Categorical charts keep their largest
+categories and sum the rest into one "Other" category; time series are
+downsampled with Largest-Triangle-Three-Buckets, which keeps the peaks and
+dips a plain every-n-th sample would miss.
+
+Budgets default per kind of chart and can be set per chart id, e.g.
+
+    FLEET_CHART_BUDGETS="penalties.vehicle_agency=50,timeline.odometer=2000"
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+OTHER = 'Other'
+
+DEFAULT_BUDGETS = {'category': 25, 'series': 500}
+
+
+def _configured(value):
+    budgets = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        chart_id, _, points = item.partition('=')
+        budgets[chart_id.strip()] = int(points)
+    return budgets
+
+
+BUDGETS = _configured(os.environ.get('FLEET_CHART_BUDGETS', ''))
+
+
+def budget(chart_id, kind='category'):
+    return BUDGETS.get(chart_id, DEFAULT_BUDGETS[kind])
+
+
+def top_n(df, category, value, n, by=None):
+    """Keep the ``n`` - 1 categories with the largest total ``value`` and sum the rest into "Other".
+
+    ``by`` lists further columns (e.g. the color of a stacked bar) the sums
+    are kept apart by. Categories come back largest first, "Other" last.
+    """
+    by = list(by or [])
+    totals = df.groupby(category)[value].sum().sort_values(ascending=False)
+    keep = totals.index if len(totals) <= n else totals.index[:max(n - 1, 0)]
+    labels = df[category].where(df[category].isin(keep), OTHER)
+    reduced = df.assign(**{category: labels}).groupby([category] + by, sort=False)[value].sum().reset_index()
+    order = reduced[category].map({name: rank for rank, name in enumerate(keep)}).fillna(len(keep))
+    return reduced.iloc[np.argsort(order.to_numpy(), kind='stable')].reset_index(drop=True)
+
+
+def lttb_indices(x, y, threshold):
+    """Positions of the ``threshold`` points LTTB keeps out of ``x``, ``y`` (sorted by x)."""
+    length = len(x)
+    if threshold >= length or threshold < 3:
+        return np.arange(length)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # First and last point are always kept; the rest is split into equal buckets
+    edges = np.linspace(1, length - 1, threshold - 1).astype(int)
+    kept = np.empty(threshold, dtype=int)
+    kept[0] = 0
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_start, next_end = end, edges[bucket + 2] if bucket + 2 < len(edges) else length
+        # Average of the next bucket is the third corner of the triangle
+        average_x = x[next_start:next_end].mean()
+        average_y = y[next_start:next_end].mean()
+        areas = np.abs((x[previous] - average_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (average_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        kept[bucket + 1] = previous
+    kept[-1] = length - 1
+    return kept
+
+
+def lttb(df, x, y, threshold, by=None):
+    """Downsample ``df`` to ``threshold`` points per series (one series per ``by`` value)."""
+    if by is None:
+        return _lttb_series(df, x, y, threshold)
+    return pd.concat([_lttb_series(group, x, y, threshold) for _, group in df.groupby(by, sort=False)],
+                     ignore_index=True) if len(df) else df
+
+
+def _lttb_series(df, x, y, threshold):
+    if len(df) <= threshold:
+        return df
+    df = df.sort_values(x)
+    valid = df[y].notna().to_numpy()
+    points = df.loc[valid]
+    position = points[x]
+    if pd.api.types.is_datetime64_any_dtype(position):
+        position = position.astype('int64')
+    return points.iloc[lttb_indices(position.to_numpy(), points[y].to_numpy(), threshold)]
@@ -0,0 +1,77 @@
+"""Schema of the tables the pages read and write in ``fleet_management.db``."""
+
+BASE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS VehicleBasics (
+    VehicleID TEXT PRIMARY KEY,
+    ChassisNo TEXT,
+    EngineNo TEXT,
+    VehicleType TEXT
+);
+
+CREATE TABLE IF NOT EXISTS branches (
+    Agency TEXT,
+    Branch TEXT
+);
+
+CREATE TABLE IF NOT EXISTS VehicleAllocation (
+    AllocationID INTEGER PRIMARY KEY AUTOINCREMENT,
+    Date TEXT,
+    VehicleID TEXT,
+    Branch TEXT,
+    Agency TEXT,
+    Condition TEXT
+);
+
+CREATE TABLE IF NOT EXISTS Fuel (
+    FuelID INTEGER PRIMARY KEY AUTOINCREMENT,
+    Date TEXT,
+    VehicleID TEXT,
+    Mileage REAL,
+    Type TEXT,
+    Amount REAL,
+    Cost REAL
+);
+
+CREATE TABLE IF NOT EXISTS VehiclesLicenses (
+    LicenseID INTEGER PRIMARY KEY AUTOINCREMENT,
+    Date TEXT,
+    VehicleID TEXT,
+    StartDate TEXT,
+    EndDate TEXT,
+    CurrentMileage REAL
+);
+
+CREATE TABLE IF NOT EXISTS Ownership (
+    OwnershipID INTEGER PRIMARY KEY AUTOINCREMENT,
+    VehicleID TEXT,
+    Ownership TEXT,
+    DataCertificate TEXT,
+    Contract TEXT,
+    UploadDate TEXT
+);
+
+CREATE TABLE IF NOT EXISTS Maintenance (
+    MaintenanceID INTEGER PRIMARY KEY AUTOINCREMENT,
+    Date TEXT,
+    VehicleID TEXT,
+    MaintenanceType TEXT,
+    SparePartName TEXT,
+    Mileage REAL,
+    Cost REAL,
+    ServiceProviderOrGarage TEXT
+);
+
+CREATE TABLE IF NOT EXISTS TrafficPen (
+    PenaltyID INTEGER PRIMARY KEY AUTOINCREMENT,
+    VehicleID TEXT,
+    Date TEXT,
+    Location TEXT,
+    Desc TEXT,
+    Cost REAL,
+    CompanyCode TEXT
+);
+'''
+
+
+def create_schema(conn):
+    conn.executescript(BASE_SCHEMA)
@@ -0,0 +1,262 @@
+"""Deterministic synthetic fleet database for benchmarks.
+
+Creates a ``fleet_management.db`` with the same tables the pages use and
+fills them with plausible history: allocations, yearly license renewals,
+ownership records, fuelings every few days, periodic and ad-hoc
+maintenance, and traffic penalties. The same seed always produces the same
+database.
+
+    python -m fleet.synthetic --vehicles 500 --years 1 --out bench/fleet_management.db
+    python -m fleet.synthetic --vehicles 20000 --years 5 --out bench/fleet_large.db
+"""
+import argparse
+import datetime
+import os
+import random
+import sqlite3
+import time
+
+from fleet.migrations import migrate as apply_migrations
+from fleet.writes import update_derived
+from fleet.schema import create_schema
+
+AGENCIES = {
+    'Cairo': ['Nasr City', 'Maadi', 'Heliopolis', 'Shubra'],
+    'Giza': ['Dokki', 'Haram', '6th of October'],
+    'Alexandria': ['Smouha', 'Agami', 'Sidi Gaber'],
+    'Qalyubia': ['Banha', 'Obour'],
+    'Sharqia': ['Zagazig', '10th of Ramadan'],
+    'Dakahlia': ['Mansoura', 'Talkha'],
+    'Gharbia': ['Tanta', 'Mahalla'],
+    'Monufia': ['Shebin El Kom'],
+    'Beheira': ['Damanhour'],
+    'Ismailia': ['Ismailia'],
+    'Suez': ['Suez'],
+    'Port Said': ['Port Said'],
+    'Fayoum': ['Fayoum'],
+    'Beni Suef': ['Beni Suef'],
+    'Minya': ['Minya', 'Mallawi'],
+    'Assiut': ['Assiut'],
+    'Sohag': ['Sohag'],
+    'Qena': ['Qena'],
+    'Luxor': ['Luxor'],
+    'Aswan': ['Aswan'],
+}
+
+# Vehicle type -> (share of the fleet, km per liter, km driven per day)
+VEHICLE_TYPES = {
+    'Van': (0.45, 9.0, 140),
+    'Pickup': (0.2, 8.0, 160),
+    'Truck': (0.1, 4.5, 220),
+    'Sedan': (0.1, 12.0, 90),
+    'Motorcycle': (0.15, 30.0, 70),
+}
+
+PLATE_LETTERS = 'ABGDRZSCTEFQKLMNHWY'
+
+MAINTENANCE_TYPES = ['Mechanical', 'Electrical', 'Tires', 'Brakes', 'Body Repair', 'Accident', 'Greasing', 'Washing']
+PM_SERVICES = ['PM 10', 'PM 20', 'PM 30', 'PM 40']
+GARAGES = ['Ghabbour Service Center', 'Al Amal Garage', 'Mansour Auto', 'Internal Workshop']
+
+# Penalty descriptions as they appear in the traffic department exports,
+# including a couple of spelling variants seen in real data.
+PENALTIES = [
+    ('انتهاء رخصة التسيير', 400),
+    ('تجاوز السرعة المقررة', 300),
+    ('قيادة السيارة بدون حزام امان', 100),
+    ('إضافة ملصقات مخالفة على جسم المركبة', 500),
+    ('تسبب دون مقتضى فى تعطيل حركة المرور أو تعويقها', 300),
+    ('عدم اتباع إشارات المرور', 500),
+    ('استخدام التليفون يدويا أثناء القيادة', 300),
+    ('تعمد تعطيل حركة المرور', 1000),
+    ('وضع كتابة مخالفة على جسم المركبة', 500),
+    ('عدم اتباع تعليمات رجل المرور', 300),
+    ('وضع رسم مخالف على جسم المركبة', 500),
+    ('الانتظار فى الممنوع', 100),
+    ('قيادة مركبة بدون رخصة تسيير', 1000),
+    ('عدم اتباع علامات المرور', 300),
+    ('الانتظار في الممنوع', 100),
+    ('تجاوز السرعه المقرره', 300),
+]
+
+PENALTY_LOCATIONS = [
+    'الطريق الدائري', 'الطريق الدائرى', 'طريق مصر اسكندرية الصحراوى', 'محور 26 يوليو',
+    'كوبرى اكتوبر', 'شارع صلاح سالم', 'طريق السويس', 'الطريق الاقليمى',
+    'كورنيش النيل', 'شارع الهرم', 'طريق القاهرة الاسماعيلية الصحراوى', 'ميدان التحرير',
+]
+
+CHUNK_SIZE = 50000
+
+
+def fuel_price(day):
+    # Rough EGP per liter, rising with the yearly price reviews
+    return 8.0 + 1.25 * (day.year - 2021) + 0.25 * (day.month >= 7)
+
+
+def make_plate(rng, used):
+    while True:
+        letters = ''.join(rng.choice(PLATE_LETTERS) for _ in range(rng.choice((2, 3))))
+        plate = f"{letters}{rng.randint(100, 9999)}"
+        if plate not in used:
+            used.add(plate)
+            return plate
+
+
+def pick_type(rng):
+    roll = rng.random()
+    for vehicle_type, (share, _, _) in VEHICLE_TYPES.items():
+        roll -= share
+        if roll <= 0:
+            return vehicle_type
+    return 'Van'
+
+
+def vehicle_history(rng, vehicle_id, vehicle_type, start, end):
+    """Yield ``(table, row)`` pairs with the complete history of one vehicle."""
+    _, km_per_liter, km_per_day = VEHICLE_TYPES[vehicle_type]
+    fuel_type = 'Diesel' if vehicle_type == 'Truck' else 'Gasoline'
+
+    # Vehicles join the fleet during the first part of the period
+    joined = start + datetime.timedelta(days=rng.randint(0, max(0, (end - start).days // 4)))
+
+    agency = rng.choice(list(AGENCIES))
+    allocation_date = joined
+    while allocation_date <= end:
+        condition = rng.choices(['Active', 'Inactive', 'Under Maintenance'], weights=[92, 3, 5])[0]
+        yield 'VehicleAllocation', (str(allocation_date), vehicle_id, rng.choice(AGENCIES[agency]), agency, condition)
+        allocation_date += datetime.timedelta(days=rng.randint(120, 700))
+        if rng.random() < 0.3:
+            agency = rng.choice(list(AGENCIES))
+
+    ownership = rng.choices(['JT', 'Lightning', 'Running Rabbit'], weights=[80, 12, 8])[0]
+    yield 'Ownership', (vehicle_id, ownership, rng.choice(['Yes', 'No', 'Not Needed']), rng.choice(['Yes', 'No', 'Not Needed']), f"{joined} 09:00:00")
+    if ownership != 'JT' and rng.random() < 0.4:
+        transfer = joined + datetime.timedelta(days=rng.randint(30, 365))
+        if transfer <= end:
+            yield 'Ownership', (vehicle_id, 'JT', 'Yes', 'Yes', f"{transfer} 09:00:00")
+
+    odometer = rng.randint(0, 150000)
+    license_start = joined - datetime.timedelta(days=rng.randint(0, 300))
+    while license_start <= end:
+        license_end = license_start + datetime.timedelta(days=365)
+        yield 'VehiclesLicenses', (f"{license_start} 10:00:00", vehicle_id, str(license_start), str(license_end), odometer)
+        # Some renewals happen late, and some vehicles are not renewed at all
+        if rng.random() < 0.08:
+            break
+        license_start = license_end + datetime.timedelta(days=rng.randint(0, 45))
+
+    day = joined
+    next_pm = (odometer // 10000 + 1) * 10000
+    pm_index = (odometer // 10000) % len(PM_SERVICES)
+    while day <= end:
+        gap = rng.randint(2, 6)
+        day += datetime.timedelta(days=gap)
+        if day > end:
+            break
+        distance = max(0, rng.gauss(km_per_day, km_per_day * 0.25)) * gap
+        odometer += round(distance)
+        liters = round(distance / max(1.0, rng.gauss(km_per_liter, km_per_liter * 0.1)), 1)
+        if liters <= 0:
+            continue
+        stamp = f"{day} {rng.randint(6, 22):02d}:{rng.randint(0, 59):02d}:00"
+        yield 'Fuel', (stamp, vehicle_id, odometer, fuel_type, liters, round(liters * fuel_price(day), 2))
+
+        if odometer >= next_pm:
+            yield 'Maintenance', (str(day), vehicle_id, PM_SERVICES[pm_index], 'Oil and filters', odometer,
+                                  round(rng.uniform(800, 2500), 2), rng.choice(GARAGES))
+            next_pm += 10000
+            pm_index = (pm_index + 1) % len(PM_SERVICES)
+        if rng.random() < 0.02:
+            yield 'Maintenance', (str(day), vehicle_id, rng.choice(MAINTENANCE_TYPES), rng.choice(['', 'Battery', 'Tyre', 'Brake pads', 'Mirror']),
+                                  odometer, round(rng.uniform(150, 6000), 2), rng.choice(GARAGES))
+        if rng.random() < 0.012:
+            description, cost = rng.choice(PENALTIES)
+            location = rng.choice(PENALTY_LOCATIONS)
+            if rng.random() < 0.2:
+                location = f" {location}  "
+            yield 'TrafficPen', (vehicle_id, stamp, location, description, cost, rng.choice(['JT', 'LT', 'RR']))
+
+
+INSERTS = {
+    'VehicleAllocation': 'INSERT INTO VehicleAllocation (Date, VehicleID, Branch, Agency, Condition) VALUES (?, ?, ?, ?, ?)',
+    'Ownership': 'INSERT INTO Ownership (VehicleID, Ownership, DataCertificate, Contract, UploadDate) VALUES (?, ?, ?, ?, ?)',
+    'VehiclesLicenses': 'INSERT INTO VehiclesLicenses (Date, VehicleID, StartDate, EndDate, CurrentMileage) VALUES (?, ?, ?, ?, ?)',
+    'Fuel': 'INSERT INTO Fuel (Date, VehicleID, Mileage, Type, Amount, Cost) VALUES (?, ?, ?, ?, ?, ?)',
+    'Maintenance': 'INSERT INTO Maintenance (Date, VehicleID, MaintenanceType, SparePartName, Mileage, Cost, ServiceProviderOrGarage) VALUES (?, ?, ?, ?, ?, ?, ?)',
+    'TrafficPen': 'INSERT INTO TrafficPen (VehicleID, Date, Location, Desc, Cost, CompanyCode) VALUES (?, ?, ?, ?, ?, ?)',
+}
+
+
+def generate(path, vehicles=500, years=1, seed=42, end=None, migrate=True):
+    """Create a synthetic database at ``path`` and return its row counts.
+
+    The history is written in the mixed date formats the pages used to write;
+    unless ``migrate`` is false the migrations are applied afterwards.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    rng = random.Random(seed)
+    end = end or datetime.date.today()
+    start = end - datetime.timedelta(days=365 * years)
+
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=OFF')
+    conn.execute('PRAGMA synchronous=OFF')
+    create_schema(conn)
+
+    conn.executemany('INSERT INTO branches (Agency, Branch) VALUES (?, ?)',
+                     [(agency, branch) for agency, branches in AGENCIES.items() for branch in branches])
+
+    used_plates = set()
+    basics = []
+    pending = {table: [] for table in INSERTS}
+    counts = {table: 0 for table in INSERTS}
+
+    def flush(table):
+        conn.executemany(INSERTS[table], pending[table])
+        counts[table] += len(pending[table])
+        pending[table].clear()
+
+    for number in range(vehicles):
+        vehicle_id = make_plate(rng, used_plates)
+        vehicle_type = pick_type(rng)
+        basics.append((vehicle_id, f"CH{seed:02d}{number:08d}", f"EN{number:08d}", vehicle_type))
+        for table, row in vehicle_history(rng, vehicle_id, vehicle_type, start, end):
+            pending[table].append(row)
+            if len(pending[table]) >= CHUNK_SIZE:
+                flush(table)
+
+    for table in INSERTS:
+        flush(table)
+    conn.executemany('INSERT INTO VehicleBasics (VehicleID, ChassisNo, EngineNo, VehicleType) VALUES (?, ?, ?, ?)', basics)
+    counts['VehicleBasics'] = len(basics)
+    conn.commit()
+    if migrate:
+        apply_migrations(conn)
+        with conn:
+            update_derived(conn)
+    conn.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic fleet_management.db")
+    parser.add_argument('--vehicles', type=int, default=500)
+    parser.add_argument('--years', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--end', type=datetime.date.fromisoformat, default=None, help="Last day of generated history (default: today)")
+    parser.add_argument('--out', default='bench/fleet_management.db')
+    parser.add_argument('--raw', action='store_true', help="Skip the migrations and keep the legacy mixed date formats")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    counts = generate(args.out, args.vehicles, args.years, args.seed, args.end, not args.raw)
+    for table, count in sorted(counts.items()):
+        print(f"{table:<20}{count:>12,}")
+    print(f"Generated {args.out} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""Daily odometer and consumption timeline per vehicle.
+
+VehicleTimeline holds one row per vehicle and day between its first and its
+last Fuel or Maintenance entry: the odometer at the end of the day, the km driven
+that day and the fuel and maintenance spent that day. Readings come from
+Fuel and Maintenance; days without a reading get a linearly interpolated
+odometer, so distance over any window is a plain SUM(Km) over a range of
+the (VehicleID, Day) primary key.
+
+The table is kept up to date incrementally. ``sync`` looks at the Fuel and
+Maintenance rows added since the last sync (by ID) and rebuilds the
+timeline of just the vehicles they belong to. Edited or deleted history
+needs ``rebuild``.
+
+    python -m fleet.timeline --db fleet_management.db --rebuild
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from fleet import dates, migrations
+from fleet.db import DB_PATH, connect, last_synced, mark_synced
+
+SOURCES = {'Fuel': 'FuelID', 'Maintenance': 'MaintenanceID'}
+
+COLUMNS = ['VehicleID', 'Day', 'Odometer', 'Km', 'Liters', 'FuelCost', 'MaintenanceCost']
+
+READINGS_QUERY = '''
+    SELECT VehicleID, Date, Mileage, Amount AS Liters, Cost AS FuelCost, 0 AS MaintenanceCost
+    FROM Fuel
+    WHERE VehicleID IN ({vehicles})
+    UNION ALL
+    SELECT VehicleID, Date, Mileage, 0, 0, Cost
+    FROM Maintenance
+    WHERE VehicleID IN ({vehicles})
+'''
+
+
+def build(readings):
+    """Daily timeline rows of every vehicle in ``readings``.
+
+    ``readings`` has VehicleID, Date (datetime), Mileage, Liters, FuelCost and
+    MaintenanceCost. All vehicles are processed at once: the grid of days is
+    laid out vehicle after vehicle on one axis, so a single np.interp call
+    interpolates every vehicle, with each day clipped to the span of its own
+    vehicle's readings.
+    """
+    readings = readings.assign(Day=readings['Date'].dt.normalize()).dropna(subset=['VehicleID', 'Day'])
+    if readings.empty:
+        return pd.DataFrame(columns=COLUMNS)
+
+    # One row per vehicle and day from the first to the last entry
+    spans = readings.groupby('VehicleID')['Day'].agg(['min', 'max'])
+    lengths = ((spans['max'] - spans['min']).dt.days + 1).to_numpy()
+    vehicle_index = np.repeat(np.arange(len(spans)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    grid = pd.DataFrame({
+        'VehicleID': spans.index.to_numpy()[vehicle_index],
+        'Day': spans['min'].to_numpy()[vehicle_index] + pd.to_timedelta(offsets, unit='D'),
+    })
+
+    # The odometer only goes up; readings below an earlier one of the same vehicle are typos
+    odometer = readings.loc[readings['Mileage'] > 0].sort_values(['VehicleID', 'Date'])
+    odometer = odometer.loc[odometer['Mileage'] >= odometer.groupby('VehicleID')['Mileage'].cummax()]
+    odometer = odometer.groupby(['VehicleID', 'Day'])['Mileage'].max().reset_index()
+
+    vehicle_codes = pd.Series(np.arange(len(spans)), index=spans.index)
+    day_number = (grid['Day'] - pd.Timestamp('1970-01-01')).dt.days.to_numpy()
+    grid_x = vehicle_codes[grid['VehicleID']].to_numpy() * 100000 + day_number
+    point_x = vehicle_codes[odometer['VehicleID']].to_numpy() * 100000 + (odometer['Day'] - pd.Timestamp('1970-01-01')).dt.days.to_numpy()
+    interpolated = np.full(len(grid), np.nan)
+    if len(point_x):
+        bounds = pd.DataFrame({'VehicleID': odometer['VehicleID'], 'x': point_x}).groupby('VehicleID')['x'].agg(['min', 'max'])
+        has_points = grid['VehicleID'].isin(bounds.index).to_numpy()
+        low = bounds['min'].reindex(grid['VehicleID']).to_numpy()
+        high = bounds['max'].reindex(grid['VehicleID']).to_numpy()
+        clipped = np.clip(grid_x[has_points], low[has_points], high[has_points])
+        interpolated[has_points] = np.interp(clipped, point_x, odometer['Mileage'].to_numpy())
+    grid['Odometer'] = interpolated
+    grid['Km'] = grid.groupby('VehicleID')['Odometer'].diff().fillna(0).where(grid['Odometer'].notna())
+
+    totals = readings.groupby(['VehicleID', 'Day'])[['Liters', 'FuelCost', 'MaintenanceCost']].sum().reset_index()
+    grid = grid.merge(totals, on=['VehicleID', 'Day'], how='left')
+    grid[['Liters', 'FuelCost', 'MaintenanceCost']] = grid[['Liters', 'FuelCost', 'MaintenanceCost']].fillna(0)
+    grid['Day'] = grid['Day'].dt.strftime('%Y-%m-%d')
+    return grid[COLUMNS]
+
+
+def rebuild_vehicles(conn, vehicle_ids):
+    # Replace the timeline of the given vehicles. The caller commits.
+    vehicle_ids = list(vehicle_ids)
+    for offset in range(0, len(vehicle_ids), 500):
+        chunk = vehicle_ids[offset:offset + 500]
+        placeholders = ', '.join('?' * len(chunk))
+        readings = pd.read_sql_query(READINGS_QUERY.format(vehicles=placeholders), conn, params=chunk * 2)
+        readings['Date'] = pd.to_datetime(readings['Date'], format=dates.FORMAT, errors='coerce')
+        for column in ['Mileage', 'Liters', 'FuelCost', 'MaintenanceCost']:
+            readings[column] = pd.to_numeric(readings[column], errors='coerce').fillna(0)
+
+        conn.execute(f"DELETE FROM VehicleTimeline WHERE VehicleID IN ({placeholders})", chunk)
+        # SQLite stores the NaN odometer of vehicles without readings as NULL
+        conn.executemany(
+            f"INSERT INTO VehicleTimeline ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+            build(readings).itertuples(index=False, name=None)
+        )
+
+
+def sync(conn):
+    """Rebuild the vehicles with Fuel or Maintenance rows added since the last sync.
+
+    Returns the number of vehicles rebuilt. The caller commits.
+    """
+    marks = {}
+    vehicles = set()
+    for table, id_column in SOURCES.items():
+        since = last_synced(conn, f'timeline.{table}')
+        rows = conn.execute(f"SELECT {id_column}, VehicleID FROM {table} WHERE {id_column} > ?", (since,)).fetchall()
+        if rows:
+            marks[table] = max(row[0] for row in rows)
+            vehicles.update(row[1] for row in rows if row[1] is not None)
+    # Nothing is written when there is nothing new, so the data version stays the same
+    rebuild_vehicles(conn, sorted(vehicles))
+    for table, last_id in marks.items():
+        mark_synced(conn, f'timeline.{table}', last_id)
+    return len(vehicles)
+
+
+def rebuild(conn):
+    conn.execute("DELETE FROM VehicleTimeline")
+    for table in SOURCES:
+        mark_synced(conn, f'timeline.{table}', 0)
+    return sync(conn)
+
+
+def window(conn, start_date, end_date, vehicle_ids=None):
+    """Km, liters and costs per vehicle over the whole days from start to end."""
+    query = '''
+        SELECT
+            VehicleID,
+            SUM(Km) AS Km,
+            SUM(Liters) AS Liters,
+            SUM(FuelCost) AS FuelCost,
+            SUM(MaintenanceCost) AS MaintenanceCost
+        FROM VehicleTimeline
+        WHERE Day >= ? AND Day <= ?
+    '''
+    params = [pd.Timestamp(start_date).strftime('%Y-%m-%d'), pd.Timestamp(end_date).strftime('%Y-%m-%d')]
+    if vehicle_ids:
+        query += f" AND VehicleID IN ({', '.join('?' * len(vehicle_ids))})"
+        params += list(vehicle_ids)
+    return pd.read_sql_query(query + " GROUP BY VehicleID", conn, params=params)
+
+
+def vehicle(conn, vehicle_id, start_date=None, end_date=None):
+    # Daily rows of one vehicle, for the drill-down charts
+    query = "SELECT Day, Odometer, Km, Liters, FuelCost, MaintenanceCost FROM VehicleTimeline WHERE VehicleID = ?"
+    params = [vehicle_id]
+    if start_date is not None:
+        query += " AND Day >= ?"
+        params.append(pd.Timestamp(start_date).strftime('%Y-%m-%d'))
+    if end_date is not None:
+        query += " AND Day <= ?"
+        params.append(pd.Timestamp(end_date).strftime('%Y-%m-%d'))
+    df = pd.read_sql_query(query + " ORDER BY Day", conn, params=params)
+    df['Day'] = pd.to_datetime(df['Day'])
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bring the per-vehicle daily timeline up to date")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--rebuild', action='store_true', help="Rebuild the timeline of every vehicle")
+    args = parser.parse_args()
+    conn = connect(args.db)
+    migrations.migrate(conn)
+    with conn:
+        vehicles = rebuild(conn) if args.rebuild else sync(conn)
+    conn.close()
+    print(f"Rebuilt the timeline of {vehicles} vehicles")
+
+
+if __name__ == '__main__':
+    main()
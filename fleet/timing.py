@@ -0,0 +1,80 @@
+"""Span-based wall-clock timing for a single Streamlit rerun.
+
+Each page creates one ``Timer`` per script run and wraps its sections in
+``timer.span(name)``. Spans nest, so ``heatmap/figure`` is recorded as a
+child of ``heatmap``. The collected spans can be exported as JSON and
+compared against an earlier export to spot regressions.
+"""
+import datetime
+import json
+import time
+from contextlib import contextmanager
+
+
+class Timer:
+    def __init__(self, name='rerun'):
+        self.name = name
+        self.started_at = datetime.datetime.now()
+        self.spans = []
+        self._stack = []
+        self._origin = time.perf_counter()
+
+    @contextmanager
+    def span(self, name):
+        path = '/'.join(self._stack + [name])
+        depth = len(self._stack)
+        self._stack.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self._stack.pop()
+            self.spans.append({
+                'span': path,
+                'depth': depth,
+                'start_ms': (start - self._origin) * 1000,
+                'ms': (end - start) * 1000,
+            })
+
+    def rows(self):
+        # Spans are appended when they close, so children come before their
+        # parents; order them by start time for display.
+        return sorted(self.spans, key=lambda row: (row['start_ms'], row['depth']))
+
+    def total_ms(self):
+        return sum(row['ms'] for row in self.spans if row['depth'] == 0)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'total_ms': self.total_ms(),
+            'spans': self.rows(),
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+
+def compare(baseline, current):
+    """Return per-span timings of two exports side by side.
+
+    Both arguments are dictionaries as produced by ``Timer.to_dict``. A span
+    that ran more than once in a rerun is summed.
+    """
+    def totals(export):
+        result = {}
+        for row in export['spans']:
+            result[row['span']] = result.get(row['span'], 0) + row['ms']
+        return result
+
+    before, after = totals(baseline), totals(current)
+    rows = []
+    for span in sorted(set(before) | set(after)):
+        old, new = before.get(span), after.get(span)
+        change = None
+        if old and new is not None:
+            change = (new - old) / old * 100
+        rows.append({'span': span, 'baseline_ms': old, 'current_ms': new, 'change_pct': change})
+    return rows
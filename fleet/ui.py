@@ -0,0 +1,105 @@
+"""Streamlit widgets shared between the pages.
+
+This is the only module in the package that imports Streamlit.
+"""
+import json
+
+import pandas as pd
+import streamlit as st
+
+from fleet import data, figures, journal, migrations, plates, writes
+from fleet.db import connect, data_version
+from fleet.timing import compare
+
+
+def timing_panel(timer):
+    # Optional debug panel, toggled from the sidebar so regular users never see it
+    if not st.sidebar.checkbox("Show render timings", key="show_render_timings"):
+        return
+
+    with st.expander("**Render Timings**", expanded=True):
+        st.write(f"Total render time: {timer.total_ms():,.0f} ms")
+        timings = pd.DataFrame(timer.rows())
+        if not timings.empty:
+            timings['span'] = [' ' * depth + span.rsplit('/', 1)[-1] for span, depth in zip(timings['span'], timings['depth'])]
+            st.dataframe(timings[['span', 'start_ms', 'ms']].round(1), use_container_width=True, hide_index=True)
+
+        st.download_button("Export Timings (JSON)", timer.to_json(), file_name=f"{timer.name}_timings.json", mime="application/json")
+
+        baseline_file = st.file_uploader("Compare with a previous export", type="json", key=f"timing_baseline_{timer.name}")
+        if baseline_file:
+            comparison = pd.DataFrame(compare(json.load(baseline_file), timer.to_dict()))
+            st.dataframe(comparison.round(1), use_container_width=True, hide_index=True)
+
+
+@st.cache_resource
+def migrated():
+    # Once per server process, before any page reads: apply pending migrations
+    # and catch the derived tables up with writes made outside the app
+    applied = migrations.migrate_path()
+    conn = connect()
+    with conn:
+        writes.update_derived(conn)
+    conn.close()
+    return applied
+
+
+@st.cache_resource
+def journal_archiver():
+    # One thread per server process ships the change journal and takes the snapshots
+    return journal.Archiver().start()
+
+
+@st.cache_resource(max_entries=2)
+def _vehicle_index(version):
+    conn = connect()
+    try:
+        return plates.PlateIndex(data.vehicle_ids(conn))
+    finally:
+        conn.close()
+
+
+def vehicle_index():
+    # Plate index of VehicleBasics, shared by all sessions and rebuilt only after a write to the database
+    return _vehicle_index(data_version())
+
+
+def vehicle_ids():
+    return vehicle_index().vehicle_ids
+
+
+# Returned by vehicle_picker when the search matches no plate
+NO_MATCH = object()
+
+
+def vehicle_picker(label, container=st, include_all=False, key=None, limit=plates.LIMIT):
+    """VehicleID picked from the plates matching a search, in Arabic or Latin.
+
+    Only the top ``limit`` matches are sent to the select box. With
+    ``include_all`` an empty search offers "All" first. Returns NO_MATCH
+    when the search matches nothing, and None when there is no vehicle.
+    """
+    # Keyed, so the pick survives the options changing while typing
+    key = key or f"vehicle_picker.{label}"
+    query = container.text_input(label, key=key, placeholder="Type a plate number (Arabic or Latin)")
+    matches = vehicle_index().search(query, limit)
+    if query and not matches:
+        container.caption(f"No vehicle matches '{query}'")
+        return NO_MATCH
+    options = matches if query else (["All"] if include_all else []) + matches
+    return container.selectbox(f"{label} matches", options, key=f"{key}.match", label_visibility="collapsed")
+
+
+@st.cache_resource
+def figure_cache():
+    # One figure cache per server process, shared by all sessions and pages
+    return figures.FigureCache()
+
+
+def cached_figure(chart_id, params, build, version=None):
+    """Figure of ``chart_id`` for ``params``, built with ``build()`` only when not cached.
+
+    ``version`` defaults to the version of the database file, so any write
+    makes every chart rebuild once.
+    """
+    return figure_cache().get(chart_id, params, version or data_version(), build)
@@ -0,0 +1,223 @@
+"""Writes from the Data Insert page and the feeds (fleet.ingest)."""
+import re
+
+import numpy as np
+import pandas as pd
+
+from fleet import activity, alerts, dates, forecast, history, hotspots, journal, ledger, migrations, penalties, timeline
+
+ARABIC_TO_ENGLISH_DICT = {
+    'ا': 'A', 'أ': 'A', 'آ': 'A', 'ب': 'B', 'ت': 'T', 'ث': 'TH', 'ج': 'G',
+    'ح': 'H', 'خ': 'KH', 'د': 'D', 'ذ': 'TH', 'ر': 'R',
+    'ز': 'Z', 'س': 'S', 'ش': 'SH', 'ص': 'C', 'ض': 'D',
+    'ط': 'T', 'ظ': 'TH', 'ع': 'E', 'غ': 'GH', 'ف': 'F',
+    'ق': 'Q', 'ك': 'K', 'ل': 'L', 'م': 'M', 'ن': 'N',
+    'ه': 'H', 'ة': 'H', 'و': 'W', 'ي': 'Y', 'ى': 'Y',
+    'ؤ': 'W', 'إ': 'A', 'ئ': 'Y',
+
+    '٠': '0', '١': '1', '٢': '2', '٣': '3', '٤': '4',
+    '٥': '5', '٦': '6', '٧': '7', '٨': '8', '٩': '9'
+}
+
+
+def transform_and_rearrange(text):
+    # Plate numbers as VehicleBasics stores them: Arabic letters and digits
+    # transliterated, letters first, then digits, upper case
+    translated_text = ''
+
+    for char in str(text):
+        if char in ARABIC_TO_ENGLISH_DICT:
+            translated_text += ARABIC_TO_ENGLISH_DICT[char]
+        elif char != ' ':
+            translated_text += char
+
+    letters = re.findall('[A-Za-z]+', translated_text)
+    numbers = re.findall(r'\d+', translated_text)
+
+    rearranged_text = ''.join(letters) + ''.join(numbers)
+
+    return rearranged_text.upper()
+
+
+def existing_vehicles(conn, vehicle_ids):
+    # The given IDs that are in VehicleBasics
+    vehicle_ids = list(vehicle_ids)
+    found = set()
+    for offset in range(0, len(vehicle_ids), 500):
+        chunk = vehicle_ids[offset:offset + 500]
+        found.update(row[0] for row in conn.execute(
+            f"SELECT VehicleID FROM VehicleBasics WHERE VehicleID IN ({', '.join('?' * len(chunk))})", chunk))
+    return found
+
+
+def required_columns(table):
+    # A key column left empty would let repeats through the unique index (NULLs never conflict)
+    key = [column for column in migrations.NATURAL_KEYS.get(table, []) if column.isidentifier()]
+    return ['VehicleID'] + [column for column in key if column != 'VehicleID']
+
+
+def check(conn, table, rows, vehicle_ids):
+    """Split ``rows`` into the rows to insert and the rejected ``(row, error)`` pairs.
+
+    Plate numbers are transliterated like imported ones and looked up in
+    ``vehicle_ids`` (the VehicleIDs of VehicleBasics) all at once, rather
+    than with a query per row.
+    """
+    known = set(vehicle_ids)
+    required = required_columns(table)
+    branch_pairs = set(conn.execute("SELECT Agency, Branch FROM branches").fetchall()) if table == 'VehicleAllocation' else None
+    valid = []
+    rejected = []
+    for row in rows:
+        row = dict(row)
+        missing = [column for column in required if pd.isna(row.get(column)) or row[column] == '']
+        if missing:
+            rejected.append((row, f"Missing {', '.join(missing)}"))
+            continue
+        row['VehicleID'] = transform_and_rearrange(row['VehicleID'])
+        if table == 'VehicleBasics':
+            if row['VehicleID'] in known:
+                rejected.append((row, f"Vehicle with ID {row['VehicleID']} already exists in VehicleBasics"))
+                continue
+        elif row['VehicleID'] not in known:
+            rejected.append((row, f"Vehicle with ID {row['VehicleID']} does not exist in VehicleBasics"))
+            continue
+        if branch_pairs is not None and (row.get('Agency'), row.get('Branch')) not in branch_pairs:
+            rejected.append((row, f"{row.get('Branch')} is not a branch of {row.get('Agency')}"))
+            continue
+        valid.append(row)
+    return valid, rejected
+
+
+def normalize(table, row):
+    # Dates of the history tables are stored in the canonical format
+    if table in dates.TABLES and row.get('Date') is not None:
+        row['Date'] = dates.canonical(row['Date'])
+    return row
+
+
+# Modules keeping derived tables, in the order they are brought up to date;
+# the ledger sums the timeline, so it follows it
+DERIVED = [timeline, ledger, activity, forecast, alerts, penalties, hotspots, history]
+
+# Kind and table of a data-changing statement typed on the SQL Queries page
+STATEMENT = re.compile(r'\s*(INSERT|REPLACE|UPDATE|DELETE)(?:\s+OR\s+\w+)?(?:\s+INTO|\s+FROM)?\s+["`\[]?(\w+)', re.IGNORECASE)
+
+# Leading keyword of a statement that changes the data or the schema
+WRITE = re.compile(r'\s*(INSERT|REPLACE|UPDATE|DELETE|CREATE|DROP|ALTER)\b', re.IGNORECASE)
+SCHEMA = re.compile(r'\s*(CREATE|DROP|ALTER)\b', re.IGNORECASE)
+
+
+def is_write(statement):
+    """Whether ``statement`` changes the data or the schema, by its leading keyword."""
+    return WRITE.match(statement) is not None
+
+
+def update_derived(conn, table=None):
+    """Bring the tables derived from ``table`` (or from every table) up to date.
+
+    Runs on the caller's connection, so the derived rows are committed in
+    the same transaction as the rows they were derived from.
+    """
+    for module in DERIVED:
+        if table is None or table in module.SOURCES:
+            module.sync(conn)
+
+
+def rebuild_derived(conn, table=None):
+    """Rebuild the tables derived from ``table`` (or from every table) from scratch.
+
+    The syncs of update_derived only see rows added since the last sync;
+    edited or deleted rows need this. The caller commits.
+    """
+    for module in DERIVED:
+        if table is None or table in module.SOURCES:
+            module.rebuild(conn)
+
+
+def after_statement(conn, statement):
+    """Bring the derived tables up to date after ``statement`` changed data.
+
+    Inserted rows are synced; rows updated or deleted, or by a statement
+    whose table cannot be told, are rebuilt from. Schema statements change
+    no rows. The caller commits.
+    """
+    if SCHEMA.match(statement):
+        return
+    match = STATEMENT.match(statement)
+    if match is None:
+        rebuild_derived(conn)
+        return
+    # SQLite table names are case-insensitive
+    sources = {name.lower(): name for module in DERIVED for name in module.SOURCES}
+    table = sources.get(match[2].lower(), match[2])
+    if match[1].upper() == 'INSERT':
+        update_derived(conn, table)
+    else:
+        rebuild_derived(conn, table)
+
+
+def _bindable(value):
+    # Rows of an uploaded sheet or an entry grid hold numpy scalars, which sqlite3 cannot bind
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def append(conn, table, row):
+    """Insert and journal ``row`` (column -> value) without updating the derived tables.
+
+    Returns the rowid, or None when a row with the same natural key is
+    already stored (see migrations.NATURAL_KEYS). The caller commits.
+    """
+    row = normalize(table, dict(row))
+    columns = list(row)
+    values = [_bindable(value) for value in row.values()]
+    cursor = conn.execute(
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) ON CONFLICT DO NOTHING",
+        values
+    )
+    if not cursor.rowcount:
+        return None
+    journal.record_rows(conn, table, cursor.lastrowid, cursor.lastrowid)
+    return cursor.lastrowid
+
+
+def append_rows(conn, table, rows):
+    """Insert and journal ``rows`` (dicts with the same columns) without updating the derived tables.
+
+    Returns the rows as stored, taken from the inserts themselves (RETURNING)
+    rather than read back; rows already stored are skipped and missing from
+    the result. The caller commits.
+    """
+    rows = [normalize(table, dict(row)) for row in rows]
+    if not rows:
+        return pd.DataFrame()
+    columns = list(rows[0])
+    placeholders = '(' + ', '.join('?' * len(columns)) + ')'
+    stored = []
+    names = []
+    # 500 rows per statement stay well below SQLite's limit on bound values
+    for offset in range(0, len(rows), 500):
+        chunk = rows[offset:offset + 500]
+        cursor = conn.execute(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES {', '.join([placeholders] * len(chunk))} "
+            f"ON CONFLICT DO NOTHING RETURNING rowid AS _rowid, *",
+            [_bindable(row[column]) for row in chunk for column in columns]
+        )
+        stored += cursor.fetchall()
+        names = [description[0] for description in cursor.description]
+    stored = pd.DataFrame(stored, columns=names).sort_values('_rowid')
+    if len(stored):
+        # No other writer gets in between inside this transaction, so the range is ours
+        journal.record_rows(conn, table, int(stored['_rowid'].iloc[0]), int(stored['_rowid'].iloc[-1]))
+    return stored.drop(columns='_rowid').reset_index(drop=True)
+
+
+def insert(conn, table, rows):
+    """Insert ``rows`` into ``table`` and update the derived tables, in the caller's transaction.
+
+    Returns the rows as stored (see append_rows); rows already stored are
+    not in it. The caller commits.
+    """
+    stored = append_rows(conn, table, rows)
+    update_derived(conn, table)
+    return stored
@@ -1,9 +1,11 @@
 import streamlit as st
-import pandas as pd
 import datetime
-import sqlite3
 import plotly.express as px
-import numpy as np
+
+from fleet import activity, alerts, analytics, data, forecast, hotspots, ledger, penalties, reduce, timeline
+from fleet.db import QueryPool, connect
+from fleet.timing import Timer
+from fleet.ui import NO_MATCH, cached_figure, migrated, timing_panel, vehicle_picker
 
 # Set page title and icon
 st.set_page_config(
@@ -11,80 +13,23 @@ st.set_page_config(
     layout='wide',
     page_icon='logo.png'
 )
-conn = sqlite3.connect('fleet_management.db')
-cursor = conn.cursor()
-
-translations = {
-    "انتهاء رخصة التسيير": "Expiry of the driving license.",
-    "تجاوز السرعة المقررة": "Exceeding the specified speed limit.",
-    "قيادة السيارة بدون حزام امان": "Driving without wearing a seatbelt.",
-    "إضافة ملصقات مخالفة على جسم المركبة": "Placing stickers to the vehicle's body.",
-    "تسبب دون مقتضى فى تعطيل حركة المرور أو تعويقها": "Causing the obstruction of traffic.",
-    "عدم اتباع إشارات المرور": "Failure to obey traffic signals.",
-    "استخدام التليفون يدويا أثناء القيادة": "Using the phone manually while driving.",
-    "تعمد تعطيل حركة المرور": "Intentionally obstructing traffic.",
-    "وضع كتابة مخالفة على جسم المركبة": "Placing a text on the vehicle's body.",
-    "عدم اتباع تعليمات رجل المرور": "Failure to follow traffic officer instructions.",
-    "وضع رسم مخالف على جسم المركبة": "Placing a drawing on the vehicle's body.",
-    "الانتظار فى الممنوع": "Waiting in a prohibited area.",
-    "قيادة مركبة بدون رخصة تسيير": "Driving a vehicle without a driving license.",
-    "عدم اتباع علامات المرور": "Disregarding traffic signs."
-}
+migrated()
+conn = connect()
+
+
+@st.cache_resource
+def read_pool():
+    # Worker threads with their own read connections, shared by all sessions
+    return QueryPool()
+
+
+# Render timings of this rerun, shown in the optional debug panel
+timer = Timer('reports')
 
 
 @st.cache_data(ttl=60 * 15)
-def basic_data_fun(where_clause_str):
-    basic_data = pd.read_sql_query(f'''
-    WITH VehicleAllocationCTE AS (
-      SELECT
-        VA1.VehicleID,
-        VA1.Agency,
-        VA1.Branch,
-        VA1.Condition,
-        ROW_NUMBER() OVER (PARTITION BY VA1.VehicleID ORDER BY VA1.AllocationID DESC) AS row_num
-      FROM VehicleAllocation VA1
-    ),
-    FuelCTE AS (
-      SELECT
-        F1.VehicleID,
-        F1.Amount,
-        F1.Date,
-        ROW_NUMBER() OVER (PARTITION BY F1.VehicleID ORDER BY F1.Date DESC) AS row_num
-      FROM Fuel F1
-    ),
-    VehiclesLicensesCTE AS (
-      SELECT
-        VL1.VehicleID,
-        VL1.EndDate,
-        ROW_NUMBER() OVER (PARTITION BY VL1.VehicleID ORDER BY VL1.LicenseID DESC) AS row_num
-      FROM VehiclesLicenses VL1
-    ),
-    OwnershipCTE AS (
-      SELECT
-        O1.VehicleID,
-        O1.Ownership,
-        ROW_NUMBER() OVER (PARTITION BY O1.VehicleID ORDER BY O1.OwnershipID DESC) AS row_num
-      FROM Ownership O1
-    )
-    SELECT
-      DISTINCT VB.VehicleID AS "Vehicle ID",
-      VB.ChassisNo AS "Chassis No.",
-      VB.VehicleType AS "Vehicle Type",
-      VA.Agency AS "Agency",
-      VA.Branch AS "Branch",
-      F.Amount AS "Last Fuel Amount",
-      F.Date AS "Last Fuel Date",
-      VL.EndDate AS "Licence End Date",
-      O.Ownership AS "Ownership",
-      VA.Condition AS "Condition"
-    FROM VehicleBasics VB
-    LEFT JOIN VehicleAllocationCTE VA ON VB.VehicleID = VA.VehicleID AND VA.row_num = 1
-    LEFT JOIN FuelCTE F ON VB.VehicleID = F.VehicleID AND F.row_num = 1
-    LEFT JOIN VehiclesLicensesCTE VL ON VB.VehicleID = VL.VehicleID AND VL.row_num = 1
-    LEFT JOIN OwnershipCTE O ON VB.VehicleID = O.VehicleID AND O.row_num = 1
-    WHERE {where_clause_str};
-    ''', con=conn)
-    return basic_data
+def basic_data_fun(filters):
+    return data.vehicle_state(conn, filters)
 
 
 # Reports section
@@ -92,431 +37,400 @@ def reports():
     st.title("Reports")
 
     col1, nocol = st.columns([1, 3])
-    report_option = col1.selectbox("Select Report:", ["Basic Vehicle Data", "Action Needed", "Expenses", "Maintenance History", "Traffic Penalties","Fuel Fraud"])
+    report_option = col1.selectbox("Select Report:", ["Basic Vehicle Data", "Action Needed", "Expenses", "Maintenance History", "Traffic Penalties","Fuel Fraud", "Vehicle Timeline", "Utilization", "Due Soon", "Cost per KM"])
+
+    with timer.span("filters"):
+        col1, col2, col3, col4 = st.columns(4)
+        agencies = data.agencies(conn)
+        vehicle_types = data.vehicle_types(conn)
 
-    col1, col2, col3, col4 = st.columns(4)
-    vehicle_ids = list(set(row[0] for row in cursor.execute("SELECT VehicleID FROM VehicleBasics").fetchall()))
-    agencies = list(set(row[0] for row in cursor.execute("SELECT Agency FROM VehicleAllocation").fetchall()))
-    vehicle_types = list(set(row[0] for row in cursor.execute("SELECT VehicleType FROM VehicleBasics").fetchall()))
+        agencies.insert(0, "All")
+        vehicle_types.insert(0, "All")
 
-    vehicle_ids.insert(0, "All")
-    agencies.insert(0, "All")
-    vehicle_types.insert(0, "All")
+        search_value = vehicle_picker("Search by VehicleID", col1, include_all=True)
+        search_agency = col2.selectbox("Search by Agency", agencies)
+        search_chassis = col3.text_input("Search by Chassis")
+        search_type = col4.selectbox("Search by Type", vehicle_types)
 
-    search_value = col1.selectbox("Search by VehicleID", vehicle_ids)
-    search_agency = col2.selectbox("Search by Agency", agencies)
-    search_chassis = col3.text_input("Search by Chassis")
-    search_type = col4.selectbox("Search by Type", vehicle_types)
+    # No report for a vehicle search that matches nothing, rather than the whole fleet
+    if search_value is NO_MATCH:
+        st.info("No vehicle matches the search.")
+        return
 
     # Define a date range slider
     start_date, end_date = st.select_slider(
         'Select a Date Range',
         options=[datetime.date(2023, 9, 1) + datetime.timedelta(days=x) for x in range((datetime.date.today() - datetime.date(2023, 9, 1)).days + 1)], value=(datetime.date(2023, 9, 1), datetime.date.today()))
 
-    where_clause = []
-    if search_value != "All":
-        where_clause.append(f'"Vehicle ID" = "{search_value}"')
-    if search_agency != "All":
-        where_clause.append(f'"Agency" = "{search_agency}"')
-    if search_chassis:
-        where_clause.append(f'"Chassis No." LIKE "%{search_chassis}%"')
-    if search_type != "All":
-        where_clause.append(f'"Vehicle Type" = "{search_type}"')
-
-    # Construct the WHERE clause as a string
-    where_clause_str = ' AND '.join(where_clause) if where_clause else "1=1"  # Default to 1=1 for no filtering
+    # Each report applies the filters it supports as query parameters
+    filters = {
+        'vehicle_id': search_value,
+        'agency': search_agency,
+        'chassis': search_chassis,
+        'vehicle_type': search_type,
+    }
+    # Charts are cached per report inputs and data version (fleet.figures), and
+    # drawn with at most their point budget of bars or points (fleet.reduce)
+    chart_params = dict(filters, start_date=start_date, end_date=end_date)
 
     if report_option == "Basic Vehicle Data":
-        st.subheader("Basic Vehicle Data")
-        st.write("View basic data of vehicles.")
-
-        # Replace with code to display basic vehicle data with date filter and search options
-        basic_data = basic_data_fun(where_clause_str)
-        datacol, chartcol = st.columns([2, 1])
-        datacol.dataframe(basic_data, use_container_width=True, hide_index=True)
-
-        # Display a bar chart for the total cost of traffic penalties by vehicle type
-        vehicle_type_distribution = basic_data['Vehicle Type'].value_counts()
-        chartcol.plotly_chart(px.bar(vehicle_type_distribution, x=vehicle_type_distribution.index, y='Vehicle Type',
-                                     title='Vehicle Type Distribution', text_auto=True,
-                                     labels={'Vehicle Type': 'Count'}, color_discrete_sequence=px.colors.qualitative.Set1),
-                              use_container_width=True)
-
-        ownership_types = basic_data['Ownership'].value_counts()
-        chartcol.plotly_chart(px.pie(ownership_types, names=ownership_types.index, values=ownership_types.values,
-                                     title='Ownership Distribution', color_discrete_sequence=px.colors.qualitative.Set2,hole=0.4),
-                              use_container_width=True)
+        with timer.span("Basic Vehicle Data"):
+            st.subheader("Basic Vehicle Data")
+            st.write("View basic data of vehicles.")
+
+            # Replace with code to display basic vehicle data with date filter and search options
+            with timer.span("query"):
+                basic_data = basic_data_fun(filters)
+            datacol, chartcol = st.columns([2, 1])
+            datacol.dataframe(basic_data, use_container_width=True, hide_index=True)
+
+            # Display a bar chart for the total cost of traffic penalties by vehicle type
+            def vehicle_type_figure():
+                vehicle_type_distribution = basic_data['Vehicle Type'].value_counts().rename('Vehicle Type').rename_axis(None)
+                return px.bar(vehicle_type_distribution, x=vehicle_type_distribution.index, y='Vehicle Type',
+                              title='Vehicle Type Distribution', text_auto=True,
+                              labels={'Vehicle Type': 'Count'}, color_discrete_sequence=px.colors.qualitative.Set1)
+            chartcol.plotly_chart(cached_figure('basic.vehicle_type', filters, vehicle_type_figure), use_container_width=True)
+
+            def ownership_figure():
+                ownership_types = basic_data['Ownership'].value_counts()
+                return px.pie(ownership_types, names=ownership_types.index, values=ownership_types.values,
+                              title='Ownership Distribution', color_discrete_sequence=px.colors.qualitative.Set2,hole=0.4)
+            chartcol.plotly_chart(cached_figure('basic.ownership', filters, ownership_figure), use_container_width=True)
 
     elif report_option == "Action Needed":
-        st.subheader("Action Needed")
-        st.write("View actions needed for vehicles (e.g., license renewal, ownership transfer).")
-        # Replace with code to display action-needed data with date filter
-        action_data = pd.read_sql_query(f'''
-        WITH RankedLicenses AS (
-            SELECT
-                VehicleID,
-                LicenseID,
-                EndDate,  -- Replace this with the actual column name
-                ROW_NUMBER() OVER (PARTITION BY VehicleID ORDER BY LicenseID DESC) AS RowNum
-            FROM VehiclesLicenses
-        ),
-        RankedOwnership AS (
-            SELECT
-                VehicleID,
-                OwnershipID,
-                Ownership,
-                ROW_NUMBER() OVER (PARTITION BY VehicleID ORDER BY OwnershipID DESC) AS RowNum
-            FROM Ownership
-        ),
-        RankedAllocation AS (
-            SELECT
-                VehicleID,
-                Agency,
-                Branch,
-                Condition,
-                ROW_NUMBER() OVER (PARTITION BY VehicleID ORDER BY AllocationID DESC) AS RowNum
-            FROM VehicleAllocation
-        )
-        SELECT
-            VB.VehicleID AS "Vehicle ID",
-            VB.VehicleType AS "Vehicle Type",
-            VA.Agency,
-            VA.Branch,
-            
-            VL.EndDate AS "Licence End Date",
-            O.Ownership AS "Ownership",
-            CASE
-                WHEN VL.EndDate < DATE('now') AND (O.Ownership = 'JT' OR O.Ownership IS NULL) THEN 'Renew License'
-                WHEN VL.EndDate >= DATE('now') AND VL.EndDate <= DATE('now', '+1 month') AND (O.Ownership = 'JT' OR O.Ownership IS NULL) THEN 'Renew Soon'
-                WHEN VL.EndDate < DATE('now') AND O.Ownership != 'JT' THEN 'Ownership Transfer and Renew License'
-                WHEN VL.EndDate >= DATE('now') AND VL.EndDate <= DATE('now', '+1 month') AND O.Ownership != 'JT' THEN 'Ownership Transfer and Renew Soon'
-                WHEN O.Ownership != 'JT' THEN 'Ownership Transfer'
-                ELSE 'No Action Needed'
-            END AS "Action Needed",
-            CASE
-                WHEN VL.EndDate < DATE('now') THEN 'High'
-                WHEN VL.EndDate >= DATE('now') AND VL.EndDate <= DATE('now', '+1 month') THEN 'Medium'
-                ELSE 
-                    CASE
-                        WHEN O.Ownership != 'JT' THEN
-                            CASE
-                                WHEN VL.EndDate < DATE('now') THEN 'High'
-                                WHEN VL.EndDate >= DATE('now') AND VL.EndDate <= DATE('now', '+1 month') THEN 'Medium'
-                                ELSE 'Low'
-                            END
-                        ELSE 'Low'
-                    END
-            END AS "Priority Type",
-            VA.Condition
-        FROM (
-            SELECT VB.VehicleID
-            FROM VehicleBasics VB
-        ) AS UniqueVehicles
-        LEFT JOIN RankedLicenses VL ON UniqueVehicles.VehicleID = VL.VehicleID AND VL.RowNum = 1
-        LEFT JOIN RankedOwnership O ON UniqueVehicles.VehicleID = O.VehicleID AND O.RowNum = 1
-        LEFT JOIN RankedAllocation VA ON UniqueVehicles.VehicleID = VA.VehicleID AND VA.RowNum = 1
-        LEFT JOIN VehicleBasics VB ON UniqueVehicles.VehicleID = VB.VehicleID
-        WHERE "Action Needed" <> 'No Action Needed'
-        AND {where_clause_str}
-        AND "Condition" <>'Inactive'
-            ''', con=conn)
-        datacol, chartcol = st.columns([2, 1])
-        datacol.dataframe(action_data.drop_duplicates(), use_container_width=True, hide_index=True)
-        action_distribution = action_data['Action Needed'].value_counts()
-        chartcol.plotly_chart(px.bar(action_distribution, x=action_distribution.index, y='Action Needed',
-                                     title='Action Needed Distribution', text_auto=True,
-                                     labels={'Action Needed': 'Count'}, color_discrete_sequence=px.colors.qualitative.Set1),
-                              use_container_width=True)
+        with timer.span("Action Needed"):
+            st.subheader("Action Needed")
+            st.write("View actions needed for vehicles (e.g., license renewal, ownership transfer).")
+            # Replace with code to display action-needed data with date filter
+            with timer.span("query"):
+                action_data = data.action_needed(conn, filters)
+            datacol, chartcol = st.columns([2, 1])
+            datacol.dataframe(action_data, use_container_width=True, hide_index=True)
+            datacol.download_button("Download Daily Digest", alerts.digest(conn).to_csv(index=False),
+                                    file_name=f"alerts-{alerts.today()}.csv", mime="text/csv")
+
+            def action_figure():
+                action_distribution = action_data['Action Needed'].value_counts().rename('Action Needed').rename_axis(None)
+                return px.bar(action_distribution, x=action_distribution.index, y='Action Needed',
+                              title='Action Needed Distribution', text_auto=True,
+                              labels={'Action Needed': 'Count'}, color_discrete_sequence=px.colors.qualitative.Set1)
+            # The actions also move with the date
+            chartcol.plotly_chart(cached_figure('action_needed.distribution', dict(filters, day=alerts.today()), action_figure),
+                                  use_container_width=True)
 
     elif report_option == "Expenses":
-        st.subheader("Expenses")
-        st.write("View expenses for each vehicle and area.")
-
-        query = f'''
-        WITH ExpenseData AS (
-            SELECT
-                M.MaintenanceID AS ID,
-                M.VehicleID,
-                M.Date,
-                VB.VehicleType,
-                VA.Agency,
-                VB.ChassisNo,
-                M.Cost,
-                M.MaintenanceType
-            FROM Maintenance M
-            LEFT JOIN VehicleBasics VB ON M.VehicleID = VB.VehicleID
-            LEFT JOIN (
-                SELECT
-                    VehicleID,
-                    Agency,
-                    ROW_NUMBER() OVER (PARTITION BY VehicleID ORDER BY AllocationID DESC) AS row_num
-                FROM VehicleAllocation
-            ) VA ON M.VehicleID = VA.VehicleID AND VA.row_num = 1
-            UNION ALL
-            SELECT
-                F.FuelID,
-                F.VehicleID,
-                F.Date,
-                VB.VehicleType,
-                VA.Agency,
-                VB.ChassisNo,
-                F.Cost,
-                NULL AS MaintenanceType
-            FROM Fuel F
-            LEFT JOIN VehicleBasics VB ON F.VehicleID = VB.VehicleID
-            LEFT JOIN (
-                SELECT
-                    VehicleID,
-                    Agency,
-                    ROW_NUMBER() OVER (PARTITION BY VehicleID ORDER BY AllocationID DESC) AS row_num
-                FROM VehicleAllocation
-            ) VA ON F.VehicleID = VA.VehicleID AND VA.row_num = 1
-        )
-
-        SELECT
-            ID,
-            VehicleID AS "Vehicle ID",
-            Date,
-            VehicleType AS "Vehicle Type",
-            Agency,
-            ChassisNo AS "Chassis No.",
-            CASE WHEN MaintenanceType IS NOT NULL THEN 'Maintenance' ELSE 'Fuel' END AS "Expense Type",
-            Cost
-        FROM ExpenseData
-        WHERE Date BETWEEN ? AND ? AND {where_clause_str};
-        '''
-
-        expenses_data = pd.read_sql_query(query, con=conn, params=(start_date, end_date)).drop_duplicates()
-        st.write(f"The total cost for the selected period is: {expenses_data['Cost'].sum():,.0f} EGP")
-        datacol, chartcol = st.columns([2, 1])
-        datacol.dataframe(expenses_data, use_container_width=True, hide_index=True)
-        # Display a pie chart for the distribution of expense types
-        expense_distribution = expenses_data.groupby('Expense Type')['Cost'].sum()
-        chartcol.plotly_chart(px.pie(expense_distribution, names=expense_distribution.index, values=expense_distribution.values,
-                                     title='Expense Type Distribution', color_discrete_sequence=px.colors.qualitative.Set2, hole=0.4),
-                              use_container_width=True)
-        total_cost_by_agency = expenses_data.groupby(['Agency', 'Expense Type'])['Cost'].sum().sort_values(ascending=False).reset_index()
-        chartcol.plotly_chart(px.bar(total_cost_by_agency, x='Agency', y='Cost', color='Expense Type',
-                                     title='Total Cost by Agency', labels={'Cost': 'Total Cost (EGP)'},
-                                     color_discrete_sequence=px.colors.qualitative.Set2),
-                              use_container_width=True)
-        cost_by_vehicle_type = expenses_data.groupby(['Vehicle Type', 'Expense Type'])['Cost'].sum().sort_values(ascending=False).reset_index()
-        chartcol.plotly_chart(px.bar(cost_by_vehicle_type, x='Vehicle Type', y='Cost', color='Expense Type',
-                                     title='Total Cost by Vehicle Type', labels={'Cost': 'Total Cost (EGP)'},
-                                     color_discrete_sequence=px.colors.qualitative.Set2),
-                              use_container_width=True)
+        with timer.span("Expenses"):
+            st.subheader("Expenses")
+            st.write("View expenses for each vehicle and area.")
+
+            with timer.span("query"):
+                expenses_data = data.expenses(read_pool(), start_date, end_date, filters)
+            st.write(f"The total cost for the selected period is: {expenses_data['Cost'].sum():,.0f} EGP")
+            datacol, chartcol = st.columns([2, 1])
+            datacol.dataframe(expenses_data, use_container_width=True, hide_index=True)
+            # Display a pie chart for the distribution of expense types
+            def expense_type_figure():
+                expense_distribution = expenses_data.groupby('Expense Type')['Cost'].sum()
+                return px.pie(expense_distribution, names=expense_distribution.index, values=expense_distribution.values,
+                              title='Expense Type Distribution', color_discrete_sequence=px.colors.qualitative.Set2, hole=0.4)
+            chartcol.plotly_chart(cached_figure('expenses.type', chart_params, expense_type_figure), use_container_width=True)
+
+            def agency_cost_figure():
+                total_cost_by_agency = reduce.top_n(expenses_data, 'Agency', 'Cost', reduce.budget('expenses.agency'), by=['Expense Type'])
+                return px.bar(total_cost_by_agency, x='Agency', y='Cost', color='Expense Type',
+                              title='Total Cost by Agency', labels={'Cost': 'Total Cost (EGP)'},
+                              color_discrete_sequence=px.colors.qualitative.Set2)
+            chartcol.plotly_chart(cached_figure('expenses.agency', chart_params, agency_cost_figure), use_container_width=True)
+
+            def vehicle_type_cost_figure():
+                cost_by_vehicle_type = reduce.top_n(expenses_data, 'Vehicle Type', 'Cost', reduce.budget('expenses.vehicle_type'), by=['Expense Type'])
+                return px.bar(cost_by_vehicle_type, x='Vehicle Type', y='Cost', color='Expense Type',
+                              title='Total Cost by Vehicle Type', labels={'Cost': 'Total Cost (EGP)'},
+                              color_discrete_sequence=px.colors.qualitative.Set2)
+            chartcol.plotly_chart(cached_figure('expenses.vehicle_type', chart_params, vehicle_type_cost_figure), use_container_width=True)
 
     elif report_option == "Maintenance History":
-        st.subheader("Maintenance History")
-        st.write("View maintenance history, focusing on repeated maintenance within a short period.")
-        # Replace with code to display maintenance history data with date filter
-        maintenance_history_data = pd.read_sql_query(f'''SELECT
-        M.MaintenanceID,
-        M.Date AS MaintenanceDate,
-        M.VehicleID,
-        M.MaintenanceType,
-        M.Mileage,
-        M.Cost,
-        CASE
-            WHEN EXISTS (
-                SELECT 1
-                FROM Maintenance AS PrevM
-                WHERE PrevM.VehicleID = M.VehicleID
-                AND PrevM.Date < M.Date
-            ) THEN 'Yes'
-            ELSE 'No'
-        END AS PreviousMaintenance,
-        CASE
-            WHEN EXISTS (
-                SELECT 1
-                FROM Maintenance AS PrevM
-                WHERE PrevM.VehicleID = M.VehicleID
-                AND PrevM.Date < M.Date
-            ) AND M.Mileage - LAG(M.Mileage) OVER (PARTITION BY M.VehicleID ORDER BY M.Date) < 5000 THEN 'Normal'
-            WHEN EXISTS (
-                SELECT 1
-                FROM Maintenance AS PrevM
-                WHERE PrevM.VehicleID = M.VehicleID
-                AND PrevM.Date < M.Date
-            ) AND M.Mileage - LAG(M.Mileage) OVER (PARTITION BY M.VehicleID ORDER BY M.Date) >= 5000 THEN 'Abnormal'
-            ELSE 'No Previous Maintenance'
-        END AS MaintenanceStatus,
-        COUNT(*) OVER (PARTITION BY M.VehicleID, M.MaintenanceType) AS "Maintenance Count"
-    FROM Maintenance AS M
-    WHERE M.Date BETWEEN '{start_date}' AND '{end_date}' AND {where_clause_str};
-
-        ''', con=conn)
-        datacol, chartcol = st.columns([2, 1])
-        datacol.dataframe(maintenance_history_data.drop_duplicates(), use_container_width=True, hide_index=True)
-        # Maintenance status distribution pie chart
-        maintenance_status_distribution = maintenance_history_data['MaintenanceStatus'].value_counts()
-
-        chartcol.plotly_chart(px.pie(maintenance_status_distribution,
-                                     names=maintenance_status_distribution.index,
-                                     values=maintenance_status_distribution.values,
-                                     title='Maintenance Status Distribution',
-                                     color_discrete_sequence=px.colors.qualitative.Set2,
-                                     labels={'MaintenanceStatus': 'Count'},
-                                     hole=0.4),
-                              use_container_width=True)
-        abnormal_maintenance_costs = maintenance_history_data[maintenance_history_data['MaintenanceStatus'] == 'Abnormal']
-        chartcol.plotly_chart(px.bar(abnormal_maintenance_costs,
-                                     x='VehicleID',
-                                     y='Cost',
-                                     title='Abnormal Maintenance Costs by Vehicle',
-                                     color='MaintenanceType',
-                                     labels={'Cost': 'Total Cost (EGP)', 'VehicleID': 'Vehicle ID', 'MaintenanceType': 'Maintenance Type'},
-                                     color_discrete_sequence=px.colors.qualitative.Set2), text_auto=True,
-                              use_container_width=True)
+        with timer.span("Maintenance History"):
+            st.subheader("Maintenance History")
+            st.write("View maintenance history, focusing on repeated maintenance within a short period.")
+            # Replace with code to display maintenance history data with date filter
+            with timer.span("query"):
+                maintenance_history_data = data.maintenance_history(conn, start_date, end_date, filters)
+            datacol, chartcol = st.columns([2, 1])
+            datacol.dataframe(maintenance_history_data, use_container_width=True, hide_index=True)
+            # Maintenance status distribution pie chart
+            def maintenance_status_figure():
+                maintenance_status_distribution = maintenance_history_data['MaintenanceStatus'].value_counts()
+                return px.pie(maintenance_status_distribution,
+                              names=maintenance_status_distribution.index,
+                              values=maintenance_status_distribution.values,
+                              title='Maintenance Status Distribution',
+                              color_discrete_sequence=px.colors.qualitative.Set2,
+                              labels={'MaintenanceStatus': 'Count'},
+                              hole=0.4)
+            chartcol.plotly_chart(cached_figure('maintenance.status', chart_params, maintenance_status_figure), use_container_width=True)
+
+            def abnormal_costs_figure():
+                abnormal_maintenance_costs = reduce.top_n(maintenance_history_data[maintenance_history_data['MaintenanceStatus'] == 'Abnormal'],
+                                                          'VehicleID', 'Cost', reduce.budget('maintenance.abnormal'), by=['MaintenanceType'])
+                return px.bar(abnormal_maintenance_costs,
+                              x='VehicleID',
+                              y='Cost',
+                              title='Abnormal Maintenance Costs by Vehicle',
+                              color='MaintenanceType',
+                              labels={'Cost': 'Total Cost (EGP)', 'VehicleID': 'Vehicle ID', 'MaintenanceType': 'Maintenance Type'},
+                              color_discrete_sequence=px.colors.qualitative.Set2, text_auto=True)
+            chartcol.plotly_chart(cached_figure('maintenance.abnormal', chart_params, abnormal_costs_figure), use_container_width=True)
 
     elif report_option == "Traffic Penalties":
-        st.subheader("Traffic Penalties")
-        st.write("Explore traffic penalties recorded for each vehicle.")
-
-        # Query traffic penalties data
-        traffic_penalties_data = pd.read_sql_query(f'''
-                SELECT
-                    TP.PenaltyID AS "Penalty ID",
-                    TP.Date,
-                    TP.VehicleID AS "Vehicle ID",
-                    VB.VehicleType AS "Vehicle Type",
-                    VA.Agency,
-                    VA.Condition,  -- Assuming there is a "Condition" column in the VehicleAllocation table
-                    TP.Location,
-                    TP.Desc AS "Description",
-                    TP.Cost,
-                    TP.CompanyCode AS "Company Code"
-                FROM TrafficPen TP
-                LEFT JOIN (
-                    SELECT
-                        VA1.VehicleID,
-                        VA1.Agency,
-                        VA1.Condition,
-                        ROW_NUMBER() OVER (PARTITION BY VA1.VehicleID ORDER BY VA1.AllocationID DESC) AS row_num
-                    FROM VehicleAllocation VA1
-                ) VA ON TP.VehicleID = VA.VehicleID AND VA.row_num = 1
-                LEFT JOIN VehicleBasics VB ON TP.VehicleID = VB.VehicleID
-                WHERE TP.Date BETWEEN ? AND ? AND {where_clause_str};
-            ''', con=conn, params=(start_date, end_date))
-
-        # Remove duplications
-        traffic_penalties_data = traffic_penalties_data.drop_duplicates()
-
-        # Translate the "Desc" column
-        traffic_penalties_data["Description"] = traffic_penalties_data["Description"].map(translations)
-
-        # Display the total cost
-        st.write(f"The total cost for the selected period is: {traffic_penalties_data['Cost'].sum():,.0f} EGP")
-
-        # Display the traffic penalties data in a table
-        datacol, chartcol = st.columns([2, 1])
-        datacol.dataframe(traffic_penalties_data, use_container_width=True, hide_index=True)
-        # Display a horizontal bar chart for the total cost of traffic penalties by violation type
-        penalty_cost_distribution = traffic_penalties_data.groupby('Description')['Cost'].sum().reset_index().sort_values(by='Cost', ascending=True)
-
-        fig = px.bar(penalty_cost_distribution, y='Description', x='Cost', orientation='h',
-                     title='Total Penalty Cost by Violation Type',
-                     labels={'Cost': 'Total Cost (EGP)', 'Description': 'Violation Type'},
-                     text='Cost', height=700, width=800,
-                     color_discrete_sequence=px.colors.qualitative.Set1)
-
-        # Improve text formatting on bars
-        fig.update_traces(texttemplate='%{text:.2s}', textposition='auto')
-        fig.update_layout(uniformtext_minsize=8, uniformtext_mode='hide')
-
-        # Display the chart
-        chartcol.plotly_chart(fig, use_container_width=True, )
-
-        # Display a bar chart for the total cost of traffic penalties by vehicle and agency
-        penalty_cost_distribution = traffic_penalties_data.groupby(['Agency', 'Vehicle ID'])['Cost'].sum().reset_index()
-        chartcol.plotly_chart(px.bar(penalty_cost_distribution, x='Vehicle ID', y='Cost', color='Agency',
-                                     title='Total Penalty Cost by Vehicle and Agency',
-                                     labels={'Cost': 'Total Cost (EGP)', 'Vehicle ID': 'Vehicle ID'},
-                                     text='Cost', height=500, width=900,
-                                     color_discrete_sequence=px.colors.qualitative.Set2),
-                              use_container_width=True)
-
-        # Display a pie chart for the distribution of total penalty cost by agency
-        penalty_cost_distribution = traffic_penalties_data.groupby(['Agency'])['Cost'].sum().reset_index().sort_values(by='Cost', ascending=False)
-        chartcol.plotly_chart(px.pie(penalty_cost_distribution, names='Agency', values='Cost',
-                                     title='Total Penalty Cost Distribution by Agency',
-                                     labels={'Cost': 'Total Cost (EGP)', 'Agency': 'Agency'},
-                                     height=500,
-                                     color_discrete_sequence=px.colors.qualitative.Set3,
-                                     hole=0.4),
-                              use_container_width=True)
+        with timer.span("Traffic Penalties"):
+            st.subheader("Traffic Penalties")
+            st.write("Explore traffic penalties recorded for each vehicle.")
+
+            # Query traffic penalties data
+            with timer.span("query"):
+                traffic_penalties_data = data.traffic_penalties(conn, start_date, end_date, filters)
+
+            # Display the total cost
+            st.write(f"The total cost for the selected period is: {traffic_penalties_data['Cost'].sum():,.0f} EGP")
+
+            # Display the traffic penalties data in a table
+            datacol, chartcol = st.columns([2, 1])
+            datacol.dataframe(traffic_penalties_data, use_container_width=True, hide_index=True)
+            # Display a horizontal bar chart for the total cost of traffic penalties by violation type
+            def violation_type_figure():
+                # Grouped by the integer category; its label is only shown
+                labels = dict(zip(traffic_penalties_data['Category ID'], traffic_penalties_data['Description']))
+                penalty_cost_distribution = reduce.top_n(traffic_penalties_data, 'Category ID', 'Cost', reduce.budget('penalties.violation_type')).iloc[::-1]
+                penalty_cost_distribution['Description'] = penalty_cost_distribution['Category ID'].map(labels).fillna(reduce.OTHER)
+
+                fig = px.bar(penalty_cost_distribution, y='Description', x='Cost', orientation='h',
+                             title='Total Penalty Cost by Violation Type',
+                             labels={'Cost': 'Total Cost (EGP)', 'Description': 'Violation Type'},
+                             text='Cost', height=700, width=800,
+                             color_discrete_sequence=px.colors.qualitative.Set1)
+
+                # Improve text formatting on bars
+                fig.update_traces(texttemplate='%{text:.2s}', textposition='auto')
+                fig.update_layout(uniformtext_minsize=8, uniformtext_mode='hide')
+                return fig
+
+            # Display the chart
+            chartcol.plotly_chart(cached_figure('penalties.violation_type', chart_params, violation_type_figure), use_container_width=True, )
+
+            # Display a bar chart for the total cost of traffic penalties by vehicle and agency
+            def vehicle_agency_figure():
+                penalty_cost_distribution = reduce.top_n(traffic_penalties_data, 'Vehicle ID', 'Cost', reduce.budget('penalties.vehicle_agency'), by=['Agency'])
+                return px.bar(penalty_cost_distribution, x='Vehicle ID', y='Cost', color='Agency',
+                              title='Total Penalty Cost by Vehicle and Agency',
+                              labels={'Cost': 'Total Cost (EGP)', 'Vehicle ID': 'Vehicle ID'},
+                              text='Cost', height=500, width=900,
+                              color_discrete_sequence=px.colors.qualitative.Set2)
+            chartcol.plotly_chart(cached_figure('penalties.vehicle_agency', chart_params, vehicle_agency_figure), use_container_width=True)
+
+            # Display a pie chart for the distribution of total penalty cost by agency
+            def agency_figure():
+                penalty_cost_distribution = reduce.top_n(traffic_penalties_data, 'Agency', 'Cost', reduce.budget('penalties.agency'))
+                return px.pie(penalty_cost_distribution, names='Agency', values='Cost',
+                              title='Total Penalty Cost Distribution by Agency',
+                              labels={'Cost': 'Total Cost (EGP)', 'Agency': 'Agency'},
+                              height=500,
+                              color_discrete_sequence=px.colors.qualitative.Set3,
+                              hole=0.4)
+            chartcol.plotly_chart(cached_figure('penalties.agency', chart_params, agency_figure), use_container_width=True)
+
+            # Hotspots, from the weekly rollup per location and agency
+            with timer.span("hotspots"):
+                st.subheader("Penalty Hotspots")
+                st.caption("Weeks overlapping the selected period; only the agency filter applies.")
+
+                def top_locations_figure():
+                    top = hotspots.top_locations(conn, start_date, end_date, filters)
+                    return px.bar(top.sort_values('Cost'), y='Location', x='Cost', orientation='h',
+                                  title='Top Locations by Penalty Cost', text='Penalties',
+                                  labels={'Cost': 'Total Cost (EGP)', 'Penalties': 'Penalties'},
+                                  color_discrete_sequence=px.colors.qualitative.Set1)
+
+                def trend_figure():
+                    top = hotspots.top_locations(conn, start_date, end_date, filters, limit=5)
+                    trend = hotspots.weekly(conn, start_date, end_date, top['LocationKey'].tolist(), filters)
+                    trend = reduce.lttb(trend, 'Week', 'Penalties', reduce.budget('penalties.hotspot_trend', 'series'), by='Location')
+                    return px.line(trend, x='Week', y='Penalties', color='Location', markers=True,
+                                   title='Weekly Penalties at the Top 5 Locations',
+                                   color_discrete_sequence=px.colors.qualitative.Set2)
+
+                topcol, trendcol = st.columns(2)
+                topcol.plotly_chart(cached_figure('penalties.hotspots', chart_params, top_locations_figure), use_container_width=True)
+                trendcol.plotly_chart(cached_figure('penalties.hotspot_trend', chart_params, trend_figure), use_container_width=True)
+
+            # Descriptions that still need a category (python -m fleet.penalties --assign)
+            unknown = penalties.unknown_descriptions(conn)
+            if not unknown.empty:
+                with st.expander(f"Uncategorized Descriptions ({len(unknown)})"):
+                    st.dataframe(unknown, use_container_width=True, hide_index=True)
+                    st.dataframe(penalties.categories(conn), use_container_width=True, hide_index=True)
     elif report_option == "Fuel Fraud":
-        st.subheader("Fuel Fraud Report")
-        st.write(
-            "This report detects potential fuel fraud based on the last 4 fuelings for each vehicle. "
-            "It identifies vehicles that have exceeded 400 km per day in the last 4 fuelings."
-        )
-
-        # Query fuel data
-        fuel_data = fetch_fuel_data(conn, start_date, end_date, where_clause_str)
-
-        # Convert the "Date" column to datetime
-        fuel_data["Date"] = pd.to_datetime(fuel_data["Date"])
-
-        # Remove duplications
-        fuel_data = fuel_data.drop_duplicates()
-
-        # Display the fuel data in a table
-        st.subheader("Fuel Data Overview")
-        st.dataframe(fuel_data, use_container_width=True, hide_index=True)
-
-        # Detect potential fuel fraud
-        fraud_data = fuel_data.groupby("Vehicle ID").apply(lambda group: detect_fuel_fraud(group)).reset_index(drop=True)
-
-        # Display potential fuel fraud data
-        st.subheader("Potential Fuel Fraud")
-        st.write(
-            "The following table shows vehicles with potential fuel fraud (exceeded 400 km per day in the last 4 fuelings):"
-        )
-
-        # Enhance the display of the fraud_data table
-        st.dataframe(fraud_data.sort_values(by="Expected Kilometers",ascending=False), use_container_width=True, hide_index=True)
-
-def fetch_fuel_data(conn, start_date, end_date, where_clause_str):
-    query = f'''
-        SELECT
-            F.FuelID AS "Fuel ID",
-            F.Date as "Date",
-            F.VehicleID AS "Vehicle ID",
-            VB.VehicleType AS "Vehicle Type",
-            VA.Agency,
-            F.Amount AS "Fuel Amount (Liters)",
-            F.Cost AS "Fuel Cost (EGP)"
-        FROM Fuel F
-        LEFT JOIN VehicleBasics VB ON F.VehicleID = VB.VehicleID
-        LEFT JOIN (
-            SELECT
-                VA1.VehicleID,
-                VA1.Agency,
-                ROW_NUMBER() OVER (PARTITION BY VA1.VehicleID ORDER BY VA1.AllocationID DESC) AS row_num
-            FROM VehicleAllocation VA1
-        ) VA ON F.VehicleID = VA.VehicleID AND VA.row_num = 1
-        WHERE F.Date BETWEEN ? AND ? AND {where_clause_str}
-    '''
-    return pd.read_sql_query(query, con=conn, params=(start_date, end_date))
-
-def detect_fuel_fraud(group):
-    group = group.sort_values(by="Date", ascending=False).head(4)
-    group["Days"] = (group["Date"].max() - group["Date"]).dt.days
-    grouppp = group.groupby(['Vehicle ID', 'Vehicle Type', 'Agency']).agg({'Days': 'max', 'Fuel Amount (Liters)': 'sum'}).reset_index()
-    grouppp['Fuel Amount (Liters)'] -= group['Fuel Amount (Liters)'].iloc[0]
-    group = grouppp
-    group["Fuel Efficiency (km/l)"] = 8
-    group["Expected Kilometers"] = ((group["Fuel Efficiency (km/l)"] * group["Fuel Amount (Liters)"]) / group["Days"])
-    group.replace([np.inf, -np.inf], np.nan, inplace=True)
-    group["Exceeded 400 km per Day"] = group["Expected Kilometers"] > 400
-    group = group.loc[group['Exceeded 400 km per Day']]
-    return group[["Vehicle ID", "Vehicle Type", "Agency", "Days", "Fuel Amount (Liters)", "Fuel Efficiency (km/l)", "Expected Kilometers", "Exceeded 400 km per Day"]].sort_values(by="Expected Kilometers")
+        with timer.span("Fuel Fraud"):
+            st.subheader("Fuel Fraud Report")
+            st.write(
+                "This report detects potential fuel fraud based on the last 4 fuelings for each vehicle. "
+                "It identifies vehicles that have exceeded 400 km per day in the last 4 fuelings."
+            )
+
+            # Query fuel data
+            with timer.span("query"):
+                fuel_data = data.fuel_fraud_data(conn, start_date, end_date, filters)
+
+            # Display the fuel data in a table
+            st.subheader("Fuel Data Overview")
+            st.dataframe(fuel_data, use_container_width=True, hide_index=True)
+
+            # Detect potential fuel fraud
+            with timer.span("fraud detection"):
+                fraud_data = analytics.fuel_fraud(fuel_data)
+
+            # Display potential fuel fraud data
+            st.subheader("Potential Fuel Fraud")
+            st.write(
+                "The following table shows vehicles with potential fuel fraud (exceeded 400 km per day in the last 4 fuelings):"
+            )
+
+            # Enhance the display of the fraud_data table
+            st.dataframe(fraud_data.sort_values(by="Expected Kilometers",ascending=False), use_container_width=True, hide_index=True)
+
+    elif report_option == "Vehicle Timeline":
+        with timer.span("Vehicle Timeline"):
+            st.subheader("Vehicle Timeline")
+            st.write("Daily odometer, kilometers driven and fuel of one vehicle. Days between readings are interpolated.")
+            if search_value == "All":
+                st.info("Select a vehicle in 'Search by VehicleID' to see its timeline.")
+                return
+
+            with timer.span("query"):
+                vehicle_timeline = timeline.vehicle(conn, search_value, start_date, end_date)
+            if vehicle_timeline.empty:
+                st.info("No fuel or maintenance entries for this vehicle in the selected period.")
+                return
+
+            total_km = vehicle_timeline['Km'].sum()
+            total_liters = vehicle_timeline['Liters'].sum()
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Kilometers", f"{total_km:,.0f}")
+            col2.metric("Fuel (Liters)", f"{total_liters:,.0f}")
+            col3.metric("Fuel Efficiency (KM/L)", f"{total_km / total_liters:,.1f}" if total_liters else "-")
+            col4.metric("Fuel and Maintenance Cost", f"EGP {vehicle_timeline['FuelCost'].sum() + vehicle_timeline['MaintenanceCost'].sum():,.0f}")
+
+            def weekly_figure():
+                weekly = vehicle_timeline.resample('W', on='Day')[['Km', 'Liters']].sum().reset_index()
+                return px.bar(weekly, x='Day', y=['Km', 'Liters'], barmode='group', title='Weekly Kilometers and Fuel',
+                              color_discrete_sequence=['#E62129', '#7F7F7F'])
+
+            chartcol1, chartcol2 = st.columns(2)
+            chartcol1.plotly_chart(cached_figure('timeline.odometer', chart_params,
+                                                 lambda: px.line(reduce.lttb(vehicle_timeline, 'Day', 'Odometer', reduce.budget('timeline.odometer', 'series')),
+                                                                 x='Day', y='Odometer', title='Odometer',
+                                                                 color_discrete_sequence=['#E62129'])),
+                                   use_container_width=True)
+            chartcol2.plotly_chart(cached_figure('timeline.weekly', chart_params, weekly_figure), use_container_width=True)
+            st.dataframe(vehicle_timeline, use_container_width=True, hide_index=True)
+
+    elif report_option == "Utilization":
+        with timer.span("Utilization"):
+            st.subheader("Utilization")
+            st.write("Vehicles without a fueling or an odometer increase for a number of days, by agency and branch.")
+            idle_days = st.number_input("Idle for at least (days)", min_value=1, value=7, step=1)
+
+            with timer.span("query"):
+                utilization_data = activity.utilization(conn, idle_days, filters)
+                idle_data = activity.idle_vehicles(conn, idle_days, filters)
+
+            vehicles = utilization_data['Vehicles'].sum()
+            active = utilization_data['Active'].sum()
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Vehicles", f"{vehicles:,.0f}")
+            col2.metric("Active", f"{active:,.0f}")
+            col3.metric("Idle", f"{vehicles - active:,.0f}")
+            col4.metric("Utilization", f"{active / vehicles * 100:.1f}%" if vehicles else "-")
+
+            datacol, chartcol = st.columns([2, 1])
+            datacol.dataframe(utilization_data, use_container_width=True, hide_index=True)
+
+            def utilization_figure():
+                by_status = utilization_data.melt(id_vars='Agency', value_vars=['Active', 'Idle'], var_name='Status', value_name='Count')
+                by_agency = reduce.top_n(by_status, 'Agency', 'Count', reduce.budget('utilization.agency'), by=['Status'])
+                return px.bar(by_agency, x='Agency', y='Count', color='Status', title='Active and Idle Vehicles by Agency',
+                              color_discrete_sequence=['#E62129', '#7F7F7F'])
+            # Idleness also moves with the date
+            chartcol.plotly_chart(cached_figure('utilization.agency', dict(filters, idle_days=idle_days, day=alerts.today()), utilization_figure),
+                                  use_container_width=True)
+
+            st.subheader("Idle Vehicles")
+            st.dataframe(idle_data, use_container_width=True, hide_index=True)
+
+    elif report_option == "Due Soon":
+        with timer.span("Due Soon"):
+            st.subheader("Due Soon")
+            st.write("Vehicles whose next preventive maintenance (PM 10/20/30/40) is predicted soon, from their recent kilometers per day.")
+            horizon = st.number_input("Due within (days)", min_value=1, value=30, step=1)
+
+            with timer.span("query"):
+                due_data = forecast.due_soon(conn, horizon, filters)
+
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Due", f"{len(due_data):,.0f}")
+            col2.metric("Overdue", f"{(due_data['Days Left'] < 0).sum():,.0f}")
+            col3.metric("Due This Week", f"{due_data['Days Left'].between(0, 6).sum():,.0f}")
+
+            datacol, chartcol = st.columns([2, 1])
+            datacol.dataframe(due_data, use_container_width=True, hide_index=True)
+
+            def due_figure():
+                by_service = due_data['Next Service'].value_counts().rename('Vehicles').rename_axis('Next Service').reset_index()
+                return px.bar(by_service, x='Next Service', y='Vehicles', title='Due Services by Type', text_auto=True,
+                              color_discrete_sequence=px.colors.qualitative.Set1)
+            chartcol.plotly_chart(cached_figure('due_soon.service', dict(filters, horizon=horizon, day=alerts.today()), due_figure),
+                                  use_container_width=True)
+
+    elif report_option == "Cost per KM":
+        with timer.span("Cost per KM"):
+            st.subheader("Cost per KM")
+            st.write("Fuel, maintenance and traffic penalty cost per kilometer of each vehicle, over the months of the selected period.")
+
+            with timer.span("query"):
+                cost_data = ledger.cost_per_km(conn, start_date, end_date, filters)
+
+            total_km = cost_data['KM'].sum()
+            total_cost = cost_data['Total Cost'].sum()
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Total Cost", f"EGP {total_cost:,.0f}")
+            col2.metric("Total KM", f"{total_km:,.0f}")
+            col3.metric("Fleet Cost per KM", f"EGP {total_cost / total_km:.2f}" if total_km else "-")
+
+            datacol, chartcol = st.columns([2, 1])
+            datacol.dataframe(cost_data, use_container_width=True, hide_index=True)
+
+            def cost_per_km_figure():
+                top = cost_data.dropna(subset=['Cost per KM']).head(reduce.budget('cost_per_km.top'))
+                return px.bar(top, x='Vehicle ID', y='Cost per KM', color='Vehicle Type',
+                              title='Highest Cost per KM', hover_data=['Agency', 'KM', 'Total Cost'],
+                              color_discrete_sequence=px.colors.qualitative.Set2)
+            chartcol.plotly_chart(cached_figure('cost_per_km.top', chart_params, cost_per_km_figure), use_container_width=True)
+
+            if search_value != "All":
+                def monthly_figure():
+                    monthly = ledger.monthly(conn, search_value)
+                    return px.bar(monthly, x='Month', y=['Fuel Cost', 'Maintenance Cost', 'Penalty Cost'],
+                                  title=f'Monthly Cost of {search_value}',
+                                  color_discrete_sequence=px.colors.qualitative.Set1)
+                chartcol.plotly_chart(cached_figure('cost_per_km.monthly', {'vehicle_id': search_value}, monthly_figure),
+                                      use_container_width=True)
 
 # Main content
 def main():
     st.header("Welcome to J&T Fleet Management System")
     reports()
+    timing_panel(timer)
 
 
 if __name__ == '__main__':